@@ -2,18 +2,32 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import json
+import math
 import boto3
+import urllib3
 import os
 import uuid
 import time
+import hashlib
+import logging
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+from botocore.client import ClientError
+from .dataplane_storage import DataPlaneStorage, DataPlaneError, DecimalEncoder
 
 # Package for implementing operations for the AWS Media Analysis Solution
 
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
 class Status:
     WORKFLOW_STATUS_QUEUED = "Queued"
     WORKFLOW_STATUS_STARTED = "Started"
     WORKFLOW_STATUS_ERROR = "Error"
     WORKFLOW_STATUS_COMPLETE = "Complete"
+    WORKFLOW_STATUS_CANCELLED = "Cancelled"
+    WORKFLOW_STATUS_TIMED_OUT = "Timed Out"
 
     STAGE_STATUS_NOT_STARTED = "Not Started"
     STAGE_STATUS_STARTED = "Started"
@@ -29,6 +43,174 @@ class Status:
     OPERATION_STATUS_SKIPPED = "Skipped"
 
 
+def store_workflow_reference(bucket, key, value):
+    """Store a workflow value in S3 and return the location that replaces it in the workflow execution
+
+    :param bucket: S3 bucket to store the value in
+    :param key: S3 key to store the value under
+    :param value: JSON serializable value
+
+    :return: Dict with the S3Bucket and S3Key of the stored value
+    """
+    boto3.client('s3').put_object(Bucket=bucket, Key=key, Body=json.dumps(value, cls=DecimalEncoder))
+    return {"S3Bucket": bucket, "S3Key": key}
+
+
+def load_workflow_reference(location, parse_float=None):
+    """Load a workflow value stored by store_workflow_reference
+
+    :param location: Dict with the S3Bucket and S3Key of the stored value
+    :param parse_float: Optional function used to decode floats, e.g. Decimal for values written to DynamoDB
+
+    :return: The stored value
+    """
+    try:
+        obj = boto3.client('s3').get_object(Bucket=location["S3Bucket"], Key=location["S3Key"])
+    except ClientError as e:
+        raise MasExecutionError("Unable to load workflow value from s3://{bucket}/{key}: {e}".format(
+            bucket=location["S3Bucket"], key=location["S3Key"], e=e.response['Error']['Message']))
+    return json.loads(obj['Body'].read().decode('utf-8'), parse_float=parse_float)
+
+
+def result_cache_key(fingerprint, operation_name, configuration):
+    """Build the key of the result cache entry for an operation run on some media
+
+    The configuration is serialized with sorted keys and with numbers normalized, so the same configuration read
+    from DynamoDB (Decimal), from a request body (int or float) or from CloudFormation gets the same key.
+
+    :param fingerprint: Content fingerprint of the asset media, see create_asset in the dataplane api
+    :param operation_name: Name of the operation
+    :param configuration: Effective configuration of the operation in the workflow execution
+
+    :return: Hex SHA-256 digest identifying the cache entry
+    """
+    def normalize(value):
+        if isinstance(value, dict):
+            return dict((key, normalize(item)) for key, item in value.items())
+        if isinstance(value, list):
+            return [normalize(item) for item in value]
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, (int, float, Decimal)):
+            value = Decimal(str(value))
+            return int(value) if value == value.to_integral_value() else float(value)
+        return value
+
+    canonical = json.dumps(normalize(configuration), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256("{}/{}/{}".format(fingerprint, operation_name, canonical).encode('utf-8')).hexdigest()
+
+
+def process_image_sequence(sequence, operator_name, asset_id, workflow_id, process_image, max_workers=10):
+    """Run an operator on each image of an image sequence and store the results of each image as a page of the
+    operator's metadata
+
+    The images are processed concurrently.  The page of each image is numbered by the image's index in the sequence
+    and has an "Image" key with the Index, S3Bucket and S3Key of the image, the pages of images that failed have an
+    "Error" instead of the results.
+
+    :param sequence: Dict with the S3Bucket and S3Key of the image sequence manifest, see create_asset in the
+                     dataplane api
+    :param operator_name: The name of the operator that created the metadata
+    :param asset_id: The id of the asset
+    :param workflow_id: Workflow ID that generated the metadata
+    :param process_image: Function of the S3Bucket and S3Key of an image that returns its results as a dict,
+                          called from several threads at once
+    :param max_workers: Number of images processed at a time
+
+    :return: Dict with the number of "Images", the "Errors" of the images that failed and whether the pages were
+             "Stored", which needs every page to be stored
+    """
+    items = load_workflow_reference(sequence)["Items"]
+    if not items:
+        return {"Images": 0, "Errors": [], "Stored": True}
+
+    # A DataPlane is not thread safe, each worker has its own and takes every nth image
+    num_workers = min(len(items), max_workers)
+    dataplanes = [DataPlane() for worker in range(num_workers)]
+    stored = [True]
+
+    def process(index, dataplane, end=False):
+        item = items[index]
+        error = None
+        try:
+            page = dict(process_image(item["S3Bucket"], item["S3Key"]))
+        except Exception as e:
+            error = str(e)
+            page = {"Error": error}
+        page["Image"] = {"Index": index, "S3Bucket": item["S3Bucket"], "S3Key": item["S3Key"]}
+        metadata_upload = dataplane.store_asset_metadata(asset_id, operator_name, workflow_id, page, paginate=True,
+                                                         end=end, page=index)
+        if "Status" not in metadata_upload or metadata_upload["Status"] != "Success":
+            logger.error("Unable to upload metadata for image {index}: {e}".format(index=index, e=metadata_upload))
+            error = error or "Unable to upload metadata for image {index}".format(index=index)
+            if end:
+                # the pages are only listed in the operator's metadata once the last page is stored
+                stored[0] = False
+        return {"Index": index, "Message": error} if error else None
+
+    def process_worker(worker):
+        return [process(index, dataplanes[worker]) for index in range(worker, len(items) - 1, num_workers)]
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        outcomes = [outcome for worker_outcomes in executor.map(process_worker, range(num_workers)) for outcome in worker_outcomes]
+    # The last page ends the pagination once all the other pages are stored
+    outcomes.append(process(len(items) - 1, dataplanes[0], end=True))
+
+    return {"Images": len(items), "Errors": [outcome for outcome in outcomes if outcome is not None],
+            "Stored": stored[0]}
+
+
+class WorkflowReferenceDict(dict):
+    """Dict whose content is stored in S3 and only loaded the first time it is read
+
+    Workflow executions store MetaData that is too large for the workflow execution item or the Step Functions
+    payload in S3 and pass its location in a sibling "MetaDataLocation" key instead.
+    """
+    def __init__(self, location):
+        super(WorkflowReferenceDict, self).__init__()
+        self.location = location
+        self.loaded = False
+
+    def load(self):
+        if not self.loaded:
+            self.loaded = True
+            logger.info("Loading workflow value from s3://{bucket}/{key}".format(
+                bucket=self.location["S3Bucket"], key=self.location["S3Key"]))
+            self.update(load_workflow_reference(self.location))
+
+    def __getitem__(self, key):
+        self.load()
+        return super(WorkflowReferenceDict, self).__getitem__(key)
+
+    def __contains__(self, key):
+        self.load()
+        return super(WorkflowReferenceDict, self).__contains__(key)
+
+    def __iter__(self):
+        self.load()
+        return super(WorkflowReferenceDict, self).__iter__()
+
+    def __len__(self):
+        self.load()
+        return super(WorkflowReferenceDict, self).__len__()
+
+    def get(self, key, default=None):
+        self.load()
+        return super(WorkflowReferenceDict, self).get(key, default)
+
+    def keys(self):
+        self.load()
+        return super(WorkflowReferenceDict, self).keys()
+
+    def values(self):
+        self.load()
+        return super(WorkflowReferenceDict, self).values()
+
+    def items(self):
+        self.load()
+        return super(WorkflowReferenceDict, self).items()
+
+
 class MediaInsightsOperationHelper:
     """Helper class to work with input and output passed between MIE operators in a workflow."""
     def __init__(self, event):
@@ -40,7 +222,14 @@ class MediaInsightsOperationHelper:
         self.name = event["Name"]
         self.asset_id = event["AssetId"]
         self.workflow_execution_id = event["WorkflowExecutionId"]
-        self.input = event["Input"]
+        # Workflow metadata stored in S3 is only loaded if the operator reads it, the output passes the
+        # reference on unchanged
+        self.input_reference = event["Input"]
+        if "MetaDataLocation" in event["Input"]:
+            self.input = dict(event["Input"])
+            self.input["MetaData"] = WorkflowReferenceDict(event["Input"]["MetaDataLocation"])
+        else:
+            self.input = event["Input"]
         self.configuration = event["Configuration"]
         self.status = event["Status"]
         if "MetaData" in event:
@@ -61,7 +250,7 @@ class MediaInsightsOperationHelper:
 
         :return: Dict of the output object
         """
-        return {"Name": self.name, "AssetId": self.asset_id, "WorkflowExecutionId": self.workflow_execution_id,  "Input": self.input, "Configuration": self.configuration, "Status": self.status, "MetaData": self.metadata, "Media": self.media}
+        return {"Name": self.name, "AssetId": self.asset_id, "WorkflowExecutionId": self.workflow_execution_id,  "Input": self.input_reference, "Configuration": self.configuration, "Status": self.status, "MetaData": self.metadata, "Media": self.media}
 
     def update_workflow_status(self, status):
         """ Method to update the status of the output object
@@ -80,6 +269,16 @@ class MediaInsightsOperationHelper:
             # TODO: Add validation here to check if item exists
             self.metadata.update({key: value})
 
+    def add_expected_duration(self, seconds):
+        """ Method to report how long the job of an async operator is expected to take
+
+        The operation state machine waits for the estimate before the first poll of the monitor lambda.
+
+        :param seconds: Estimated job duration in seconds
+        :return: Nothing
+        """
+        self.metadata.update({"ExpectedDurationSeconds": max(0, int(math.ceil(seconds)))})
+
     def add_workflow_metadata_json(self, json_metadata):
         """ Method to update the metadata key of the output object
 
@@ -158,10 +357,29 @@ class MasExecutionError(Exception):
 
 
 class DataPlane:
-    """Helper Class for interacting with the dataplane"""
+    """Helper Class for interacting with the dataplane
+
+    By default each call is sent to the dataplane api lambda. Setting the DATAPLANE_MODE environment variable to
+    "library" performs the same S3 and DynamoDB operations inside the calling lambda instead, through the
+    DataPlaneStorage the dataplane api uses.  This requires the DATAPLANE_BUCKET and DATAPLANE_TABLE_NAME environment
+    variables and access to both resources.
+    """
+
+    base_s3_uri = DataPlaneStorage.base_s3_uri
 
     def __init__(self):
-        self.dataplane_function_name = os.environ["DataplaneEndpoint"]
+        # Results are exchanged through S3 instead of inline when the encoded lambda invoke payload would be larger
+        # than this many bytes.  A synchronous invoke payload is limited to 6 MB.
+        if "DATAPLANE_CLAIM_CHECK_THRESHOLD" in os.environ:
+            self.claim_check_threshold = int(os.environ["DATAPLANE_CLAIM_CHECK_THRESHOLD"])
+        else:
+            self.claim_check_threshold = 6000000
+        if "DATAPLANE_MODE" in os.environ and os.environ["DATAPLANE_MODE"] == "library":
+            self.library_mode = True
+            self.storage = DataPlaneStorage(os.environ["DATAPLANE_BUCKET"], os.environ["DATAPLANE_TABLE_NAME"])
+        else:
+            self.library_mode = False
+            self.dataplane_function_name = os.environ["DataplaneEndpoint"]
         self.lambda_client = boto3.client('lambda')
         self.lambda_invoke_object = {
             # some api uri
@@ -196,6 +414,29 @@ class DataPlane:
         }
 
     def call_dataplane(self, path, resource, method, body=None, path_params=None, query_params=None):
+        if self.library_mode:
+            return self.call_dataplane_library(resource, method, body, path_params, query_params)
+
+        request_object = self.encode_dataplane_request(path, resource, method, body, path_params, query_params)
+
+        invoke_request = self.lambda_client.invoke(
+            FunctionName=self.dataplane_function_name,
+            InvocationType='RequestResponse',
+            LogType='None',
+            Payload=bytes(request_object, encoding='utf-8')
+        )
+
+        response = invoke_request["Payload"].read().decode('utf-8')
+
+        # TODO: Do we want to do any validation on the status code or let clients parse the response as needed?
+        dataplane_response = json.loads(response)
+        return json.loads(dataplane_response["body"])
+
+    def encode_dataplane_request(self, path, resource, method, body=None, path_params=None, query_params=None):
+        """
+        Encode a request to the dataplane api lambda as the payload of its invocation.  The body is encoded on
+        its own and then again as a string of the API Gateway proxy event.
+        """
         encoded_body = json.dumps(body)
 
         self.lambda_invoke_object["resource"] = resource
@@ -215,20 +456,31 @@ class DataPlane:
         self.lambda_invoke_object["requestContext"]["requestId"] = 'lambda_' + str(uuid.uuid4()).split('-')[-1]
         self.lambda_invoke_object["requestContext"]["requestTime"] = time.time()
 
-        request_object = json.dumps(self.lambda_invoke_object)
-
-        invoke_request = self.lambda_client.invoke(
-            FunctionName=self.dataplane_function_name,
-            InvocationType='RequestResponse',
-            LogType='None',
-            Payload=bytes(request_object, encoding='utf-8')
-        )
-
-        response = invoke_request["Payload"].read().decode('utf-8')
-
-        # TODO: Do we want to do any validation on the status code or let clients parse the response as needed?
-        dataplane_response = json.loads(response)
-        return json.loads(dataplane_response["body"])
+        return json.dumps(self.lambda_invoke_object)
+
+    def call_dataplane_library(self, resource, method, body=None, path_params=None, query_params=None):
+        """Run a dataplane api call with the DataPlaneStorage, returning what the dataplane api would"""
+        try:
+            if (resource, method) == ("/create", "POST"):
+                if isinstance(body.get('Input'), dict) and ('Items' in body['Input'] or 'S3Prefix' in body['Input']):
+                    return self.storage.create_image_sequence_asset(body['Input'])
+                try:
+                    return self.storage.create_asset(body['Input']['S3Bucket'], body['Input']['S3Key'])
+                except KeyError as e:
+                    raise DataPlaneError("BadRequestError", "Missing required inputs for asset creation: {e}".format(e=e))
+            elif (resource, method) == ("/metadata/{asset_id}", "POST"):
+                paginated, end_pagination, page = self.storage.parse_metadata_query(query_params)
+                return self.storage.store_asset_metadata(path_params["asset_id"], body, paginated, end_pagination, page)
+            elif (resource, method) == ("/metadata/{asset_id}", "GET"):
+                cursor = query_params["cursor"] if query_params is not None else None
+                return self.storage.get_asset_metadata(path_params["asset_id"], cursor)[0]
+            elif (resource, method) == ("/mediapath/{asset_id}/{workflow_id}", "GET"):
+                return self.storage.media_storage_path(path_params["asset_id"], path_params["workflow_id"])
+        except DataPlaneError as e:
+            logger.error("Dataplane error: {e}".format(e=e.message))
+            return {"Code": e.code, "Message": "{code}: {message}".format(code=e.code, message=e.message)}
+        return {"Code": "NotFoundError", "Message": "NotFoundError: Unsupported dataplane call: {method} {resource}".format(
+            method=method, resource=resource)}
 
     def create_asset(self, s3bucket, s3key):
         """
@@ -246,7 +498,28 @@ class DataPlane:
         dataplane_response = self.call_dataplane(path, resource, method, body)
         return dataplane_response
 
-    def store_asset_metadata(self, asset_id, operator_name, workflow_id, results, paginate=False, end=False):
+    def create_image_sequence_asset(self, items=None, s3bucket=None, s3prefix=None):
+        """
+        Method to create an image sequence asset in the dataplane, from a list of images or from the images under
+        an S3 prefix
+
+        :param items: List of dicts with the S3Bucket and S3Key of each image
+        :param s3bucket: S3 Bucket of the images, when they are listed from a prefix
+        :param s3prefix: S3 prefix of the images
+
+        :return: Dataplane response
+        """
+        path = "/create"
+        resource = "/create"
+        method = "POST"
+        if items is not None:
+            body = {"Input": {"Items": items}}
+        else:
+            body = {"Input": {"S3Bucket": s3bucket, "S3Prefix": s3prefix}}
+        dataplane_response = self.call_dataplane(path, resource, method, body)
+        return dataplane_response
+
+    def store_asset_metadata(self, asset_id, operator_name, workflow_id, results, paginate=False, end=False, page=None):
         """
         Method to store asset metadata in the dataplane
 
@@ -258,6 +531,9 @@ class DataPlane:
         Pagination params:
         :param paginate: Boolean to tell dataplane that the results will come in as pages
         :param end: Boolean to declare the last page in a set of paginated results
+        :param page: Number of the page, starting at 0. Numbered pages can be stored again, such as when the
+                     operator is retried, without being duplicated. Pages without a number are numbered in the
+                     order the dataplane receives them.
 
         :return: Dataplane response
 
@@ -276,9 +552,24 @@ class DataPlane:
                 query_params["paginated"] = "true"
             if end is True:
                 query_params["end"] = "true"
+            if page is not None:
+                query_params["page"] = str(page)
         else:
             query_params = None
 
+        # Spill results that would not fit in the lambda invoke payload to S3 and pass a reference instead
+        if not self.library_mode and "DATAPLANE_BUCKET" in os.environ:
+            payload = self.encode_dataplane_request(path, resource, method, body, path_params, query_params)
+            if len(payload.encode('utf-8')) > self.claim_check_threshold:
+                claim_check_key = self.base_s3_uri + asset_id + '/workflows/' + workflow_id + '/claimcheck/' + \
+                    str(uuid.uuid4()) + '.json'
+                boto3.client('s3').put_object(Bucket=os.environ["DATAPLANE_BUCKET"], Key=claim_check_key,
+                                              Body=json.dumps(results))
+                logger.info("Dataplane request exceeds {threshold} bytes, passing the results through {key}".format(
+                    threshold=self.claim_check_threshold, key=claim_check_key))
+                del body["Results"]
+                body["ResultsLocation"] = {"S3Bucket": os.environ["DATAPLANE_BUCKET"], "S3Key": claim_check_key}
+
         dataplane_response = self.call_dataplane(path, resource, method, body, path_params, query_params)
         return dataplane_response
 
@@ -311,6 +602,16 @@ class DataPlane:
 
         dataplane_response = self.call_dataplane(path, resource, method, None, path_params, query_params)
 
+        # Pages too large to return inline come back as a presigned url, fetch them so callers see the same shape
+        if "results_url" in dataplane_response:
+            http = urllib3.PoolManager()
+            page = http.request('GET', dataplane_response["results_url"])
+            if page.status != 200:
+                raise MasExecutionError("Unable to retrieve metadata page from the dataplane: {status}".format(
+                    status=page.status))
+            dataplane_response["results"] = json.loads(page.data.decode('utf-8'))
+            del dataplane_response["results_url"]
+
         return dataplane_response
 
     def generate_media_storage_path(self, asset_id, workflow_id):
@@ -0,0 +1,611 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import os
+import uuid
+import base64
+import hashlib
+import logging
+import datetime
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.client import ClientError
+
+# Storage of dataplane assets and their metadata in S3 and DynamoDB.  The dataplane api serves these operations
+# over http and the DataPlane helper runs them inside the calling lambda in library mode, both use this module so
+# they store and read assets the same way.
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class DataPlaneError(Exception):
+    """Error raised by the dataplane storage, its code names the chalice error the dataplane api returns for it"""
+    def __init__(self, code, message):
+        super(DataPlaneError, self).__init__(message)
+        self.code = code
+        self.message = message
+
+
+class DecimalEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, Decimal):
+            return str(obj)
+        return json.JSONEncoder.default(self, obj)
+
+
+class DataPlaneStorage:
+    """Assets and metadata stored in the dataplane bucket and table
+
+    Methods raise DataPlaneError with the code of the chalice error ("BadRequestError", "NotFoundError" or
+    "ChaliceViewError") that the dataplane api returns for the failure.
+    """
+
+    base_s3_uri = 'private/assets/'
+    manifest_file_name = 'manifest.json'
+    # Attributes of an asset item that are not operator metadata pointers
+    global_attributes = ['S3Key', 'S3Bucket', 'AssetId', 'Created', 'Fingerprint', 'MediaType']
+    # Attributes of an asset item the dataplane keeps for itself, they are neither returned nor operator metadata
+    internal_attributes = ['PageCounters']
+
+    # An image sequence asset holds a set of images, such as the frames or photos of a batch, that one workflow
+    # execution processes together.  The images are copied to the asset's input folder and listed, in order,
+    # in an image sequence manifest that is the asset's media object.
+    image_sequence_media_type = 'ImageSequence'
+    image_sequence_file_name = 'image-sequence.json'
+    image_sequence_image_types = ['.png', '.jpg', '.jpeg']
+    image_sequence_max_items = 1000
+    image_sequence_copy_workers = 20
+
+    def __init__(self, bucket, table_name):
+        """
+        :param bucket: The dataplane bucket
+        :param table_name: The dataplane table
+        """
+        self.bucket = bucket
+        self.table_name = table_name
+        self.s3_client = boto3.client('s3')
+        self.dynamo_resource = boto3.resource('dynamodb')
+
+    # Request parameters
+
+    @staticmethod
+    def parse_metadata_query(query_params):
+        """
+        Read the pagination query params of a put metadata request
+
+        :return: Tuple of whether the results are a page, whether they are the last page and the number of the page
+                 or None when the caller did not number it
+        """
+        paginated = False
+        end_pagination = False
+        page = None
+        if query_params is not None:
+            if "paginated" not in query_params:
+                raise DataPlaneError("BadRequestError", "Must pass required query parameter: paginated")
+            paginated = query_params["paginated"] == "true"
+        if paginated and "end" in query_params:
+            if query_params["end"] != "true":
+                raise DataPlaneError("BadRequestError", "Query param end only supports a value of: true")
+            end_pagination = True
+        if paginated and "page" in query_params:
+            if not query_params["page"].isdigit():
+                raise DataPlaneError("BadRequestError", "Query param page must be a non-negative integer")
+            page = int(query_params["page"])
+        return paginated, end_pagination, page
+
+    @staticmethod
+    def encode_cursor(cursor):
+        cursor = json.dumps(cursor)
+        return base64.urlsafe_b64encode(cursor.encode('UTF-8')).decode('ascii')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            return json.loads(base64.urlsafe_b64decode(cursor).decode('utf-8'))
+        except (ValueError, TypeError) as e:
+            raise DataPlaneError("BadRequestError", "Invalid cursor: {e}".format(e=e))
+
+    @staticmethod
+    def cursor_entry(entry):
+        """
+        Read the {"operator", "pointer"} of a cursor entry.  Cursors issued by earlier versions of the dataplane
+        name the operator by key instead, {operator_name: pointer}, next to the "page" (and "locator") of "next".
+        """
+        if "operator" in entry:
+            return {"operator": entry["operator"], "pointer": entry["pointer"]}
+        operators = [key for key in entry.keys() if key not in ["page", "locator"]]
+        if len(operators) != 1:
+            raise KeyError("operator")
+        return {"operator": operators[0], "pointer": entry[operators[0]]}
+
+    @classmethod
+    def is_metadata_manifest(cls, key):
+        return key.endswith('/' + cls.manifest_file_name)
+
+    # S3 and DynamoDB access
+
+    def write_metadata_to_s3(self, key, data):
+        try:
+            self.s3_client.put_object(Bucket=self.bucket, Key=key, Body=json.dumps(data, cls=DecimalEncoder))
+        except ClientError as e:
+            error = e.response['Error']['Message']
+            logger.error("Exception occurred while writing asset metadata to s3: {e}".format(e=error))
+            raise DataPlaneError("ChaliceViewError", "Exception occurred while writing metadata to s3: {e}".format(e=error))
+
+    def read_metadata_from_s3(self, key, parse_float=None):
+        try:
+            obj = self.s3_client.get_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            error = e.response['Error']['Message']
+            logger.error("Exception occurred while reading asset metadata from s3: {e}".format(e=error))
+            raise DataPlaneError("ChaliceViewError", "Unable to retrieve metadata: {e}".format(e=error))
+        return json.loads(obj['Body'].read().decode('utf-8'), parse_float=parse_float)
+
+    def list_metadata_pages(self, metadata_prefix, last_page):
+        """
+        List the pages 0 to last_page stored under a metadata prefix, in page order
+
+        Page objects that are not numbered, or numbered past the last page, are left out of the listing.
+        """
+        pages = {}
+        try:
+            paginator = self.s3_client.get_paginator('list_objects_v2')
+            for response in paginator.paginate(Bucket=self.bucket, Prefix=metadata_prefix + 'pages/'):
+                for obj in response.get('Contents', []):
+                    page_name = os.path.splitext(os.path.basename(obj['Key']))[0]
+                    if page_name.isdigit() and int(page_name) <= last_page:
+                        pages[int(page_name)] = {"Key": obj['Key'], "Size": obj['Size']}
+        except ClientError as e:
+            error = e.response['Error']['Message']
+            logger.error("Exception occurred while listing metadata pages in s3: {e}".format(e=error))
+            raise DataPlaneError("ChaliceViewError", "Exception occurred while listing metadata in s3: {e}".format(e=error))
+        missing = [page for page in range(last_page + 1) if page not in pages]
+        if missing:
+            raise DataPlaneError("ChaliceViewError", "Unable to complete paginated metadata, missing pages: {pages}".format(
+                pages=missing))
+        return [pages[page] for page in range(last_page + 1)]
+
+    def list_metadata_page_keys(self, asset_id, operator_name=None):
+        """
+        List every metadata page object of an asset, or of one operator of the asset
+
+        Pages are listed by prefix rather than from the manifests, so the pages of sessions that never stored their
+        final page and pages numbered past the final page are listed too.
+        """
+        workflows_prefix = self.base_s3_uri + asset_id + '/workflows/'
+        keys = []
+        try:
+            paginator = self.s3_client.get_paginator('list_objects_v2')
+            for response in paginator.paginate(Bucket=self.bucket, Prefix=workflows_prefix):
+                for obj in response.get('Contents', []):
+                    # workflows/{workflow_id}/{operator_name}/pages/{page}.json
+                    parts = obj['Key'][len(workflows_prefix):].split('/')
+                    if len(parts) == 4 and parts[2] == 'pages' and (operator_name is None or parts[1] == operator_name):
+                        keys.append(obj['Key'])
+        except ClientError as e:
+            error = e.response['Error']['Message']
+            logger.error("Exception occurred while listing metadata pages in s3: {e}".format(e=error))
+            raise DataPlaneError("ChaliceViewError", "Exception occurred while listing metadata in s3: {e}".format(e=error))
+        return keys
+
+    def get_asset_item(self, asset_id, attribute=None):
+        params = {"Key": {"AssetId": asset_id}}
+        if attribute is not None:
+            params["ProjectionExpression"] = "#attr"
+            params["ExpressionAttributeNames"] = {"#attr": attribute}
+        try:
+            response = self.dynamo_resource.Table(self.table_name).get_item(**params)
+        except ClientError as e:
+            error = e.response['Error']['Message']
+            logger.error("Exception occurred while retrieving asset {asset}: {e}".format(asset=asset_id, e=error))
+            raise DataPlaneError("ChaliceViewError", "Unable to retrieve asset: {e}".format(e=error))
+        if 'Item' not in response:
+            raise DataPlaneError("NotFoundError", "Asset {asset} does not exist".format(asset=asset_id))
+        return response['Item']
+
+    def put_asset_item(self, item):
+        try:
+            self.dynamo_resource.Table(self.table_name).put_item(Item=item)
+        except ClientError as e:
+            error = e.response['Error']['Message']
+            logger.error("Exception occurred during asset creation: {e}".format(e=error))
+            raise DataPlaneError("ChaliceViewError", "Unable to create asset item in dynamo: {e}".format(e=error))
+
+    def next_page_number(self, asset_id, session):
+        """
+        Take the next page number of a paginated results session from the counter kept on the asset item
+
+        Used for pages stored without a page number, the counter is removed once the session's last page is stored.
+        """
+        table = self.dynamo_resource.Table(self.table_name)
+        try:
+            # Nested map attributes can only be set once their parent map exists
+            table.update_item(
+                Key={"AssetId": asset_id},
+                UpdateExpression="SET #counters = if_not_exists(#counters, :empty)",
+                ConditionExpression="attribute_exists(AssetId)",
+                ExpressionAttributeNames={"#counters": "PageCounters"},
+                ExpressionAttributeValues={":empty": {}}
+            )
+            response = table.update_item(
+                Key={"AssetId": asset_id},
+                UpdateExpression="SET #counters.#session = if_not_exists(#counters.#session, :zero) + :one",
+                ExpressionAttributeNames={"#counters": "PageCounters", "#session": session},
+                ExpressionAttributeValues={":zero": 0, ":one": 1},
+                ReturnValues="UPDATED_NEW"
+            )
+        except ClientError as e:
+            error = e.response['Error']['Message']
+            logger.error("Exception occurred while numbering metadata page for {asset}: {e}".format(asset=asset_id, e=error))
+            raise DataPlaneError("ChaliceViewError", "Unable to number metadata page: {e}".format(e=error))
+        return int(response["Attributes"]["PageCounters"][session]) - 1
+
+    # Assets
+
+    def media_storage_path(self, asset_id, workflow_id):
+        return {
+            "S3Bucket": self.bucket,
+            "S3Key": self.base_s3_uri + asset_id + "/workflows/" + workflow_id + "/"
+        }
+
+    def create_asset(self, source_bucket, source_key):
+        """
+        Create an asset, copying its media object to the dataplane bucket
+
+        :return: Dict with the AssetId, the S3Bucket and S3Key of the media in the dataplane and its Fingerprint,
+                 when the content of the media could be fingerprinted, see copy_fingerprint
+        """
+        asset_id = str(uuid.uuid4())
+        directory = self.base_s3_uri + asset_id + "/"
+        new_key = directory + 'input' + '/' + source_key
+        logger.info("Creating an asset from: {bucket}/{key}".format(bucket=source_bucket, key=source_key))
+
+        try:
+            self.s3_client.put_object(Bucket=self.bucket, Key=directory)
+            response = self.copy_media(source_bucket, source_key, new_key)
+        except ClientError as e:
+            error = e.response['Error']['Message']
+            logger.error("Exception occurred during asset creation: {e}".format(e=error))
+            raise DataPlaneError("ChaliceViewError", "Unable to copy input media to the dataplane bucket: {e}".format(e=error))
+        logger.info("Copied input media into dataplane bucket: {key}".format(key=new_key))
+
+        # fingerprint the media content so the workflow api can reuse results computed for identical media
+        fingerprint = self.copy_fingerprint(response)
+
+        asset = {"AssetId": asset_id, "S3Bucket": self.bucket, "S3Key": new_key}
+        if fingerprint is not None:
+            asset["Fingerprint"] = fingerprint
+        self.put_asset_item(dict(asset, Created=str(datetime.datetime.now().timestamp())))
+        logger.info("Completed asset creation for asset: {asset}".format(asset=asset_id))
+        return asset
+
+    def create_image_sequence_asset(self, sequence):
+        """
+        Create an image sequence asset, copying the images to the asset and listing them in its manifest
+
+        :param sequence: Dict with the "Items" of the sequence, each with an S3Bucket and S3Key, or with the
+                         S3Bucket and S3Prefix of its images
+        :return: Dict with the AssetId, the S3Bucket and S3Key of the image sequence manifest, the MediaType and the
+                 Fingerprint of the images, when each of them could be fingerprinted
+        """
+        if 'Items' in sequence:
+            items = sequence['Items']
+            if not isinstance(items, list) or not all(isinstance(item, dict) and 'S3Bucket' in item and 'S3Key' in item for item in items):
+                raise DataPlaneError("BadRequestError", "Items must be a list of objects with an S3Bucket and an S3Key")
+        else:
+            try:
+                source_bucket = sequence['S3Bucket']
+                source_prefix = sequence['S3Prefix']
+            except KeyError as e:
+                raise DataPlaneError("BadRequestError", "Missing required inputs for asset creation: {e}".format(e=e))
+            items = []
+            try:
+                paginator = self.s3_client.get_paginator('list_objects_v2')
+                for response in paginator.paginate(Bucket=source_bucket, Prefix=source_prefix):
+                    for obj in response.get('Contents', []):
+                        if os.path.splitext(obj['Key'])[1].lower() in self.image_sequence_image_types:
+                            items.append({"S3Bucket": source_bucket, "S3Key": obj['Key']})
+                    if len(items) > self.image_sequence_max_items:
+                        break
+            except ClientError as e:
+                error = e.response['Error']['Message']
+                logger.error("Exception occurred while listing {prefix}: {e}".format(prefix=source_prefix, e=error))
+                raise DataPlaneError("ChaliceViewError", "Unable to list the images of the image sequence: {e}".format(e=error))
+
+        if not items:
+            raise DataPlaneError("BadRequestError", "The image sequence has no images")
+        if len(items) > self.image_sequence_max_items:
+            raise DataPlaneError("BadRequestError", "An image sequence can have at most {max} images".format(
+                max=self.image_sequence_max_items))
+
+        asset_id = str(uuid.uuid4())
+        directory = self.base_s3_uri + asset_id + "/"
+        logger.info("Creating an image sequence asset {asset} from {count} images".format(asset=asset_id, count=len(items)))
+
+        def copy_image(item):
+            new_key = directory + 'input' + '/' + item['S3Key']
+            response = self.copy_media(item['S3Bucket'], item['S3Key'], new_key)
+            return {"S3Bucket": self.bucket, "S3Key": new_key}, self.copy_fingerprint(response)
+
+        try:
+            self.s3_client.put_object(Bucket=self.bucket, Key=directory)
+            with ThreadPoolExecutor(max_workers=min(len(items), self.image_sequence_copy_workers)) as executor:
+                copies = list(executor.map(copy_image, items))
+        except ClientError as e:
+            error = e.response['Error']['Message']
+            logger.error("Exception occurred during asset creation: {e}".format(e=error))
+            raise DataPlaneError("ChaliceViewError", "Unable to copy the images to the dataplane bucket: {e}".format(e=error))
+        logger.info("Copied {count} images into dataplane bucket".format(count=len(copies)))
+
+        manifest_key = directory + 'input' + '/' + self.image_sequence_file_name
+        self.write_metadata_to_s3(manifest_key, {"Items": [copy[0] for copy in copies]})
+
+        asset = {"AssetId": asset_id, "S3Bucket": self.bucket, "S3Key": manifest_key,
+                 "MediaType": self.image_sequence_media_type}
+        image_fingerprints = [copy[1] for copy in copies]
+        if None not in image_fingerprints:
+            # the fingerprint of the sequence covers the content and order of its images
+            asset["Fingerprint"] = "{digest}:{count}".format(
+                digest=hashlib.sha256("\n".join(image_fingerprints).encode('utf-8')).hexdigest(), count=len(copies))
+        else:
+            logger.info("Not fingerprinting asset {asset}, some of its images have no content digest".format(asset=asset_id))
+
+        self.put_asset_item(dict(asset, Created=str(datetime.datetime.now().timestamp())))
+        logger.info("Completed asset creation for asset: {asset}".format(asset=asset_id))
+        return asset
+
+    def copy_checksums_supported(self):
+        # CopyObject only takes a ChecksumAlgorithm in versions of boto3 released since S3 added additional checksums
+        return 'ChecksumAlgorithm' in self.s3_client.meta.service_model.operation_model('CopyObject').input_shape.members
+
+    def copy_media(self, source_bucket, source_key, key):
+        """Copy a media object to the dataplane bucket, computing a SHA-256 checksum of its content when S3 supports it"""
+        params = {
+            "Bucket": self.bucket,
+            "Key": key,
+            "CopySource": {'Bucket': source_bucket, 'Key': source_key}
+        }
+        if self.copy_checksums_supported():
+            params["ChecksumAlgorithm"] = "SHA256"
+        return self.s3_client.copy_object(**params)
+
+    @staticmethod
+    def copy_fingerprint(response):
+        """
+        Build a content fingerprint of a media object from the response of the copy_media call that stored it
+
+        The fingerprint is the SHA-256 checksum S3 computed over the content of the copy.  Without a checksum, the ETag
+        is used when it is the MD5 digest of the content, which is the case for objects stored in a single request
+        with no or SSE-S3 encryption.  The ETag of multipart objects, which contains a '-', and of SSE-KMS or SSE-C
+        encrypted objects is not derived from the content alone, so these objects have no fingerprint.
+
+        :return: A string in the form "sha256:{checksum}" or "md5:{etag}", or None when the content has no digest
+        """
+        copy_result = response['CopyObjectResult']
+        checksum = copy_result.get('ChecksumSHA256')
+        if checksum and '-' not in checksum:
+            return "sha256:{checksum}".format(checksum=checksum)
+        etag = copy_result['ETag'].strip('"')
+        if '-' in etag or response.get('ServerSideEncryption') == 'aws:kms' or 'SSECustomerAlgorithm' in response:
+            return None
+        return "md5:{etag}".format(etag=etag)
+
+    # Metadata
+
+    def store_asset_metadata(self, asset_id, body, paginated=False, end_pagination=False, page=None):
+        """
+        Store operator metadata for an asset
+
+        Each page of paginated results is stored as its own S3 object named by its page number, and the final page
+        writes a manifest listing the pages 0 to its own number.  The pointer for paginated results references the
+        manifest.  Pages stored without a number are numbered in the order they are received.
+
+        :param asset_id: The id of the asset
+        :param body: Dict with the OperatorName, WorkflowId and the Results, or the ResultsLocation of results staged
+                     in the dataplane bucket, which is removed once the results are stored
+        :param paginated: Whether the results are a page of paginated results
+        :param end_pagination: Whether the results are the last page
+        :param page: The number of the page, starting at 0, or None to number it in the order it is received
+        :return: Dict with the Status, and the Bucket and Key of the metadata once the pointer is updated
+        """
+        claim_check_key = None
+        try:
+            operator_name = body['OperatorName']
+            workflow_id = body['WorkflowId']
+            if 'Results' not in body and 'ResultsLocation' in body:
+                # Results too large for the request were staged in the dataplane bucket by the caller
+                if body['ResultsLocation']['S3Bucket'] != self.bucket:
+                    raise DataPlaneError("BadRequestError", "ResultsLocation must reference the dataplane bucket")
+                claim_check_key = body['ResultsLocation']['S3Key']
+                results = self.read_metadata_from_s3(claim_check_key, parse_float=Decimal)
+            else:
+                results = json.loads(json.dumps(body['Results']), parse_float=Decimal)
+        except KeyError as e:
+            logger.error("Exception occurred while storing metadata for {asset}: {e}".format(asset=asset_id, e=e))
+            raise DataPlaneError("BadRequestError", "Missing required inputs for storing metadata: {e}".format(e=e))
+        if not isinstance(results, dict):
+            logger.error("Exception occurred while storing metadata for {asset}".format(asset=asset_id))
+            raise DataPlaneError("BadRequestError",
+                                 "Exception occurred while storing metadata for {asset}: results are not the required data type, dict".format(
+                                     asset=asset_id))
+        logger.info("Storing metadata for {asset}".format(asset=asset_id))
+
+        # Verify asset exists before adding metadata and check if pointers exist for this operator
+        pointers = self.get_asset_item(asset_id).get(operator_name, [])
+
+        metadata_prefix = self.base_s3_uri + asset_id + '/' + 'workflows' + '/' + workflow_id + '/' + operator_name + '/'
+        page_session = None
+        if paginated:
+            if page is None:
+                page_session = workflow_id + '/' + operator_name
+                page = self.next_page_number(asset_id, page_session)
+            # Each page is written to its own object so appending a page never rewrites the previous ones, and a
+            # page stored again, such as by a retried operator, replaces itself.
+            # The manifest listing the pages is only written once the final page has been stored.
+            self.write_metadata_to_s3(self.metadata_page_key(metadata_prefix, page), results)
+            logger.info('Wrote {operator} metadata page {page} to S3 for asset: {asset}'.format(
+                asset=asset_id, operator=operator_name, page=page))
+            if not end_pagination:
+                if claim_check_key is not None:
+                    self.delete_metadata_object(claim_check_key)
+                return {"Status": "Success"}
+            metadata_key = metadata_prefix + self.manifest_file_name
+            self.write_metadata_to_s3(metadata_key, {"Pages": self.list_metadata_pages(metadata_prefix, page)})
+            logger.info('Wrote {operator} metadata manifest to S3 for asset: {asset}'.format(asset=asset_id, operator=operator_name))
+        else:
+            metadata_key = metadata_prefix[:-1] + '.json'
+            self.write_metadata_to_s3(metadata_key, results)
+            logger.info('Wrote {operator} metadata to S3 for asset: {asset}'.format(asset=asset_id, operator=operator_name))
+
+        if claim_check_key is not None:
+            self.delete_metadata_object(claim_check_key)
+
+        # we store pointers as list to keep reference of results from different executions for the same operator
+        pointers.insert(0, {"workflow": workflow_id, "pointer": metadata_key})
+        params = {
+            "Key": {"AssetId": asset_id},
+            "UpdateExpression": "SET #operator_result = :result",
+            "ExpressionAttributeNames": {"#operator_result": operator_name},
+            "ExpressionAttributeValues": {":result": pointers}
+        }
+        if page_session is not None:
+            # the session is complete, a later session for the same workflow and operator numbers its pages from 0
+            params["UpdateExpression"] += " REMOVE #counters.#session"
+            params["ExpressionAttributeNames"]["#counters"] = "PageCounters"
+            params["ExpressionAttributeNames"]["#session"] = page_session
+        try:
+            self.dynamo_resource.Table(self.table_name).update_item(**params)
+        except ClientError as e:
+            error = e.response['Error']['Message']
+            logger.error("Exception occurred during metadata pointer update: {e}".format(e=error))
+            raise DataPlaneError("ChaliceViewError", "Unable to update metadata pointer: {e}".format(e=error))
+        logger.info("Successfully stored {operator} metadata for asset: {asset} in the dataplane".format(
+            operator=operator_name, asset=asset_id))
+        return {"Status": "Success", "Bucket": self.bucket, "Key": metadata_key}
+
+    @staticmethod
+    def metadata_page_key(metadata_prefix, page):
+        # Page numbers are zero padded so that a lexical listing of the prefix returns the pages in order
+        return metadata_prefix + 'pages/' + str(page).zfill(10) + '.json'
+
+    def delete_metadata_object(self, key):
+        try:
+            self.s3_client.delete_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            logger.info("Unable to remove {key}: {e}".format(key=key, e=e.response['Error']['Message']))
+
+    def read_metadata_page(self, pointer, page_num):
+        """
+        Read a single page of operator metadata
+
+        Results stored as a manifest are read one page object at a time, in the order of the manifest's Pages, so
+        only the pages committed by the final page of the session are returned.  Results stored as a single object
+        are read whole.
+
+        :return: Tuple of the page, the number of the next page or None, and the key of the object holding exactly
+                 this page or None
+        """
+        if self.is_metadata_manifest(pointer):
+            pages = self.read_metadata_from_s3(pointer)["Pages"]
+            if page_num >= len(pages):
+                raise DataPlaneError("ChaliceViewError", "Unable to retrieve metadata: No metadata page {page} found for {key}".format(
+                    page=page_num, key=pointer))
+            page_key = pages[page_num]["Key"]
+            next_page = page_num + 1 if page_num + 1 < len(pages) else None
+            return self.read_metadata_from_s3(page_key), next_page, page_key
+
+        operator_metadata = self.read_metadata_from_s3(pointer)
+        if isinstance(operator_metadata, list):
+            if page_num >= len(operator_metadata):
+                raise DataPlaneError("ChaliceViewError", "Unable to retrieve metadata: No metadata page {page} found for {key}".format(
+                    page=page_num, key=pointer))
+            next_page = page_num + 1 if page_num + 1 < len(operator_metadata) else None
+            return operator_metadata[page_num], next_page, None
+        return operator_metadata, None, pointer
+
+    def get_asset_metadata(self, asset_id, cursor=None):
+        """
+        Read the metadata of an asset, one page per call
+
+        The first call returns the global asset information and a cursor to iterate through each stored metadata
+        type.  The cursor's "next" is the {"operator", "pointer", "page"} to read on the following call and its
+        "remaining" lists the {"operator", "pointer"} of the metadata types still to read, starting with the current
+        one.  Once all results have been read no cursor is returned.
+
+        :return: Tuple of the response and the key of the object holding exactly its results or None
+        """
+        if cursor is None:
+            asset_attributes = self.get_asset_item(asset_id)
+            global_asset_info = {}
+            for attr in self.global_attributes:
+                # assets created before fingerprinting was added have no fingerprint
+                if attr != "AssetId" and attr in asset_attributes:
+                    global_asset_info[attr] = asset_attributes[attr]
+            remaining = []
+            for attr in sorted(set(asset_attributes.keys()) - set(self.global_attributes) - set(self.internal_attributes)):
+                remaining.append({"operator": attr, "pointer": asset_attributes[attr][0]["pointer"]})
+            if not remaining:
+                return {"asset_id": asset_id, "results": global_asset_info}, None
+            next_object = dict(remaining[0], page=0)
+            return {"asset_id": asset_id,
+                    "cursor": self.encode_cursor({"next": next_object, "remaining": remaining}),
+                    "results": global_asset_info}, None
+
+        decoded_cursor = self.decode_cursor(cursor)
+        try:
+            next_entry = self.cursor_entry(decoded_cursor["next"])
+            operator_name = next_entry["operator"]
+            pointer = next_entry["pointer"]
+            page_num = int(decoded_cursor["next"]["page"])
+            remaining = [self.cursor_entry(entry) for entry in decoded_cursor["remaining"]]
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            raise DataPlaneError("BadRequestError", "Invalid cursor: {e}".format(e=e))
+
+        page_data, next_page, page_key = self.read_metadata_page(pointer, page_num)
+        response = {"asset_id": asset_id, "operator": operator_name, "results": page_data}
+        if next_page is not None:
+            next_object = {"operator": operator_name, "pointer": pointer, "page": next_page}
+            response["cursor"] = self.encode_cursor({"next": next_object, "remaining": remaining})
+        else:
+            del remaining[0]
+            if remaining:
+                next_object = dict(remaining[0], page=0)
+                response["cursor"] = self.encode_cursor({"next": next_object, "remaining": remaining})
+        return response, page_key
+
+    def get_asset_metadata_operator(self, asset_id, operator_name, cursor=None):
+        """
+        Read the metadata an operator stored for an asset, one page per call
+
+        :return: Tuple of the response and the key of the object holding exactly its results or None
+        """
+        if cursor is None:
+            asset_item = self.get_asset_item(asset_id, operator_name)
+            if operator_name not in asset_item:
+                raise DataPlaneError("NotFoundError", "No {operator} metadata stored for asset {asset}".format(
+                    operator=operator_name, asset=asset_id))
+            pointer = asset_item[operator_name][0]["pointer"]
+            page_num = 0
+        else:
+            decoded_cursor = self.decode_cursor(cursor)
+            try:
+                next_entry = self.cursor_entry(decoded_cursor["next"])
+                if next_entry["operator"] != operator_name:
+                    raise DataPlaneError("BadRequestError", "Invalid cursor: not a cursor of {operator} metadata".format(
+                        operator=operator_name))
+                pointer = next_entry["pointer"]
+                page_num = int(decoded_cursor["next"]["page"])
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                raise DataPlaneError("BadRequestError", "Invalid cursor: {e}".format(e=e))
+
+        page_data, next_page, page_key = self.read_metadata_page(pointer, page_num)
+        response = {"asset_id": asset_id, "operator": operator_name, "results": page_data}
+        if next_page is not None:
+            next_object = {"operator": operator_name, "pointer": pointer, "page": next_page}
+            response["cursor"] = self.encode_cursor({"next": next_object,
+                                                     "remaining": [{"operator": operator_name, "pointer": pointer}]})
+        return response, page_key
@@ -0,0 +1,190 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import time
+import logging
+
+import boto3
+from botocore.client import ClientError
+
+from . import Status as awsmie
+
+# Workflow scheduling state kept in the system table that both the workflow api and the workflow lambdas
+# change, such as when a workflow execution is cancelled or completes.
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Each admitted workflow execution holds a lease item listing the counters its slot was taken from
+WORKFLOW_SLOT_PREFIX = "WorkflowSlot:"
+SLOT_TRANSACTION_ATTEMPTS = 3
+
+# Scheduler invocations are coalesced, see trigger_workflow_scheduler
+SCHEDULER_TRIGGER = "SchedulerTrigger"
+SCHEDULER_TRIGGER_WINDOW_SECONDS = 5
+
+# The tenants that have queued workflows are registered in one item, so the scheduler reads the counters of each
+# tenant by key rather than scanning the system table
+SCHEDULER_TENANTS = "SchedulerTenants"
+
+
+class WorkflowScheduling:
+    """Workflow execution status changes and the slot and scheduler bookkeeping that goes with them"""
+
+    def __init__(self, system_table_name, workflow_execution_table_name, scheduler_lambda_arn):
+        """
+        :param system_table_name: The system table holding the slot leases, counters and scheduler trigger
+        :param workflow_execution_table_name: The workflow execution table
+        :param scheduler_lambda_arn: The workflow scheduler lambda
+        """
+        self.system_table_name = system_table_name
+        self.workflow_execution_table_name = workflow_execution_table_name
+        self.scheduler_lambda_arn = scheduler_lambda_arn
+        self.dynamo_client = boto3.client('dynamodb')
+        self.dynamo_resource = boto3.resource('dynamodb')
+        self.lambda_client = boto3.client('lambda')
+
+    def update_workflow_execution_status(self, id, status, message):
+        """
+        Set the status of a workflow execution, releasing its slot when it ends and triggering the scheduler
+        when a slot may be free or a workflow execution is waiting for one.  A cancelled workflow execution keeps
+        its status, its slot was released when it was cancelled.
+
+        :param id: The id of the workflow execution
+        :param status: The new status of the workflow execution
+        :param message: The error message, stored when the status is Error
+        :return: True if the status was set
+        """
+        logger.info("Update workflow execution {} set status = {}".format(id, status))
+        update_expression = 'SET #workflow_status = :workflow_status'
+        values = {
+            ':workflow_status': status,
+            ':cancelled': awsmie.WORKFLOW_STATUS_CANCELLED
+        }
+        if status == awsmie.WORKFLOW_STATUS_ERROR:
+            update_expression += ', Message = :message'
+            values[':message'] = message
+
+        try:
+            self.dynamo_resource.Table(self.workflow_execution_table_name).update_item(
+                Key={
+                    'Id': id
+                },
+                UpdateExpression=update_expression,
+                ConditionExpression='#workflow_status <> :cancelled',
+                ExpressionAttributeNames={
+                    '#workflow_status': "Status"
+                },
+                ExpressionAttributeValues=values
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            logger.info("Workflow execution {} was cancelled, not setting status {}".format(id, status))
+            return False
+
+        if status in [awsmie.WORKFLOW_STATUS_COMPLETE, awsmie.WORKFLOW_STATUS_ERROR]:
+            # Give the workflow's slot back before the scheduler looks for more work
+            self.release_workflow_slot(id)
+
+        if status in [awsmie.WORKFLOW_STATUS_QUEUED, awsmie.WORKFLOW_STATUS_COMPLETE, awsmie.WORKFLOW_STATUS_ERROR]:
+            self.trigger_workflow_scheduler()
+        return True
+
+    def release_workflow_slot(self, workflow_execution_id):
+        """
+        Release the slot held by a workflow execution, if it holds one
+
+        :param workflow_execution_id: The id of the workflow execution
+        :return: True if a slot was released
+        """
+        lease_key = {'Name': {'S': WORKFLOW_SLOT_PREFIX + workflow_execution_id}}
+
+        for attempt in range(SLOT_TRANSACTION_ATTEMPTS):
+            response = self.dynamo_client.get_item(TableName=self.system_table_name, Key=lease_key, ConsistentRead=True)
+            if "Item" not in response:
+                return False
+
+            # The condition on the counters guards against a concurrent release of some of the operation slots
+            transact_items = [
+                {
+                    'Delete': {
+                        'TableName': self.system_table_name,
+                        'Key': lease_key,
+                        'ConditionExpression': 'attribute_exists(#name) AND #counters = :counters',
+                        'ExpressionAttributeNames': {'#name': 'Name', '#counters': 'Counters'},
+                        'ExpressionAttributeValues': {':counters': response["Item"]["Counters"]}
+                    }
+                }
+            ]
+            for counter in response["Item"]["Counters"]["SS"]:
+                transact_items.append({
+                    'Update': {
+                        'TableName': self.system_table_name,
+                        'Key': {'Name': {'S': counter}},
+                        'UpdateExpression': 'ADD #value :minus_one',
+                        'ExpressionAttributeNames': {'#value': 'Value'},
+                        'ExpressionAttributeValues': {':minus_one': {'N': '-1'}}
+                    }
+                })
+
+            try:
+                self.dynamo_client.transact_write_items(TransactItems=transact_items)
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'TransactionCanceledException':
+                    raise
+                # The lease changed or was released by another caller, read it again
+                continue
+            else:
+                logger.info("Released workflow slot for {}".format(workflow_execution_id))
+                return True
+
+        logger.info("Unable to release workflow slot for {}".format(workflow_execution_id))
+        return False
+
+    def register_tenants(self, tenants):
+        """
+        Add tenants to the tenants the workflow scheduler reads the counters of
+
+        :param tenants: List of tenant names
+        """
+        self.dynamo_client.update_item(
+            TableName=self.system_table_name,
+            Key={
+                'Name': {'S': SCHEDULER_TENANTS}
+            },
+            UpdateExpression='ADD #value :tenants',
+            ExpressionAttributeNames={'#value': 'Value'},
+            ExpressionAttributeValues={':tenants': {'SS': list(set(tenants))}}
+        )
+
+    def trigger_workflow_scheduler(self):
+        """
+        Invoke the workflow scheduler unless a trigger is already pending.  Triggers are coalesced through an
+        item in the system table that the scheduler clears when it starts, so a burst of status changes results
+        in one scheduler run rather than one per change.  A pending trigger expires after
+        SCHEDULER_TRIGGER_WINDOW_SECONDS in case the invocation it made is lost.
+        """
+        now = int(time.time())
+        try:
+            self.dynamo_client.put_item(
+                TableName=self.system_table_name,
+                Item={
+                    'Name': {'S': SCHEDULER_TRIGGER},
+                    'Value': {'N': str(now + SCHEDULER_TRIGGER_WINDOW_SECONDS)}
+                },
+                ConditionExpression='attribute_not_exists(#value) OR #value < :now',
+                ExpressionAttributeNames={'#value': 'Value'},
+                ExpressionAttributeValues={':now': {'N': str(now)}}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                logger.info("Workflow scheduler trigger is already pending")
+                return
+            raise
+
+        # Trigger the workflow_scheduler
+        self.lambda_client.invoke(
+            FunctionName=self.scheduler_lambda_arn,
+            InvocationType='Event'
+        )
@@ -625,6 +625,15 @@ def read_json_from_s3(key):
         return {"Status": "Error", "Error": e}
     else:
         results = obj['Body'].read().decode('utf-8')
+        # Paginated metadata is stored as a manifest of page objects, reassemble the pages into a list
+        if key.endswith('/manifest.json'):
+            pages = []
+            for page in json.loads(results)["Pages"]:
+                page_object = read_json_from_s3(page["Key"])
+                if page_object["Status"] == "Error":
+                    return page_object
+                pages.append(json.loads(page_object["Results"]))
+            results = json.dumps(pages)
         return {"Status": "Success", "Results": results}
 
 
@@ -4,7 +4,6 @@
 from chalice import Chalice
 from chalice import NotFoundError, BadRequestError, ChaliceViewError, CognitoUserPoolAuthorizer
 from botocore.client import ClientError
-from decimal import Decimal
 from botocore.config import Config
 
 import boto3
@@ -12,8 +11,7 @@ import os
 import uuid
 import json
 import logging
-import datetime
-import base64
+from MediaInsightsEngineLambdaHelper.dataplane_storage import DataPlaneStorage, DataPlaneError, DecimalEncoder
 
 # TODO: Add additional exception and response codes
 # TODO: Narrow exception scopes
@@ -51,61 +49,62 @@ cognito_user_pool_arn = os.environ['USER_POOL_ARN']
 
 # TODO: Should we add a variable for the upload bucket?
 
-base_s3_uri = 'private/assets/'
+base_s3_uri = DataPlaneStorage.base_s3_uri
+
+# Results are exchanged through S3 rather than inline when the encoded lambda response would be larger than this
+# many bytes.  A synchronous invoke response is limited to 6 MB.
+if "CLAIM_CHECK_THRESHOLD" in os.environ:
+    claim_check_threshold = int(os.environ["CLAIM_CHECK_THRESHOLD"])
+else:
+    claim_check_threshold = 6000000
 s3_client = boto3.client('s3')
 s3_resource = boto3.resource('s3')
 
+# Assets and metadata are stored through the same module the DataPlane helper uses in library mode
+storage = DataPlaneStorage(dataplane_s3_bucket, dataplane_table_name)
+
 authorizer = CognitoUserPoolAuthorizer(
     'MieUserPool', header='Authorization',
     provider_arns=[cognito_user_pool_arn])
 
 
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, Decimal):
-            return str(obj)
-            # Let the base class default method raise the TypeError
-        return json.JSONEncoder.default(self, obj)
-
-
 def check_required_input(key, dict, objectname):
     if key not in dict:
         raise BadRequestError("Key '%s' is required in '%s' input" % (
             key, objectname))
 
 
-def write_metadata_to_s3(bucket, key, data):
-    encoded = json.dumps(data, cls=DecimalEncoder)
-    try:
-        s3_client.put_object(Bucket=bucket, Key=key, Body=encoded)
-    except ClientError as e:
-        error = e.response['Error']['Message']
-        logger.info("Exception occurred while writing asset metadata to s3: {e}".format(e=error))
-        return {"Status": "Error", "Message": error}
-    except Exception as e:
-        logger.error("Exception occurred while writing asset metadata to s3")
-        return {"Status": "Error", "Message": e}
-    else:
-        logger.info("Wrote asset metadata to s3")
-        return {"Status": "Success"}
+def chalice_error(error):
+    """Build the chalice error the dataplane api returns for a DataPlaneError"""
+    errors = {"BadRequestError": BadRequestError, "NotFoundError": NotFoundError}
+    if error.code in errors:
+        return errors[error.code](error.message)
+    return ChaliceViewError(error.message)
 
 
-def read_metadata_from_s3(bucket, key):
-    try:
-        obj = s3_client.get_object(
-            Bucket=bucket,
-            Key=key
-        )
-    except ClientError as e:
-        error = e.response['Error']['Message']
-        logger.info("Exception occurred while reading asset metadata from s3: {e}".format(e=error))
-        return {"Status": "Error", "Message": error}
-    except Exception as e:
-        logger.error("Exception occurred while reading asset metadata from s3")
-        return {"Status": "Error", "Message": e}
-    else:
-        results = obj['Body'].read().decode('utf-8')
-        return {"Status": "Success", "Object": results}
+def claim_check_response(response, asset_id, source_key=None):
+    """
+    Replace oversized results in a metadata response with a presigned url.
+
+    If the page was read from an object of its own that object is presigned directly, otherwise the page is
+    written to a claim check object under the asset first.  The size checked is that of the response as the
+    lambda returns it, the body is encoded once and then again as a string of the API Gateway proxy response.
+    """
+    encoded_response = json.dumps(json.dumps(response, cls=DecimalEncoder))
+    if len(encoded_response.encode('utf-8')) <= claim_check_threshold:
+        return response
+    if source_key is None:
+        source_key = base_s3_uri + asset_id + '/claimcheck/' + str(uuid.uuid4()) + '.json'
+        s3_client.put_object(Bucket=dataplane_s3_bucket, Key=source_key,
+                             Body=json.dumps(response["results"], cls=DecimalEncoder))
+    logger.info("Metadata response exceeds {threshold} bytes, returning a presigned url for {key}".format(
+        threshold=claim_check_threshold, key=source_key))
+    del response["results"]
+    response["results_url"] = s3_client.generate_presigned_url('get_object',
+                                                               Params={'Bucket': dataplane_s3_bucket,
+                                                                       'Key': source_key},
+                                                               ExpiresIn=3600)
+    return response
 
 
 def delete_s3_objects(keys):
@@ -113,12 +112,14 @@ def delete_s3_objects(keys):
     for key in keys:
         objects.append({"Key": key})
     try:
-        response = s3_client.delete_objects(
-            Bucket=dataplane_s3_bucket,
-            Delete={
-                'Objects': objects
-            }
-        )
+        # delete_objects accepts at most 1000 keys per request
+        for i in range(0, len(objects), 1000):
+            response = s3_client.delete_objects(
+                Bucket=dataplane_s3_bucket,
+                Delete={
+                    'Objects': objects[i:i + 1000]
+                }
+            )
     except ClientError as e:
         error = e.response['Error']['Message']
         logger.info("Exception occurred while deleting asset metadata from s3: {e}".format(e=error))
@@ -130,40 +131,6 @@ def delete_s3_objects(keys):
         return {"Status": "Success", "Message": response}
 
 
-def build_cursor_object(next_object, remaining):
-    cursor = {
-        "next": next_object,
-        "remaining": remaining
-    }
-    return cursor
-
-
-def encode_cursor(cursor):
-    cursor = json.dumps(cursor)
-    encoded = base64.urlsafe_b64encode(cursor.encode('UTF-8')).decode('ascii')
-    return encoded
-
-
-def decode_cursor(cursor):
-    decoded = json.loads(base64.b64decode(cursor).decode('utf-8'))
-    return decoded
-
-
-def is_metadata_list(metadata):
-    if isinstance(metadata, list):
-        return True
-    else:
-        return False
-
-
-def next_page_valid(metadata, page_num):
-    try:
-        page = metadata[page_num]
-        return True
-    except IndexError:
-        return False
-
-
 # @app.lambda_function()
 # def hello_world_function():
 #     return {"Message": "Hello World!"}
@@ -255,10 +222,7 @@ def media_upload_path(asset_id, workflow_id):
         ChaliceViewError - 500
     """
     try:
-        response = {
-            "S3Bucket": dataplane_s3_bucket,
-            "S3Key": 'private/assets/' + asset_id + "/workflows/" + workflow_id + "/"
-        }
+        response = storage.media_storage_path(asset_id, workflow_id)
     except Exception as e:
         logging.info(e)
         raise ChaliceViewError(
@@ -284,105 +248,55 @@ def create_asset():
             }
         }
 
+    An image sequence asset is created from a list of images, or from the images under an S3 prefix.
+
+    .. code-block:: python
+
+        {
+            "Input": {
+                "Items": [{"S3Bucket": "{somenbucket}", "S3Key": "{somekey}"}, ...]
+            }
+        }
+
+        {
+            "Input": {
+                "S3Bucket": "{somenbucket}",
+                "S3Prefix": "{someprefix}"
+            }
+        }
+
     Returns:
-        A dict containing the asset id and the location of the media object in the dataplane.
+        A dict containing the asset id, the location of the media object in the dataplane and the content
+        fingerprint of the media. Media whose content S3 has no digest for, such as SSE-KMS encrypted media
+        copied without a checksum, has no fingerprint.
          .. code-block:: python
 
             {
                 "AssetId": asset_id,
                 "S3Bucket": dataplane_s3_bucket,
-                "S3Key": key
+                "S3Key": key,
+                "Fingerprint": fingerprint
             }
     Raises:
         ChaliceViewError - 500
     """
 
-    table_name = dataplane_table_name
-    bucket = dataplane_s3_bucket
-    uri = base_s3_uri
-
     asset = app.current_request.json_body
     logger.info(asset)
 
-    # create a uuid for the asset
-
-    asset_id = str(uuid.uuid4())
-
-    # check required inputs
-
-    try:
-        source_key = asset['Input']['S3Key']
-        source_bucket = asset['Input']['S3Bucket']
-    except KeyError as e:
-        logger.error("Exception occurred during asset creation: {e}".format(e=e))
-        raise BadRequestError("Missing required inputs for asset creation: {e}".format(e=e))
-    else:
-        logger.info("Creating an asset from: {bucket}/{key}".format(bucket=source_bucket, key=source_key))
-
-    # create directory structure in s3 dataplane bucket for the asset
-    directory = uri + asset_id + "/"
-
-    try:
-        s3_client.put_object(
-            Bucket=bucket,
-            Key=directory
-        )
-    except ClientError as e:
-        error = e.response['Error']['Message']
-        logger.error("Exception occurred during asset creation: {e}".format(e=error))
-        raise ChaliceViewError("Unable to create asset directory in the dataplane bucket: {e}".format(e=error))
-    except Exception as e:
-        logger.error("Exception occurred during asset creation: {e}".format(e=e))
-        raise ChaliceViewError("Exception when creating dynamo item for asset: {e}".format(e=e))
-    else:
-        logger.info("Created asset directory structure: {directory}".format(directory=directory))
-
-    # build key for new s3 object
-
-    new_key = directory + 'input' + '/' + source_key
-
-    # copy input media into newly created dataplane s3 directory
-
-    try:
-        s3_client.copy_object(
-            Bucket=dataplane_s3_bucket,
-            Key=new_key,
-            CopySource={'Bucket': source_bucket, 'Key': source_key}
-        )
-    except ClientError as e:
-        error = e.response['Error']['Message']
-        logger.error("Exception occurred during asset creation: {e}".format(e=error))
-        raise ChaliceViewError("Unable to copy input media to the dataplane bucket: {e}".format(e=error))
-    except Exception as e:
-        logger.error("Exception occurred during asset creation: {e}".format(e=e))
-        raise ChaliceViewError("Exception when creating s3 object for asset: {e}".format(e=e))
-    else:
-        logger.info("Copied input media into dataplane bucket: {key}".format(key=new_key))
-
-    # build ddb item of the asset
-
-    ts = str(datetime.datetime.now().timestamp())
-
     try:
-        table = dynamo_resource.Table(table_name)
-        table.put_item(
-            Item={
-                "AssetId": asset_id,
-                "S3Bucket": dataplane_s3_bucket,
-                "S3Key": new_key,
-                "Created": ts
-            }
-        )
-    except ClientError as e:
-        error = e.response['Error']['Message']
-        logger.error("Exception occurred during asset creation: {e}".format(e=error))
-        raise ChaliceViewError("Unable to create asset item in dynamo: {e}".format(e=error))
-    except Exception as e:
-        logger.error("Exception occurred during asset creation: {e}".format(e=e))
-        raise ChaliceViewError("Exception when creating dynamo item for asset: {e}".format(e=e))
-    else:
-        logger.info("Completed asset creation for asset: {asset}".format(asset=asset_id))
-        return {"AssetId": asset_id, "S3Bucket": dataplane_s3_bucket, "S3Key": new_key}
+        if isinstance(asset, dict) and isinstance(asset.get('Input'), dict) and \
+                ('Items' in asset['Input'] or 'S3Prefix' in asset['Input']):
+            return storage.create_image_sequence_asset(asset['Input'])
+        try:
+            source_key = asset['Input']['S3Key']
+            source_bucket = asset['Input']['S3Bucket']
+        except KeyError as e:
+            logger.error("Exception occurred during asset creation: {e}".format(e=e))
+            raise BadRequestError("Missing required inputs for asset creation: {e}".format(e=e))
+        return storage.create_asset(source_bucket, source_key)
+    except DataPlaneError as e:
+        raise chalice_error(e)
 
 
 @app.route('/metadata/{asset_id}', cors=True, methods=['POST'], authorizer=authorizer)
@@ -395,9 +309,17 @@ def put_asset_metadata(asset_id):
     the "end" query param must be set to "true", which will tell the dataplane that the paginated session is
     over and update the pointer for that metadata type.
 
+    Each page is stored as its own S3 object named by its page number, and the final call writes a manifest listing
+    the pages from 0 to the number of the final page. The pointer for paginated results references the manifest,
+    readers of this API still receive the pages as a list.
+
+    Pages should be numbered with the "page" query param, so that a page stored again, such as by a retried
+    operator, replaces itself. Pages stored without a number are numbered in the order they are received.
+
     Query String Params:
     :param paginate: Boolean to tell dataplane that the results will come in as pages.
     :param end: Boolean to declare the last page in a set of paginated results.
+    :param page: The number of the page, starting at 0.
 
     Body:
 
@@ -409,6 +331,10 @@ def put_asset_metadata(asset_id):
             "WorkflowId": "workflow-id"
         }
 
+    Results too large for the request can be staged as a json object in the dataplane bucket and referenced
+    with "ResultsLocation": {"S3Bucket": "{dataplane_bucket}", "S3Key": "{key}"} in place of "Results". The staged
+    object is removed once the results are stored.
+
     Returns:
 
         Dictionary containing the status of the PUT metadata operation. If a pointer is updated, the response will also
@@ -427,176 +353,11 @@ def put_asset_metadata(asset_id):
 
     # TODO: Maybe add some enforcement around only being able to end paginated calls if called from the same workflow
 
-    bucket = dataplane_s3_bucket
-    table_name = dataplane_table_name
-    asset = asset_id
-
-    body = app.current_request.json_body
-    query_params = app.current_request.query_params
-
-    paginated = False
-    end_pagination = False
-
-    if query_params is not None:
-        try:
-            paginated = query_params["paginated"]
-        except KeyError:
-            raise BadRequestError("Must pass required query parameter: paginated")
-        else:
-            if paginated == "true":
-                paginated = True
-
-    if paginated is True:
-        try:
-            end_pagination = query_params["end"]
-        except KeyError:
-            logger.info("Not the end of paginated results")
-        else:
-            if end_pagination == "true":
-                logger.info("Storing the last page of results")
-                end_pagination = True
-            else:
-                raise BadRequestError("Query param end only supports a value of: true")
-
     try:
-        operator_name = body['OperatorName']
-        workflow_id = body['WorkflowId']
-        results = json.loads(json.dumps(body['Results']), parse_float=Decimal)
-    except KeyError as e:
-        logger.error("Exception occurred while storing metadata for {asset}: {e}".format(asset=asset, e=e))
-        raise BadRequestError("Missing required inputs for storing metadata: {e}".format(e=e))
-    except Exception as e:
-        logger.error("Exception occurred while storing metadata for {asset}: {e}".format(asset=asset, e=e))
-        raise ChaliceViewError("Unknown exception when storing asset metadata: {e}".format(e=e))
-    else:
-        # check that results is dict
-        if not isinstance(results, dict):
-            logger.error("Exception occurred while storing metadata for {asset}".format(asset=asset))
-            raise BadRequestError(
-                "Exception occurred while storing metadata for {asset}: results are not the required data type, dict".format(
-                    asset=asset))
-        else:
-            logger.info("Storing metadata for {asset}".format(asset=asset))
-
-    # Key that we'll write the results too
-    metadata_key = base_s3_uri + asset + '/' + 'workflows' + '/' + workflow_id + '/' + operator_name + '.json'
-
-    # Verify asset exists before adding metadata and check if pointers exist for this operator
-
-    # TODO: This check happens every time we have an additional call when storing paginated results,
-    #  could likely refactor this to avoid that
-
-    try:
-        table = dynamo_resource.Table(table_name)
-        response = table.get_item(
-            Key={
-                "AssetId": asset
-            }
-        )
-    except ClientError as e:
-        error = e.response['Error']['Message']
-        logger.error("Exception occurred while storing metadata for {asset}: {e}".format(asset=asset, e=error))
-        raise ChaliceViewError("Exception occurred while verifying asset exists: {e}".format(e=error))
-    except Exception as e:
-        logger.error("Exception occurred while storing metadata for {asset}: {e}".format(asset=asset, e=e))
-        raise ChaliceViewError("Exception occurred while verifying asset exists: {e}".format(e=e))
-    else:
-        if 'Item' not in response:
-            raise NotFoundError(
-                "Exception occurred while verifying asset exists: {asset} does not exist".format(asset=asset))
-        else:
-            try:
-                pointers = response['Item'][operator_name]
-            except KeyError:
-                logger.info("No pointers have been stored for this operator")
-                pointers = []
-            else:
-                logger.info("Retrieved existing pointers")
-
-    # We wont update dynamo unless we successfully write to s3
-
-    wrote_to_s3 = False
-
-    # write results to s3
-
-    if paginated:
-        # Check if the operator already generated metadata in this workflow execution
-        check_existing = read_metadata_from_s3(bucket, metadata_key)
-        if check_existing['Status'] == 'Error':
-            # Write the first page directly, format it as a list
-            logger.info("Operator has not stored results during this worfklow execution, writing first page to S3")
-            formatted_result = [results]
-            store_results = write_metadata_to_s3(bucket, metadata_key, formatted_result)
-            if store_results['Status'] == 'Success':
-                logging.info(
-                    'Wrote {operator} metadata page to s3 for asset: {asset}'.format(asset=asset, operator=operator_name))
-                wrote_to_s3 = True
-            else:
-                logging.error('Unable to write paginated metadata to s3 for asset: {asset}'.format(asset=asset))
-                raise ChaliceViewError("Exception occurred while writing metadata to s3: {e}".format(e=store_results["Message"]))
-        else:
-            # Pull in the existing metadata
-            existing_results = json.loads(check_existing['Object'])
-            # Append new data
-            existing_results.append(results)
-            # Write back to s3
-            store_results = write_metadata_to_s3(bucket, metadata_key, existing_results)
-            if store_results['Status'] == 'Success':
-                logging.info(
-                    'Wrote {operator} metadata page to S3 for asset: {asset}'.format(asset=asset, operator=operator_name))
-                wrote_to_s3 = True
-            else:
-                logging.error('Unable to write paginated metadata to s3 for asset: {asset}'.format(asset=asset))
-                raise ChaliceViewError("Exception occurred while writing metadata to s3: {e}".format(e=store_results["Message"]))
-    else:
-        store_results = write_metadata_to_s3(bucket, metadata_key, results)
-        if store_results['Status'] == 'Success':
-            logging.info(
-                'Wrote {operator} metadata to S3 for asset: {asset}'.format(asset=asset, operator=operator_name))
-            wrote_to_s3 = True
-        else:
-            logging.error('Unable to write metadata to s3 for asset: {asset}'.format(asset=asset))
-            raise ChaliceViewError(
-                "Exception occurred while writing metadata to s3: {e}".format(e=store_results["Message"]))
-
-    # We only update pointer for results if all the pages are written successfully
-    if not paginated and wrote_to_s3 or end_pagination and wrote_to_s3:
-        # update the pointer list in dynamo
-
-        # we store pointers as list to keep reference of results from different executions for the same operator
-
-        pointer = {"workflow": workflow_id, "pointer": metadata_key}
-        pointers.insert(0, pointer)
-
-        update_expression = "SET #operator_result = :result"
-        expression_attr_name = {"#operator_result": operator_name}
-        expression_attr_val = {":result": pointers}
-
-        try:
-            table = dynamo_resource.Table(table_name)
-            table.update_item(
-                Key={
-                    "AssetId": asset
-                },
-                UpdateExpression=update_expression,
-                ExpressionAttributeNames=expression_attr_name,
-                ExpressionAttributeValues=expression_attr_val,
-            )
-        except ClientError as e:
-            error = e.response['Error']['Message']
-            logger.error("Exception occurred during metadata pointer update: {e}".format(e=error))
-            raise ChaliceViewError("Unable to update metadata pointer: {e}".format(e=error))
-        except Exception as e:
-            logger.error("Exception updating pointer in dynamo {e}".format(e=e))
-            raise ChaliceViewError("Exception: {e}".format(e=e))
-        else:
-            logger.info("Successfully stored {operator} metadata for asset: {asset} in the dataplane".format(
-                operator=operator_name, asset=asset_id))
-            return {"Status": "Success", "Bucket": bucket, "Key": metadata_key}
-    elif paginated and not end_pagination and wrote_to_s3:
-        return {"Status": "Success"}
-    else:
-        return {"Status": "Failed"}
+        paginated, end_pagination, page = storage.parse_metadata_query(app.current_request.query_params)
+        return storage.store_asset_metadata(asset_id, app.current_request.json_body, paginated, end_pagination, page)
+    except DataPlaneError as e:
+        raise chalice_error(e)
 
 
 @app.route('/metadata/{asset_id}', cors=True, methods=['GET'], authorizer=authorizer)
@@ -612,6 +373,8 @@ def get_asset_metadata(asset_id):
 
     Once all results have been retrieved, no cursor key will be present in the response.
 
+    Pages too large to return inline are replaced by a "results_url" key holding a presigned url for the page.
+
     Returns:
         All asset metadata
 
@@ -629,123 +392,20 @@ def get_asset_metadata(asset_id):
     """
 
     logging.info("Returning all metadata for asset: {asset_id}".format(asset_id=asset_id))
-    table_name = dataplane_table_name
 
     # Check if cursor is present, if not this is the first request
 
     query_params = app.current_request.query_params
+    cursor = query_params['cursor'] if query_params is not None else None
 
-    if query_params is None:
-        first_call = True
-    else:
-        # TODO: Do I want to add another check here?
-        cursor = app.current_request.query_params['cursor']
-        first_call = False
-
-    if first_call is True:
-        try:
-            table = dynamo_resource.Table(table_name)
-            asset_item = table.get_item(
-                Key={
-                    'AssetId': asset_id
-                }
-            )
-        except ClientError as e:
-            error = e.response['Error']['Message']
-            logger.error("Exception occurred while retreiving metadata for {asset}: {e}".format(asset=asset_id, e=error))
-            raise ChaliceViewError("Unable to retrieve metadata: {e}".format(e=error))
-        except Exception as e:
-            logger.error(
-                "Exception occurred while retreiving metadata for {asset}: {e}".format(asset=asset_id, e=e))
-            raise ChaliceViewError("Unable to retrieve metadata: {e}".format(e=e))
-        else:
-            # TODO: Should clarify varaible names for first page in the context of the
-            #  entire request vs. a page for a specific operator
-            if "Item" in asset_item:
-                asset_attributes = asset_item["Item"]
-                global_attributes = ['S3Key', 'S3Bucket', 'AssetId', 'Created']
-                remaining_attributes = list(set(asset_attributes.keys()) - set(global_attributes))
-                remaining = []
-
-                global_asset_info = {}
-
-                for attr in global_attributes:
-                    if attr == "AssetId":
-                        pass
-                    else:
-                        global_asset_info[attr] = asset_attributes[attr]
-
-                if not remaining_attributes:
-                    response = {"asset_id": asset_id, "results": global_asset_info}
-
-                else:
-                    for attr in remaining_attributes:
-                        attr_name = attr
-                        attr_pointer = asset_attributes[attr_name][0]["pointer"]
-                        remaining.append({attr_name: attr_pointer})
-
-                    next = remaining[0]
-                    next["page"] = 0
-
-                    new_cursor = build_cursor_object(next, remaining)
-
-                    # TODO: Maybe return the list of attributes in the response?
-                    response = {"asset_id": asset_id,
-                                "cursor": encode_cursor(new_cursor),
-                                "results": global_asset_info}
-
-                return response
-    else:
-        decoded_cursor = decode_cursor(cursor)
-        # TODO: Can probably move this to an ordered dict, but this works for now
-        operator_name = list(decoded_cursor["next"].keys())[0]
-        pointer = decoded_cursor["next"][operator_name]
-        page_num = decoded_cursor["next"]["page"]
-        remaining = decoded_cursor["remaining"]
-
-        s3_object = read_metadata_from_s3(dataplane_s3_bucket, pointer)
-        # TODO: Add error handling for s3 call
-        operator_metadata = json.loads(s3_object["Object"])
-        if is_metadata_list(operator_metadata) is True:
-            next_page_num = page_num + 1
-
-            page_data = operator_metadata[page_num]
-
-            if next_page_valid(operator_metadata, next_page_num) is True:
-                next = {operator_name: pointer, "page": next_page_num}
-                new_cursor = build_cursor_object(next, remaining)
-                response = {"asset_id": asset_id, "operator": operator_name,
-                            "cursor": encode_cursor(new_cursor),
-                            "results": page_data}
-            else:
-                del remaining[0]
-
-                if not remaining:
-                    response = {"asset_id": asset_id, "operator": operator_name,
-                                "results": page_data}
-                else:
-                    next = remaining[0]
-                    next["page"] = 0
-                    new_cursor = build_cursor_object(next, remaining)
-                    response = {"asset_id": asset_id, "operator": operator_name, "cursor": encode_cursor(new_cursor),
-                                "results": page_data}
-            return response
-        else:
-            page = operator_metadata
-
-            del remaining[0]
-
-            if not remaining:
-                response = {"asset_id": asset_id, "operator": operator_name,
-                            "results": page}
-
-            else:
-                next = remaining[0]
-                next["page"] = 0
-                new_cursor = build_cursor_object(next, remaining)
-                response = {"asset_id": asset_id, "operator": operator_name, "cursor": encode_cursor(new_cursor),
-                            "results": page}
-            return response
+    try:
+        response, page_key = storage.get_asset_metadata(asset_id, cursor)
+    except DataPlaneError as e:
+        logger.error("Exception occurred while retreiving metadata for {asset}: {e}".format(asset=asset_id, e=e.message))
+        raise chalice_error(e)
+    if cursor is None:
+        return response
+    return claim_check_response(response, asset_id, page_key)
 
 
 # TODO: I need to do some bugfixing, this method works but I think I'm sending the last page back twice
@@ -761,6 +421,8 @@ def get_asset_metadata_operator(asset_id, operator_name):
 
     Once all results have been retrieved, no cursor key will be present in the response.
 
+    Pages too large to return inline are replaced by a "results_url" key holding a presigned url for the page.
+
     Returns:
 
         Metadata that a specific operator created
@@ -779,90 +441,18 @@ def get_asset_metadata_operator(asset_id, operator_name):
     """
     logging.info(
         "Returning {operator} metadata for asset: {asset_id}".format(asset_id=asset_id, operator=operator_name))
-    table_name = dataplane_table_name
 
     # Check if cursor is present, if not this is the first request
 
-    if app.current_request.query_params is None:
-        first_call = True
-    else:
-        # TODO: Do I want to add another check here?
-        cursor = app.current_request.query_params['cursor']
-        first_call = False
-
-    if first_call is True:
-        projection_expression = "#attr"
-        expression_attribute_names = {"#attr": operator_name}
-        try:
-            table = dynamo_resource.Table(table_name)
-            asset_item = table.get_item(
-                Key={
-                    'AssetId': asset_id
-                },
-                ProjectionExpression=projection_expression,
-                ExpressionAttributeNames=expression_attribute_names
-            )
-        except ClientError as e:
-            error = e.response['Error']['Message']
-            logger.error(
-                "Exception occurred while retreiving metadata for {asset}: {e}".format(asset=asset_id, e=error))
-            raise ChaliceViewError("Unable to retrieve metadata: {e}".format(e=error))
-        except Exception as e:
-            logger.error(
-                "Exception occurred while retreiving metadata for {asset}: {e}".format(asset=asset_id, e=e))
-            raise ChaliceViewError("Unable to retrieve metadata: {e}".format(e=e))
-        else:
-            if "Item" in asset_item:
-                pointer = asset_item["Item"][operator_name][0]["pointer"]
-                s3_object = read_metadata_from_s3(dataplane_s3_bucket, pointer)
-                # TODO: Add error handling for s3 call
-                operator_metadata = json.loads(s3_object["Object"])
-                if is_metadata_list(operator_metadata) is True:
-                    first_page_num = 0
-                    next_page_num = first_page_num + 1
-
-                    first_page_data = operator_metadata[first_page_num]
-
-                    if next_page_valid(operator_metadata, next_page_num) is True:
-                        next = {operator_name: pointer, "page": next_page_num}
-                        # TODO: Do I really need this for getting results of a specific operator?
-                        remaining = [operator_name]
-                        new_cursor = build_cursor_object(next, remaining)
-                        response = {"asset_id": asset_id, "operator": operator_name,
-                                    "cursor": encode_cursor(new_cursor),
-                                    "results": first_page_data}
-                    else:
-                        response = {"asset_id": asset_id, "operator": operator_name, "results": first_page_data}
-                    return response
-                else:
-                    page = operator_metadata
-                    response = {"asset_id": asset_id, "operator": operator_name, "results": page}
-                    return response
-            # TODO: Add else block to handle not finding an item
-    else:
-        decoded_cursor = decode_cursor(cursor)
-
-        pointer = decoded_cursor["next"][operator_name]
-        page_num = decoded_cursor["next"]["page"]
-
-        next_page_num = page_num + 1
-
-        # TODO: Add error handling for s3 call
-        s3_object = read_metadata_from_s3(dataplane_s3_bucket, pointer)
-
-        operator_metadata = json.loads(s3_object["Object"])
-        page_data = operator_metadata[page_num]
-
-        if next_page_valid(operator_metadata, next_page_num) is True:
-            next = {operator_name: pointer, "page": next_page_num}
-            remaining = [operator_name]
-            new_cursor = build_cursor_object(next, remaining)
-            response = {"asset_id": asset_id, "operator": operator_name,
-                        "cursor": encode_cursor(new_cursor), "results": page_data}
-        else:
-            response = {"asset_id": asset_id, "operator": operator_name, "results": page_data}
+    query_params = app.current_request.query_params
+    cursor = query_params['cursor'] if query_params is not None else None
 
-        return response
+    try:
+        response, page_key = storage.get_asset_metadata_operator(asset_id, operator_name, cursor)
+    except DataPlaneError as e:
+        logger.error("Exception occurred while retreiving metadata for {asset}: {e}".format(asset=asset_id, e=e.message))
+        raise chalice_error(e)
+    return claim_check_response(response, asset_id, page_key)
 
 
 @app.route('/metadata', cors=True, methods=['GET'], authorizer=authorizer)
@@ -969,6 +559,11 @@ def delete_operator_metadata(asset_id, operator_name):
             for item in deleted_pointers:
                 for pointer in item.values():
                     keys.append(pointer)
+            # Every page of the operator, including those of sessions that never stored their final page
+            try:
+                keys.extend(storage.list_metadata_page_keys(asset, operator))
+            except DataPlaneError as e:
+                raise chalice_error(e)
             delete = delete_s3_objects(keys)
             if delete["Status"] == "Success":
                 logger.info(
@@ -1015,8 +610,8 @@ def delete_asset(asset_id):
             logger.error("Exception occurred during request to delete asset: {e}".format(e=e))
             raise ChaliceViewError("Unable to delete asset: {e}".format(e=e))
         else:
-            global_attributes = ['S3Key', 'S3Bucket', 'AssetId', 'Created']
-            remaining_attributes = list(set(attributes_to_delete.keys()) - set(global_attributes))
+            remaining_attributes = list(set(attributes_to_delete.keys()) - set(storage.global_attributes) -
+                                        set(storage.internal_attributes))
 
             # Build list of all s3 objects that the asset had pointers to
             keys = []
@@ -1026,6 +621,11 @@ def delete_asset(asset_id):
                     for pointer in item.values():
                         keys.append(pointer)
             keys.append(attributes_to_delete['S3Key'])
+            # Every metadata page of the asset, including those of sessions that never stored their final page
+            try:
+                keys.extend(storage.list_metadata_page_keys(asset))
+            except DataPlaneError as e:
+                raise chalice_error(e)
 
             # Delete all the objects from S3
             logger.info("Deleting the metadata objects from s3")
@@ -51,6 +51,7 @@ def lambda_handler(event, context):
     pagination_token = ''
     finished = False
     is_paginated = False
+    page = 0
     # Pagination starts on 1001th result. This while loops through each page.
     while not finished:
         response = rek.get_face_detection(JobId=job_id, MaxResults=max_results, NextToken=pagination_token)
@@ -69,7 +70,7 @@ def lambda_handler(event, context):
                 is_paginated = True
                 pagination_token = response['NextToken']
                 # Persist rekognition results (current page)
-                metadata_upload = dataplane.store_asset_metadata(asset_id=asset_id, operator_name=operator_name, workflow_id=workflow_id, results=response, paginate=True, end=False)
+                metadata_upload = dataplane.store_asset_metadata(asset_id=asset_id, operator_name=operator_name, workflow_id=workflow_id, results=response, paginate=True, end=False, page=page)
                 if "Status" not in metadata_upload:
                     output_object.update_workflow_status("Error")
                     output_object.add_workflow_metadata(
@@ -79,6 +80,7 @@ def lambda_handler(event, context):
                 else:
                     if metadata_upload["Status"] == "Success":
                         print("Uploaded metadata for asset: {asset}".format(asset=asset_id))
+                        page += 1
                     elif metadata_upload["Status"] == "Failed":
                         output_object.update_workflow_status("Error")
                         output_object.add_workflow_metadata(
@@ -95,7 +97,7 @@ def lambda_handler(event, context):
                 finished = True
                 # Persist rekognition results
                 if is_paginated:
-                    metadata_upload = dataplane.store_asset_metadata(asset_id=asset_id, operator_name=operator_name, workflow_id=workflow_id, results=response, paginate=True, end=True)
+                    metadata_upload = dataplane.store_asset_metadata(asset_id=asset_id, operator_name=operator_name, workflow_id=workflow_id, results=response, paginate=True, end=True, page=page)
                 else:
                     metadata_upload = dataplane.store_asset_metadata(asset_id=asset_id, operator_name=operator_name, workflow_id=workflow_id, results=response)
                 if "Status" not in metadata_upload:
@@ -16,6 +16,7 @@ from botocore import config
 from MediaInsightsEngineLambdaHelper import OutputHelper
 from MediaInsightsEngineLambdaHelper import MasExecutionError
 from MediaInsightsEngineLambdaHelper import DataPlane
+from MediaInsightsEngineLambdaHelper import process_image_sequence
 
 operator_name = os.environ['OPERATOR_NAME']
 output_object = OutputHelper(operator_name)
@@ -37,6 +38,23 @@ def detect_labels(bucket, key):
     return response
 
 
+# Recognizes labels in each image of an image sequence, storing the labels of each image as a metadata page
+def detect_image_sequence_labels(sequence, asset_id, workflow_id):
+    def detect_image_labels(bucket, key):
+        return rek.detect_labels(Image={'S3Object':{'Bucket':bucket, 'Name':urllib.parse.unquote_plus(key)}})
+
+    result = process_image_sequence(sequence, operator_name, asset_id, workflow_id, detect_image_labels)
+    for error in result["Errors"]:
+        print("ERROR: image {index}: {message}".format(index=error["Index"], message=error["Message"]))
+    # An empty sequence has no images that failed
+    if not result["Stored"] or (result["Images"] > 0 and len(result["Errors"]) == result["Images"]):
+        output_object.update_workflow_status("Error")
+        output_object.add_workflow_metadata(
+            LabelDetectionError="Unable to detect labels for any image of asset: {asset}".format(asset=asset_id))
+        raise MasExecutionError(output_object.return_output_object())
+    return result
+
+
 # Recognizes labels in a video
 def start_label_detection(bucket, key):
     try:
@@ -62,19 +80,34 @@ def start_label_detection(bucket, key):
 
 # Lambda function entrypoint:
 def lambda_handler(event, context):
+    sequence = None
     try:
-        if "Video" in event["Input"]["Media"]:
+        # A workflow execution can carry several media types, the operation's MediaType chooses the one to process
+        media_type = event["Configuration"]["MediaType"]
+        if media_type == "ImageSequence":
+            sequence = event["Input"]["Media"]["ImageSequence"]
+        elif media_type == "Video":
             s3bucket = event["Input"]["Media"]["Video"]["S3Bucket"]
             s3key = event["Input"]["Media"]["Video"]["S3Key"]
-        elif "Image" in event["Input"]["Media"]:
+        elif media_type == "Image":
             s3bucket = event["Input"]["Media"]["Image"]["S3Bucket"]
             s3key = event["Input"]["Media"]["Image"]["S3Key"]
+        else:
+            raise ValueError("Unsupported media type {}".format(media_type))
         workflow_id = str(event["WorkflowExecutionId"])
         asset_id = event['AssetId']
     except Exception:
         output_object.update_workflow_status("Error")
         output_object.add_workflow_metadata(LabelDetectionError="No valid inputs")
         raise MasExecutionError(output_object.return_output_object())
+    if sequence is not None:
+        # Image sequence processing is synchronous, the images are processed concurrently.
+        print("Processing image sequence s3://"+sequence["S3Bucket"]+"/"+sequence["S3Key"])
+        result = detect_image_sequence_labels(sequence, asset_id, workflow_id)
+        output_object.add_workflow_metadata(AssetId=asset_id, WorkflowExecutionId=workflow_id,
+                                            LabelDetectionImages=result["Images"], LabelDetectionImageErrors=len(result["Errors"]))
+        output_object.update_workflow_status("Complete")
+        return output_object.return_output_object()
     print("Processing s3://"+s3bucket+"/"+s3key)
     valid_video_types = [".avi", ".mp4", ".mov"]
     valid_image_types = [".png", ".jpg", ".jpeg"]
@@ -14,9 +14,16 @@ from datetime import datetime
 import json
 import time
 import decimal
+from concurrent.futures import ThreadPoolExecutor
 from MediaInsightsEngineLambdaHelper import Status as awsmie
 from MediaInsightsEngineLambdaHelper import MediaInsightsOperationHelper
 from MediaInsightsEngineLambdaHelper import MasExecutionError
+from MediaInsightsEngineLambdaHelper import store_workflow_reference
+from MediaInsightsEngineLambdaHelper import load_workflow_reference
+from MediaInsightsEngineLambdaHelper import result_cache_key
+from MediaInsightsEngineLambdaHelper import DataPlane
+from MediaInsightsEngineLambdaHelper import workflow_scheduling
+from boto3.dynamodb.types import TypeSerializer
 
 # Setup logging
 # Logging Configuration
@@ -38,15 +45,59 @@ OPERATION_TABLE_NAME = os.environ["OPERATION_TABLE_NAME"]
 WORKFLOW_EXECUTION_TABLE_NAME = os.environ["WORKFLOW_EXECUTION_TABLE_NAME"]
 STAGE_EXECUTION_QUEUE_URL = os.environ["STAGE_EXECUTION_QUEUE_URL"]
 
+if "HIGH_PRIORITY_STAGE_EXECUTION_QUEUE_URL" in os.environ and os.environ["HIGH_PRIORITY_STAGE_EXECUTION_QUEUE_URL"]:
+    HIGH_PRIORITY_STAGE_EXECUTION_QUEUE_URL = os.environ["HIGH_PRIORITY_STAGE_EXECUTION_QUEUE_URL"]
+else:
+    HIGH_PRIORITY_STAGE_EXECUTION_QUEUE_URL = STAGE_EXECUTION_QUEUE_URL
+
+if "LOW_PRIORITY_STAGE_EXECUTION_QUEUE_URL" in os.environ and os.environ["LOW_PRIORITY_STAGE_EXECUTION_QUEUE_URL"]:
+    LOW_PRIORITY_STAGE_EXECUTION_QUEUE_URL = os.environ["LOW_PRIORITY_STAGE_EXECUTION_QUEUE_URL"]
+else:
+    LOW_PRIORITY_STAGE_EXECUTION_QUEUE_URL = STAGE_EXECUTION_QUEUE_URL
+
 if "WORKFLOW_SCHEDULER_LAMBDA_ARN" in os.environ:
     WORKFLOW_SCHEDULER_LAMBDA_ARN = os.environ["WORKFLOW_SCHEDULER_LAMBDA_ARN"]
 else:
     WORKFLOW_SCHEDULER_LAMBDA_ARN = ""
 
+# Workflow executions submitted asynchronously get their asset from the workflow asset lambda, see
+# workflow_asset_lambda
+if "WORKFLOW_ASSET_LAMBDA_ARN" in os.environ:
+    WORKFLOW_ASSET_LAMBDA_ARN = os.environ["WORKFLOW_ASSET_LAMBDA_ARN"]
+else:
+    WORKFLOW_ASSET_LAMBDA_ARN = ""
+
 if "SYSTEM_TABLE_NAME" in os.environ:
     SYSTEM_TABLE_NAME = os.environ["SYSTEM_TABLE_NAME"]
 else:
-    ""
+    SYSTEM_TABLE_NAME = ""
+
+if "TASK_TOKEN_TABLE_NAME" in os.environ:
+    TASK_TOKEN_TABLE_NAME = os.environ["TASK_TOKEN_TABLE_NAME"]
+else:
+    TASK_TOKEN_TABLE_NAME = ""
+
+if "DATAPLANE_BUCKET" in os.environ:
+    DATAPLANE_BUCKET = os.environ["DATAPLANE_BUCKET"]
+else:
+    DATAPLANE_BUCKET = ""
+
+# The results of operations with CacheResults set are saved in the result cache, see cache_stage_results
+if "RESULT_CACHE_TABLE_NAME" in os.environ:
+    RESULT_CACHE_TABLE_NAME = os.environ["RESULT_CACHE_TABLE_NAME"]
+else:
+    RESULT_CACHE_TABLE_NAME = ""
+
+if "DATAPLANE_TABLE_NAME" in os.environ:
+    DATAPLANE_TABLE_NAME = os.environ["DATAPLANE_TABLE_NAME"]
+else:
+    DATAPLANE_TABLE_NAME = ""
+
+# Globals metadata and stage outputs larger than this many bytes are stored in the dataplane bucket
+if "WORKFLOW_REFERENCE_THRESHOLD_BYTES" in os.environ:
+    WORKFLOW_REFERENCE_THRESHOLD_BYTES = int(os.environ["WORKFLOW_REFERENCE_THRESHOLD_BYTES"])
+else:
+    WORKFLOW_REFERENCE_THRESHOLD_BYTES = 32768
 
 if "DEFAULT_MAX_CONCURRENT_WORKFLOWS" in os.environ:
     DEFAULT_MAX_CONCURRENT_WORKFLOWS = int(os.environ["DEFAULT_MAX_CONCURRENT_WORKFLOWS"])
@@ -67,6 +118,97 @@ SQS_CLIENT = boto3.client('sqs')
 # Lambda
 LAMBDA_CLIENT = boto3.client("lambda")
 
+# Workflow execution status changes, slot releases and scheduler triggers shared with the workflow api
+WORKFLOW_SCHEDULING = workflow_scheduling.WorkflowScheduling(SYSTEM_TABLE_NAME, WORKFLOW_EXECUTION_TABLE_NAME,
+                                                             WORKFLOW_SCHEDULER_LAMBDA_ARN)
+
+# Workflow slots are accounted for in the system table.  The RunningWorkflows counter holds the number of
+# workflows that currently own a slot and each admitted workflow execution owns a lease item listing the
+# counters it incremented, so that the slot is released exactly once however many times the workflow is
+# marked complete or failed.
+RUNNING_WORKFLOWS_COUNTER = "RunningWorkflows"
+WORKFLOW_SLOT_PREFIX = workflow_scheduling.WORKFLOW_SLOT_PREFIX
+# Operations limited by the MaxConcurrentOperations configuration have a counter of their own.  A workflow
+# takes a slot on each limited operation it will run when it is admitted and gives it back as soon as the
+# last stage that runs the operation completes.
+OPERATION_COUNTER_PREFIX = "RunningOperations:"
+SLOT_TRANSACTION_ATTEMPTS = workflow_scheduling.SLOT_TRANSACTION_ATTEMPTS
+
+# Scheduler queue reads long poll briefly so an empty response means the queue really is empty, and
+# admitted workflows are started on a bounded pool of threads
+SCHEDULER_RECEIVE_WAIT_SECONDS = 1
+SCHEDULER_MAX_START_WORKERS = 10
+
+# Workflows waiting only on an operation limit are hidden from the queue for a while so the scheduler can
+# admit workflows behind them, up to a limit per scheduler run
+SCHEDULER_DEFER_SECONDS = 15
+SCHEDULER_MAX_DEFERRED = 100
+
+# The scheduler's admission limit adapts to throttling (AIMD).  The limit grows by 1/limit for each stage
+# that completes cleanly and is cut in half, at most once per cooldown period, when an operation fails with
+# a throttling error.  MaxConcurrentWorkflows is the ceiling.  The controller state is kept in the system
+# table so it can be read through the system configuration API.
+ADAPTIVE_CONCURRENCY_LIMIT = "AdaptiveConcurrencyLimit"
+THROTTLING_ERRORS = ["ThrottlingException", "ProvisionedThroughputExceeded", "LimitExceededException"]
+AIMD_DECREASE_FACTOR = 0.5
+AIMD_DECREASE_COOLDOWN_SECONDS = 60
+
+# Scheduler invocations are coalesced, see trigger_workflow_scheduler
+SCHEDULER_TRIGGER = workflow_scheduling.SCHEDULER_TRIGGER
+
+# Workflow executions are queued by priority, from highest to lowest.  Priorities without a queue of their
+# own share the Normal priority queue.  The scheduler shares free slots between the queues by weight,
+# using smooth weighted round robin over batches of messages, or drains them in order in Strict mode.
+# The round robin credits are carried from one scheduler run to the next in the statistics item.
+WORKFLOW_PRIORITIES = ["High", "Normal", "Low"]
+PRIORITY_QUEUE_URLS = {
+    "High": HIGH_PRIORITY_STAGE_EXECUTION_QUEUE_URL,
+    "Normal": STAGE_EXECUTION_QUEUE_URL,
+    "Low": LOW_PRIORITY_STAGE_EXECUTION_QUEUE_URL
+}
+PRIORITY_SCHEDULING = "PriorityScheduling"
+PRIORITY_MODE_WEIGHTED = "Weighted"
+PRIORITY_MODE_STRICT = "Strict"
+DEFAULT_PRIORITY_WEIGHTS = {"High": 6, "Normal": 3, "Low": 1}
+SCHEDULER_QUEUE_STATISTICS = "SchedulerQueueStatistics"
+
+# Workflow executions belong to a tenant.  Each tenant has a counter of its running workflows, taken with
+# the workflow slot and capped by the tenant's MaxConcurrentWorkflows in the TenantConfiguration, and a
+# counter of its workflows queued at each priority.  Within a priority queue the scheduler admits workflows
+# by weighted fair queuing across tenants.  Workflows of a tenant that holds its weighted share of the slots
+# while another tenant with queued workflows holds less are hidden for a while, so the scheduler reaches
+# the other tenants' workflows further back in the queue.
+DEFAULT_TENANT = "default"
+TENANT_CONFIGURATION = "TenantConfiguration"
+RUNNING_TENANT_COUNTER_PREFIX = "RunningTenant:"
+QUEUED_TENANT_COUNTER_PREFIX = "QueuedTenant:"
+# Tenant counters are read by key, a BatchGetItem call reads at most 100 items
+BATCH_GET_MAX_KEYS = 100
+BATCH_GET_RETRY_SECONDS = 0.1
+SCHEDULER_FAIR_SHARE_DEFER_SECONDS = 60
+
+# A state machine that ends without reaching the complete stage lambda, because it timed out, a lambda
+# crashed or it was stopped by hand, leaves its workflow execution Started and holding its slot.  The
+# reaper runs on a schedule, checks the state machine of every Started workflow execution and marks the
+# ones whose state machine ended as Error or Timed Out, releasing their slots.  It also releases the
+# slots of workflow executions that already ended.  The outcome of each run is kept in the statistics item.
+REAPER_STATISTICS = "WorkflowReaperStatistics"
+REAPER_MAX_WORKERS = 10
+# A workflow execution that holds a slot but is still Queued this long after it was admitted was lost on its
+# way to its state machine, for instance when the workflow asset lambda timed out copying its media.  The
+# reaper marks it as Error.  This covers the age limit of an asynchronous invocation of the workflow asset
+# lambda and its timeout, see WorkflowAssetLambda in the stack template.
+WORKFLOW_START_TIMEOUT_SECONDS = 45 * 60
+
+# Workflow executions of an image sequence process a set of images with one asset, see create_asset in the
+# dataplane api
+IMAGE_SEQUENCE_MEDIA_TYPE = "ImageSequence"
+
+# Async operators in callback mode wait on a Step Functions task token instead of polling.  The token and
+# the job completion notification are matched up by job id in the task token table, whichever arrives
+# second resumes the state machine.  Items expire so the table doesn't keep jobs nobody waits for.
+TASK_TOKEN_EXPIRATION_SECONDS = 7 * 24 * 60 * 60
+
 
 def list_workflow_executions_by_status(Status):
     table = DYNAMO_RESOURCE.Table(WORKFLOW_EXECUTION_TABLE_NAME)
@@ -87,112 +229,1235 @@ def list_workflow_executions_by_status(Status):
     
     workflow_executions = response['Items']
     while 'LastEvaluatedKey' in response:
-        response = table.query(ExclusiveStartKey=response['LastEvaluatedKey'])
+        response = table.query(
+            IndexName='WorkflowExecutionStatus',
+            ExpressionAttributeNames={
+                '#workflow_status': "Status",
+                '#workflow_name': "Name"
+            },
+            ExpressionAttributeValues={
+                ':workflow_status': Status
+            },
+            KeyConditionExpression='#workflow_status = :workflow_status',
+            ProjectionExpression = projection_expression,
+            ExclusiveStartKey=response['LastEvaluatedKey']
+            )
         workflow_executions.extend(response['Items'])
 
     return workflow_executions
 
-def workflow_scheduler_lambda(event, context):
+def get_system_counter(name):
+    response = DYNAMO_CLIENT.get_item(
+        TableName=SYSTEM_TABLE_NAME,
+        Key={
+            'Name': {'S': name}
+        },
+        ConsistentRead=True)
+
+    if "Item" in response and "Value" in response["Item"]:
+        return int(response["Item"]["Value"]["N"])
+    return 0
+
+
+def transaction_conflicted(e):
+    # A cancelled transaction is only worth retrying if it lost a race, not if a condition failed
+    reasons = e.response.get("CancellationReasons", [])
+    return any(reason.get("Code") == "TransactionConflict" for reason in reasons)
 
-    execution_table = DYNAMO_RESOURCE.Table(WORKFLOW_EXECUTION_TABLE_NAME)
-    arn = ""
-    workflow_execution = {}
-    MaxConcurrentWorkflows = DEFAULT_MAX_CONCURRENT_WORKFLOWS
-    empty = False
 
+def acquire_workflow_slot(workflow_execution_id, limits, dequeued=None):
+    """
+    Atomically take a slot on every counter in limits for a workflow execution
+    :param workflow_execution_id: The id of the workflow execution being admitted
+    :param limits: Dict of counter name to the maximum value the counter may reach
+    :param dequeued: Optional counter of queued workflows to decrement when the slot is acquired
+    :return: List of the counters that are at their limit, empty if the slot was acquired
+    """
+    counters = list(limits.keys())
+    transact_items = [
+        {
+            'Put': {
+                'TableName': SYSTEM_TABLE_NAME,
+                'Item': {
+                    'Name': {'S': WORKFLOW_SLOT_PREFIX + workflow_execution_id},
+                    'Counters': {'SS': counters},
+                    'Acquired': {'N': str(int(time.time()))}
+                },
+                'ConditionExpression': 'attribute_not_exists(#name)',
+                'ExpressionAttributeNames': {'#name': 'Name'}
+            }
+        }
+    ]
+    for counter in counters:
+        transact_items.append({
+            'Update': {
+                'TableName': SYSTEM_TABLE_NAME,
+                'Key': {'Name': {'S': counter}},
+                'UpdateExpression': 'ADD #value :one',
+                'ConditionExpression': 'attribute_not_exists(#value) OR #value < :limit',
+                'ExpressionAttributeNames': {'#value': 'Value'},
+                'ExpressionAttributeValues': {':one': {'N': '1'}, ':limit': {'N': str(int(limits[counter]))}}
+            }
+        })
+    if dequeued is not None:
+        # Last, so the cancellation reasons of the limited counters still line up
+        transact_items.append({
+            'Update': {
+                'TableName': SYSTEM_TABLE_NAME,
+                'Key': {'Name': {'S': dequeued}},
+                'UpdateExpression': 'ADD #value :minus_one',
+                'ExpressionAttributeNames': {'#value': 'Value'},
+                'ExpressionAttributeValues': {':minus_one': {'N': '-1'}}
+            }
+        })
+
+    blocked = []
+    for attempt in range(SLOT_TRANSACTION_ATTEMPTS):
+        try:
+            DYNAMO_CLIENT.transact_write_items(TransactItems=transact_items)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'TransactionCanceledException':
+                raise
+            reasons = e.response.get("CancellationReasons", [])
+            if reasons and reasons[0].get("Code") == "ConditionalCheckFailed":
+                # The lease already exists, the execution was admitted before and its message delivered again
+                logger.info("Workflow execution {} already holds a slot".format(workflow_execution_id))
+                return []
+            # Cancellation reasons line up with the transaction items, the first item is the lease
+            blocked = [counter for counter, reason in zip(counters, reasons[1:]) if reason.get("Code") == "ConditionalCheckFailed"]
+            if not transaction_conflicted(e):
+                return blocked
+        else:
+            return []
+    return blocked or counters
+
+
+def release_workflow_slot(workflow_execution_id):
+    """
+    Release the slot held by a workflow execution, if it holds one
+    :param workflow_execution_id: The id of the workflow execution
+    :return: True if a slot was released
+    """
+    return WORKFLOW_SCHEDULING.release_workflow_slot(workflow_execution_id)
+
+
+def release_operation_slots(workflow_execution_id, operations):
+    """
+    Release the operation slots a workflow execution holds for the given operations, keeping its
+    workflow slot and any other operation slots
+    :param workflow_execution_id: The id of the workflow execution
+    :param operations: List of operation names whose slots can be released
+    """
+    counters = [OPERATION_COUNTER_PREFIX + operation for operation in operations]
+    if not counters:
+        return
+
+    transact_items = [
+        {
+            'Update': {
+                'TableName': SYSTEM_TABLE_NAME,
+                'Key': {'Name': {'S': WORKFLOW_SLOT_PREFIX + workflow_execution_id}},
+                'UpdateExpression': 'DELETE #counters :counters',
+                'ConditionExpression': ' AND '.join(['contains(#counters, :counter{})'.format(i) for i in range(len(counters))]),
+                'ExpressionAttributeNames': {'#counters': 'Counters'},
+                'ExpressionAttributeValues': dict([(':counters', {'SS': counters})] + [(':counter{}'.format(i), {'S': counter}) for i, counter in enumerate(counters)])
+            }
+        }
+    ]
+    for counter in counters:
+        transact_items.append({
+            'Update': {
+                'TableName': SYSTEM_TABLE_NAME,
+                'Key': {'Name': {'S': counter}},
+                'UpdateExpression': 'ADD #value :minus_one',
+                'ExpressionAttributeNames': {'#value': 'Value'},
+                'ExpressionAttributeValues': {':minus_one': {'N': '-1'}}
+            }
+        })
+
+    for attempt in range(SLOT_TRANSACTION_ATTEMPTS):
+        try:
+            DYNAMO_CLIENT.transact_write_items(TransactItems=transact_items)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'TransactionCanceledException':
+                raise
+            if not transaction_conflicted(e):
+                # The slots were already released
+                return
+        else:
+            logger.info("Released operation slots {} for {}".format(operations, workflow_execution_id))
+            return
+
+
+def get_max_concurrent_workflows():
+    # Get the MaxConcurrent configruation parameter, if it is not set, use the default
+    system_table = DYNAMO_RESOURCE.Table(SYSTEM_TABLE_NAME)
+    response = system_table.get_item(
+        Key={
+            'Name': 'MaxConcurrentWorkflows'
+        },
+        ConsistentRead=True)
+
+    if "Item" in response:
+        logger.info("Got MaxConcurrentWorkflows = {}".format(response["Item"]["Value"]))
+        return int(response["Item"]["Value"])
+    return DEFAULT_MAX_CONCURRENT_WORKFLOWS
+
+
+def get_adaptive_concurrency_limit(ceiling):
+    system_table = DYNAMO_RESOURCE.Table(SYSTEM_TABLE_NAME)
+    response = system_table.get_item(
+        Key={
+            'Name': ADAPTIVE_CONCURRENCY_LIMIT
+        },
+        ConsistentRead=True)
+
+    if "Item" in response:
+        return min(ceiling, max(1, int(response["Item"]["Value"])))
+    return ceiling
+
+
+def operation_throttled(operation):
+    """
+    Check if a failed operation reported a throttling error in its message or metadata
+    """
+    if operation["Status"] != awsmie.OPERATION_STATUS_ERROR:
+        return False
+    reported = json.dumps(operation.get("MetaData", {}), default=str) + str(operation.get("Message", ""))
+    return any(error in reported for error in THROTTLING_ERRORS)
+
+
+def adjust_adaptive_concurrency_limit(throttled):
+    """
+    Raise the adaptive concurrency limit additively after a clean stage, or cut it multiplicatively after
+    a throttled one
+    :param throttled: True if an operation in the stage failed because it was throttled
+    """
+    ceiling = get_max_concurrent_workflows()
+    system_table = DYNAMO_RESOURCE.Table(SYSTEM_TABLE_NAME)
+    response = system_table.get_item(
+        Key={
+            'Name': ADAPTIVE_CONCURRENCY_LIMIT
+        },
+        ConsistentRead=True)
+
+    now = int(time.time())
+    if "Item" in response:
+        limit = float(response["Item"]["Value"])
+        last_decrease = int(response["Item"].get("LastDecrease", 0))
+    else:
+        limit = float(ceiling)
+        last_decrease = 0
+
+    if throttled:
+        if now - last_decrease < AIMD_DECREASE_COOLDOWN_SECONDS:
+            logger.info("Adaptive concurrency limit was decreased less than {} seconds ago".format(AIMD_DECREASE_COOLDOWN_SECONDS))
+            return
+        new_limit = max(1.0, min(limit, ceiling) * AIMD_DECREASE_FACTOR)
+        last_decrease = now
+    else:
+        new_limit = min(float(ceiling), limit + 1.0 / limit)
+        if new_limit == limit:
+            return
+
+    item = {
+        "Name": ADAPTIVE_CONCURRENCY_LIMIT,
+        "Value": decimal.Decimal(str(round(new_limit, 3))),
+        "Ceiling": ceiling,
+        "LastDecrease": last_decrease
+    }
     try:
-        print(json.dumps(event))
+        # Only replace the state that was read, a concurrent adjustment wins
+        if "Item" in response:
+            system_table.put_item(
+                Item=item,
+                ConditionExpression='#value = :value',
+                ExpressionAttributeNames={'#value': 'Value'},
+                ExpressionAttributeValues={':value': response["Item"]["Value"]}
+            )
+        else:
+            system_table.put_item(
+                Item=item,
+                ConditionExpression='attribute_not_exists(#name)',
+                ExpressionAttributeNames={'#name': 'Name'}
+            )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        logger.info("Adaptive concurrency limit was adjusted concurrently")
+        return
+
+    logger.info("Adaptive concurrency limit {} -> {} (ceiling {}, throttled {})".format(limit, new_limit, ceiling, throttled))
+
+
+def get_max_concurrent_operations():
+    """
+    Get the per operation concurrency limits from the MaxConcurrentOperations system configuration
+    :return: Dict of operation name to the maximum number of workflows that may run it concurrently
+    """
+    system_table = DYNAMO_RESOURCE.Table(SYSTEM_TABLE_NAME)
+    response = system_table.get_item(
+        Key={
+            'Name': 'MaxConcurrentOperations'
+        },
+        ConsistentRead=True)
+
+    if "Item" in response:
+        return dict((operation, int(limit)) for operation, limit in response["Item"]["Value"].items())
+    return {}
+
+
+def enabled_operations(stage):
+    operations = []
+    if "Configuration" in stage:
+        for operation, configuration in stage["Configuration"].items():
+            if "Enabled" not in configuration or configuration["Enabled"] == True:
+                operations.append(operation)
+    return operations
 
-        # Get the MaxConcurrent configruation parameter, if it is not set, use the default
-        system_table = DYNAMO_RESOURCE.Table(SYSTEM_TABLE_NAME)
 
-        # Check if any configuration has been added yet
-        response = system_table.get_item(
+def get_tenant_configuration():
+    """
+    Get the per tenant scheduling settings from the TenantConfiguration system configuration
+    :return: Dict of tenant to a dict with the tenant's "Weight" and optional "MaxConcurrentWorkflows"
+    """
+    system_table = DYNAMO_RESOURCE.Table(SYSTEM_TABLE_NAME)
+    response = system_table.get_item(
+        Key={
+            'Name': TENANT_CONFIGURATION
+        },
+        ConsistentRead=True)
+
+    tenants = {}
+    if "Item" in response:
+        for tenant, configuration in response["Item"]["Value"].items():
+            tenants[tenant] = {"Weight": max(1, int(configuration.get("Weight", 1)))}
+            if "MaxConcurrentWorkflows" in configuration:
+                tenants[tenant]["MaxConcurrentWorkflows"] = int(configuration["MaxConcurrentWorkflows"])
+    return tenants
+
+
+def get_tenant_counters(tenants):
+    """
+    Read the running and queued workflow counters of the default tenant, of the configured tenants and of the
+    tenants the workflow api registered when it queued their workflows
+    :param tenants: The tenant configuration, see get_tenant_configuration
+    :return: Tuple of a dict of tenant to running workflows and a dict of priority to a dict of tenant to
+             queued workflows
+    """
+    response = DYNAMO_CLIENT.get_item(
+        TableName=SYSTEM_TABLE_NAME,
+        Key={
+            'Name': {'S': workflow_scheduling.SCHEDULER_TENANTS}
+        },
+        ConsistentRead=True)
+    names = set([DEFAULT_TENANT] + list(tenants.keys()))
+    if "Item" in response and "Value" in response["Item"]:
+        names.update(response["Item"]["Value"]["SS"])
+
+    keys = []
+    for tenant in names:
+        keys.append(RUNNING_TENANT_COUNTER_PREFIX + tenant)
+        for priority in WORKFLOW_PRIORITIES:
+            keys.append(QUEUED_TENANT_COUNTER_PREFIX + priority + ":" + tenant)
+
+    running = {}
+    queued = dict((priority, {}) for priority in WORKFLOW_PRIORITIES)
+    for start in range(0, len(keys), BATCH_GET_MAX_KEYS):
+        request = {
+            SYSTEM_TABLE_NAME: {
+                'Keys': [{'Name': {'S': key}} for key in keys[start:start + BATCH_GET_MAX_KEYS]],
+                'ConsistentRead': True
+            }
+        }
+        while request:
+            response = DYNAMO_CLIENT.batch_get_item(RequestItems=request)
+            for item in response["Responses"].get(SYSTEM_TABLE_NAME, []):
+                name = item["Name"]["S"]
+                # Counters can briefly go negative when a workflow is admitted before its queuing is counted
+                value = max(0, int(item["Value"]["N"])) if "Value" in item else 0
+                if name.startswith(RUNNING_TENANT_COUNTER_PREFIX):
+                    running[name[len(RUNNING_TENANT_COUNTER_PREFIX):]] = value
+                else:
+                    priority, tenant = name[len(QUEUED_TENANT_COUNTER_PREFIX):].split(":", 1)
+                    queued[priority][tenant] = value
+            request = response.get("UnprocessedKeys")
+            if request:
+                time.sleep(BATCH_GET_RETRY_SECONDS)
+    return running, queued
+
+
+def tenant_weight(tenants, tenant):
+    if tenant in tenants:
+        return tenants[tenant]["Weight"]
+    return 1
+
+
+def tenant_over_fair_share(tenant, queue_url, MaxConcurrentWorkflows, tenants, running, queued):
+    """
+    Check if a tenant holds at least its weighted share of the workflow slots while another tenant with
+    workflows queued on the same queue holds less than its share
+    :param queued: Dict of priority to a dict of tenant to queued workflows
+    """
+    waiting = {}
+    for priority in WORKFLOW_PRIORITIES:
+        if PRIORITY_QUEUE_URLS[priority] == queue_url:
+            for other, count in queued[priority].items():
+                waiting[other] = waiting.get(other, 0) + count
+
+    active = set([tenant] + [other for other, count in running.items() if count > 0] + [other for other, count in waiting.items() if count > 0])
+    total_weight = float(sum([tenant_weight(tenants, other) for other in active]))
+
+    def fair_share(other):
+        share = MaxConcurrentWorkflows * tenant_weight(tenants, other) / total_weight
+        if other in tenants and "MaxConcurrentWorkflows" in tenants[other]:
+            share = min(share, tenants[other]["MaxConcurrentWorkflows"])
+        return share
+
+    if running.get(tenant, 0) < fair_share(tenant):
+        return False
+    return any([other != tenant and waiting.get(other, 0) > 0 and running.get(other, 0) < fair_share(other) for other in active])
+
+
+def workflow_slot_limits(workflow_execution, MaxConcurrentWorkflows, MaxConcurrentOperations, tenants):
+    """
+    Build the counters a workflow execution needs a slot on: the workflow slot, the slot of its tenant and
+    a slot for each limited operation that is enabled in any of its stages
+    """
+    limits = {RUNNING_WORKFLOWS_COUNTER: MaxConcurrentWorkflows}
+    tenant = workflow_execution.get("Tenant", DEFAULT_TENANT)
+    if tenant in tenants and "MaxConcurrentWorkflows" in tenants[tenant]:
+        limits[RUNNING_TENANT_COUNTER_PREFIX + tenant] = tenants[tenant]["MaxConcurrentWorkflows"]
+    else:
+        limits[RUNNING_TENANT_COUNTER_PREFIX + tenant] = MaxConcurrentWorkflows
+    for stage in workflow_execution["Workflow"]["Stages"].values():
+        for operation in enabled_operations(stage):
+            if operation in MaxConcurrentOperations:
+                limits[OPERATION_COUNTER_PREFIX + operation] = MaxConcurrentOperations[operation]
+    return limits
+
+
+def release_stage_operation_slots(workflow_execution, stage_name):
+    """
+    Release the operation slots of a completed stage that no stage still to run needs
+    """
+    stages = workflow_execution["Workflow"]["Stages"]
+    later_operations = []
+    for name, stage in stages.items():
+        # Stages of the same workflow may run in parallel, their operations are still needed too
+        if name != stage_name and stage["Status"] in [awsmie.STAGE_STATUS_NOT_STARTED, awsmie.STAGE_STATUS_STARTED, awsmie.STAGE_STATUS_EXECUTING]:
+            later_operations.extend(enabled_operations(stage))
+    operations = [operation for operation in enabled_operations(stages[stage_name]) if operation not in later_operations]
+    if operations:
+        try:
+            release_operation_slots(workflow_execution["Id"], operations)
+        except Exception as e:
+            # The remaining slots are released with the workflow slot when the workflow ends
+            logger.info("Exception releasing operation slots {}".format(e))
+
+
+def hand_off_workflow_execution(workflow_execution):
+    """
+    Start an admitted workflow execution, or hand a workflow execution that still needs its asset to the
+    workflow asset lambda, which starts it once the asset is created.  Runs on the scheduler's thread pool,
+    so it only uses the thread safe low level clients.
+    :param workflow_execution: The workflow execution taken off the queue
+    :return: None if the workflow execution was handed off, otherwise the error message
+    """
+    if "DeferredInput" not in workflow_execution:
+        return start_workflow_execution(workflow_execution)
+
+    try:
+        # The invocation is queued by Lambda, so the message can be deleted once it is accepted
+        LAMBDA_CLIENT.invoke(
+            FunctionName=WORKFLOW_ASSET_LAMBDA_ARN,
+            InvocationType='Event',
+            Payload=json.dumps(workflow_execution)
+        )
+    except Exception as e:
+        return "Exception invoking the workflow asset lambda for workflow execution {}: {}".format(workflow_execution["Id"], e)
+
+    logger.info("Handed workflow execution {} to the workflow asset lambda".format(workflow_execution["Id"]))
+    return None
+
+
+def start_workflow_execution(workflow_execution):
+    """
+    Start the state machine for an admitted workflow execution and record it as started.  Runs on the
+    scheduler's thread pool, so it only uses the thread safe low level clients.
+    :param workflow_execution: The workflow execution taken off the queue
+    :return: None if the workflow started, otherwise the error message
+    """
+    name = workflow_execution["Workflow"]["Name"]+workflow_execution["Id"]
+    # A resumed workflow execution starts a new state machine execution, see resume_workflow_execution in the
+    # workflow api
+    if "ResumeCount" in workflow_execution:
+        name += "-{}".format(workflow_execution["ResumeCount"])
+
+    try:
+        # Kick off the state machine for the workflow
+        response = SFN_CLIENT.start_execution(
+            stateMachineArn=workflow_execution["Workflow"]["StateMachineArn"],
+            name=name,
+            input=json.dumps(workflow_execution["Workflow"]["Stages"][workflow_execution["CurrentStage"]])
+        )
+    except SFN_CLIENT.exceptions.ExecutionAlreadyExists as e:
+        # The message was delivered again after the workflow had already been started.  The scheduler may have
+        # stopped before it recorded the state machine, so record it now.
+        logger.info("State machine for workflow execution {} was already started: {}".format(workflow_execution["Id"], e))
+        response = {
+            "executionArn": "{}:{}".format(workflow_execution["Workflow"]["StateMachineArn"].replace(":stateMachine:", ":execution:", 1), name)
+        }
+    except Exception as e:
+        return "Exception in workflow_scheduler_lambda {}".format(e)
+
+    workflow_execution["StateMachineExecutionArn"] = response["executionArn"]
+
+    try:
+        # Set the status and the state machine id in one update.  The condition keeps a workflow that
+        # already ran to completion from being put back into the Started state.
+        DYNAMO_CLIENT.update_item(
+            TableName=WORKFLOW_EXECUTION_TABLE_NAME,
             Key={
-                'Name': 'MaxConcurrentWorkflows'
+                'Id': {'S': workflow_execution["Id"]}
             },
-            ConsistentRead=True)
+            UpdateExpression='SET #workflow_status = :started, StateMachineExecutionArn = :arn, Workflow.Stages.#stage.Metrics.QueuedTime = :queued_time, Workflow.Stages.#stage.Metrics.StartTime = :start_time',
+            ConditionExpression='#workflow_status = :queued',
+            ExpressionAttributeNames={
+                '#workflow_status': "Status",
+                '#stage': workflow_execution["CurrentStage"]
+            },
+            ExpressionAttributeValues={
+                ':started': {'S': awsmie.WORKFLOW_STATUS_STARTED},
+                ':queued': {'S': awsmie.WORKFLOW_STATUS_QUEUED},
+                ':arn': {'S': response["executionArn"]},
+                ':queued_time': {'N': str(metrics_timestamp(float(workflow_execution["Created"])))},
+                ':start_time': {'N': str(metrics_timestamp())}
+            }
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            return "Exception in workflow_scheduler_lambda {}".format(e)
+        try:
+            DYNAMO_CLIENT.update_item(
+                TableName=WORKFLOW_EXECUTION_TABLE_NAME,
+                Key={
+                    'Id': {'S': workflow_execution["Id"]}
+                },
+                UpdateExpression='SET StateMachineExecutionArn = :arn',
+                ConditionExpression='#workflow_status <> :cancelled',
+                ExpressionAttributeNames={
+                    '#workflow_status': "Status"
+                },
+                ExpressionAttributeValues={
+                    ':arn': {'S': response["executionArn"]},
+                    ':cancelled': {'S': awsmie.WORKFLOW_STATUS_CANCELLED}
+                }
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                return "Exception in workflow_scheduler_lambda {}".format(e)
+            # The workflow execution was cancelled while it was being started
+            logger.info("Workflow execution {} was cancelled, stopping its state machine".format(workflow_execution["Id"]))
+            SFN_CLIENT.stop_execution(executionArn=response["executionArn"], error="Cancelled",
+                                      cause="Workflow execution {} was cancelled".format(workflow_execution["Id"]))
+            release_workflow_slot(workflow_execution["Id"])
+            return None
 
-        if "Item" in response:
-            MaxConcurrentWorkflows = response["Item"]["Value"]
-            logger.info("Got MaxConcurrentWorkflows = {}".format(response["Item"]["Value"]))
+    logger.info("Started workflow execution {}".format(workflow_execution["Id"]))
+    return None
+
+
+def workflow_asset_lambda(event, context):
+    """
+    Create the asset of a workflow execution that was submitted asynchronously and start its state machine.
+    The workflow scheduler invokes this lambda for each such workflow execution it admits, so the copies of
+    large media don't hold up the scheduler.  A workflow execution this lambda doesn't start is marked as
+    Error by the reaper, see WORKFLOW_START_TIMEOUT_SECONDS.
+    :param event: The workflow execution taken off the queue
+    """
+    workflow_execution = event
+    logger.info("Workflow asset event for workflow execution {}".format(workflow_execution["Id"]))
+
+    try:
+        if not create_deferred_asset(workflow_execution, DataPlane()):
+            return
+    except Exception as e:
+        error = "Exception creating the asset of workflow execution {}: {}".format(workflow_execution["Id"], e)
+    else:
+        error = start_workflow_execution(workflow_execution)
+
+    if error is not None:
+        logger.info(error)
+        update_workflow_execution_status(workflow_execution["Id"], awsmie.WORKFLOW_STATUS_ERROR, error)
+
+
+def deferred_asset_pending(workflow_execution_id):
+    """
+    Check that a workflow execution is still Queued without its asset.  A workflow execution that was
+    cancelled after it took its slot gives the slot back.
+    :param workflow_execution_id: The id of the workflow execution
+    :return: True if the asset still needs to be created
+    """
+    response = DYNAMO_CLIENT.get_item(
+        TableName=WORKFLOW_EXECUTION_TABLE_NAME,
+        Key={'Id': {'S': workflow_execution_id}},
+        ProjectionExpression='#workflow_status, AssetId',
+        ExpressionAttributeNames={'#workflow_status': "Status"},
+        ConsistentRead=True
+    )
+    status = response["Item"]["Status"]["S"] if "Item" in response else None
+    if status == awsmie.WORKFLOW_STATUS_QUEUED and "AssetId" not in response["Item"]:
+        return True
+
+    logger.info("Workflow execution {} has status {}, not creating its asset".format(workflow_execution_id, status))
+    if status == awsmie.WORKFLOW_STATUS_CANCELLED:
+        release_workflow_slot(workflow_execution_id)
+    return False
+
+
+def create_deferred_asset(workflow_execution, dataplane):
+    """
+    Create the asset of a workflow execution that was submitted without waiting for it, copying the input
+    media to the dataplane, and record it on the workflow execution.  This is the first step of the
+    workflow execution, it runs once the workflow holds a slot so the copies of large media are limited
+    by MaxConcurrentWorkflows.
+    :param workflow_execution: The workflow execution taken off the queue, updated in place
+    :param dataplane: The DataPlane to create the asset with
+    :return: False if the workflow execution is no longer queued or already has its asset
+    """
+    # The message of the workflow execution may have been delivered again after it was handed off
+    if not deferred_asset_pending(workflow_execution["Id"]):
+        return False
+
+    media = workflow_execution["DeferredInput"]["Media"]
+    media_type = list(media.keys())[0]
+    if media_type == IMAGE_SEQUENCE_MEDIA_TYPE:
+        asset_creation = dataplane.create_image_sequence_asset(media[media_type].get("Items"), media[media_type].get("S3Bucket"), media[media_type].get("S3Prefix"))
+    else:
+        asset_creation = dataplane.create_asset(media[media_type]["S3Bucket"], media[media_type]["S3Key"])
+    if "AssetId" not in asset_creation:
+        raise Exception("Unable to create asset: {}".format(asset_creation))
+    asset_id = asset_creation["AssetId"]
+    logger.info("Created asset {} for workflow execution {}".format(asset_id, workflow_execution["Id"]))
+
+    workflow_execution["AssetId"] = asset_id
+    workflow_execution["Globals"]["Media"][media_type] = {
+        "S3Bucket": asset_creation["S3Bucket"],
+        "S3Key": asset_creation["S3Key"]
+    }
+    for stage in workflow_execution["Workflow"]["Stages"].values():
+        stage["AssetId"] = asset_id
+    workflow_execution["Workflow"]["Stages"][workflow_execution["CurrentStage"]]["Input"] = workflow_execution["Globals"]
+    del workflow_execution["DeferredInput"]
+
+    update_expression = 'SET AssetId = :asset_id, Globals = :globals, Workflow = :workflow'
+    values = {
+        ':asset_id': asset_id,
+        ':globals': workflow_execution["Globals"],
+        ':workflow': workflow_execution["Workflow"],
+        ':queued': awsmie.WORKFLOW_STATUS_QUEUED
+    }
+    if asset_creation.get("Fingerprint"):
+        workflow_execution["Fingerprint"] = asset_creation["Fingerprint"]
+        update_expression += ', Fingerprint = :fingerprint'
+        values[':fingerprint'] = asset_creation["Fingerprint"]
+
+    serializer = TypeSerializer()
+    try:
+        DYNAMO_CLIENT.update_item(
+            TableName=WORKFLOW_EXECUTION_TABLE_NAME,
+            Key={
+                'Id': {'S': workflow_execution["Id"]}
+            },
+            UpdateExpression=update_expression + ' REMOVE DeferredInput',
+            ConditionExpression='#workflow_status = :queued AND attribute_exists(DeferredInput)',
+            ExpressionAttributeNames={
+                '#workflow_status': "Status"
+            },
+            ExpressionAttributeValues=dict((name, serializer.serialize(value)) for name, value in dynamo_value(values).items())
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        # The workflow execution was cancelled or got its asset while the media was copied
+        deferred_asset_pending(workflow_execution["Id"])
+        return False
 
-        # Check if there are slots to run a workflow 
-        # FIXME - we really need consistent read here.  Index query is not consistent read
-        started_workflows = list_workflow_executions_by_status(awsmie.WORKFLOW_STATUS_STARTED) 
-        num_started_workflows = len(started_workflows)
+    return True
+
+
+def get_priority_scheduling():
+    """
+    Get the PriorityScheduling system configuration
+    :return: Tuple of the scheduling mode and a dict of priority to weight
+    """
+    system_table = DYNAMO_RESOURCE.Table(SYSTEM_TABLE_NAME)
+    response = system_table.get_item(
+        Key={
+            'Name': PRIORITY_SCHEDULING
+        },
+        ConsistentRead=True)
+
+    mode = PRIORITY_MODE_WEIGHTED
+    weights = dict(DEFAULT_PRIORITY_WEIGHTS)
+    if "Item" in response:
+        if "Mode" in response["Item"]["Value"]:
+            mode = response["Item"]["Value"]["Mode"]
+        for priority, weight in response["Item"]["Value"].get("Weights", {}).items():
+            if priority in weights:
+                weights[priority] = max(1, int(weight))
+    return mode, weights
+
+
+def priority_queues():
+    # Each queue is drawn from once, under the highest priority that uses it
+    priorities = []
+    for priority in WORKFLOW_PRIORITIES:
+        if PRIORITY_QUEUE_URLS[priority] not in [PRIORITY_QUEUE_URLS[p] for p in priorities]:
+            priorities.append(priority)
+    return priorities
+
+
+def get_priority_queue_depths(priorities):
+    depths = {}
+    for priority in priorities:
+        response = SQS_CLIENT.get_queue_attributes(
+            QueueUrl=PRIORITY_QUEUE_URLS[priority],
+            AttributeNames=['ApproximateNumberOfMessages', 'ApproximateNumberOfMessagesNotVisible']
+        )
+        depths[priority] = {
+            "Depth": int(response["Attributes"]["ApproximateNumberOfMessages"]),
+            "NotVisible": int(response["Attributes"]["ApproximateNumberOfMessagesNotVisible"])
+        }
+    return depths
+
+
+def get_priority_credits():
+    system_table = DYNAMO_RESOURCE.Table(SYSTEM_TABLE_NAME)
+    response = system_table.get_item(
+        Key={
+            'Name': SCHEDULER_QUEUE_STATISTICS
+        },
+        ConsistentRead=True)
+
+    credits = dict((priority, 0) for priority in WORKFLOW_PRIORITIES)
+    if "Item" in response:
+        for priority, credit in response["Item"].get("Credits", {}).items():
+            if priority in credits:
+                credits[priority] = int(credit)
+    return credits
+
+
+def next_priority(priorities, mode, weights, credits):
+    """
+    Pick the priority queue to draw the next batch of workflow executions from
+    :param priorities: Priorities whose queues may have workflows waiting, highest first
+    :param mode: PRIORITY_MODE_WEIGHTED or PRIORITY_MODE_STRICT
+    :param weights: Dict of priority to weight
+    :param credits: Dict of priority to smooth weighted round robin credit, updated in place
+    """
+    if mode == PRIORITY_MODE_STRICT:
+        return priorities[0]
+
+    total = sum([weights[priority] for priority in priorities])
+    for priority in priorities:
+        credits[priority] += weights[priority]
+    # max returns the first of equal credits, so ties go to the higher priority
+    selected = max(priorities, key=lambda priority: credits[priority])
+    credits[selected] -= total
+    return selected
+
+
+def save_queue_statistics(statistics, credits):
+    system_table = DYNAMO_RESOURCE.Table(SYSTEM_TABLE_NAME)
+    value = {}
+    for priority, queue in statistics.items():
+        value[priority] = {
+            "Depth": queue["Depth"],
+            "NotVisible": queue["NotVisible"],
+            "Admitted": len(queue["WaitSeconds"]),
+            "AverageWaitSeconds": decimal.Decimal(str(round(sum(queue["WaitSeconds"]) / len(queue["WaitSeconds"]), 3))) if queue["WaitSeconds"] else 0,
+            "MaxWaitSeconds": decimal.Decimal(str(round(max(queue["WaitSeconds"]), 3))) if queue["WaitSeconds"] else 0
+        }
+        logger.info("Priority {} queue depth {}, admitted {}, average wait {}s, max wait {}s".format(
+            priority, queue["Depth"], value[priority]["Admitted"], value[priority]["AverageWaitSeconds"], value[priority]["MaxWaitSeconds"]))
+
+    system_table.put_item(
+        Item={
+            "Name": SCHEDULER_QUEUE_STATISTICS,
+            "Value": value,
+            "Credits": credits,
+            "Updated": str(datetime.now().timestamp())
+        }
+    )
+
+
+def schedule_workflow_executions(queue_url, capacity, MaxConcurrentWorkflows, MaxConcurrentOperations, tenants, running, queued):
+    """
+    Receive a batch of queued workflow executions and start the ones there is a slot for, in weighted fair
+    order across their tenants
+    :param queue_url: The priority queue to receive from
+    :param capacity: The number of workflow executions to start, at most 10
+    :param tenants: The tenant configuration
+    :param running: Dict of tenant to running workflows, updated as workflows are admitted
+    :param queued: Dict of priority to a dict of tenant to queued workflows, updated as workflows are admitted
+    :return: Dict with the number of messages "Received" and "Deferred", the "WaitSeconds" each admitted
+             workflow spent on the queue and "Full" if the workflow slots ran out
+    """
+    result = {"Received": 0, "Deferred": 0, "WaitSeconds": [], "Full": False}
+
+    # Check if there are workflows waiting to run on the queue.  Always read a full batch so there
+    # is a choice of tenants to admit.
+    messages = SQS_CLIENT.receive_message(
+        QueueUrl=queue_url,
+        MaxNumberOfMessages=10,
+        WaitTimeSeconds=SCHEDULER_RECEIVE_WAIT_SECONDS,
+        AttributeNames=['SentTimestamp']
+    )
+    if 'Messages' not in messages: # when the queue is exhausted, the response dict contains no 'Messages' key
+        return result
+    result["Received"] = len(messages['Messages'])
+
+    # Workflow executions cancelled while they were queued are dropped from the queue
+    cancelled = get_cancelled_workflow_executions([json.loads(message['Body'])["Id"] for message in messages['Messages']])
+
+    # Group the workflows by tenant, keeping the queue order within each tenant
+    pending = {}
+    cancelled_receipts = []
+    for message in messages['Messages']: # 'Messages' is a list
+        logger.info(message['Body'])
+        workflow_execution = json.loads(message['Body'])
+        if workflow_execution["Id"] in cancelled:
+            logger.info("Workflow execution {} was cancelled, removing it from the queue".format(workflow_execution["Id"]))
+            cancelled_receipts.append(message['ReceiptHandle'])
+            if "Tenant" in workflow_execution:
+                count_cancelled_queued_workflow(workflow_execution, queued)
+            continue
+        pending.setdefault(workflow_execution.get("Tenant", DEFAULT_TENANT), []).append((workflow_execution, message))
+
+    if cancelled_receipts:
+        SQS_CLIENT.delete_message_batch(
+            QueueUrl=queue_url,
+            Entries=[{'Id': str(i), 'ReceiptHandle': receipt} for i, receipt in enumerate(cancelled_receipts)]
+        )
+
+    admitted = []
+    admitted_receipts = []
+    returned_receipts = []
+    capped = []
+    now = time.time()
+    while pending:
+        # Weighted fair queuing, the next workflow is from the tenant that holds the smallest share of
+        # the slots for its weight once the workflow is admitted
+        tenant = min(pending.keys(), key=lambda t: (running.get(t, 0) + 1) / float(tenant_weight(tenants, t)))
+        workflow_execution, message = pending[tenant].pop(0)
+        if not pending[tenant]:
+            del pending[tenant]
+
+        # Take a slot before the workflow leaves the queue.  If the slots ran out in the
+        # meantime, make the message visible again so it is picked up on a later run.
+        # Workflows held back by an operation or tenant limit are deferred so others can run.
+        if result["Full"] or len(admitted) >= capacity:
+            returned_receipts.append((message['ReceiptHandle'], 0))
+            continue
+
+        if tenant in capped:
+            returned_receipts.append((message['ReceiptHandle'], SCHEDULER_DEFER_SECONDS))
+            result["Deferred"] += 1
+            continue
+
+        if tenant_over_fair_share(tenant, queue_url, MaxConcurrentWorkflows, tenants, running, queued):
+            logger.info("Tenant {} is over its fair share, deferring workflow execution {}".format(tenant, workflow_execution["Id"]))
+            returned_receipts.append((message['ReceiptHandle'], SCHEDULER_FAIR_SHARE_DEFER_SECONDS))
+            result["Deferred"] += 1
+            continue
+
+        # Only workflows queued with a tenant were counted as queued
+        dequeued = None
+        priority = workflow_execution.get("Priority", "Normal")
+        if "Tenant" in workflow_execution:
+            dequeued = QUEUED_TENANT_COUNTER_PREFIX + priority + ":" + tenant
+
+        blocked = acquire_workflow_slot(workflow_execution["Id"], workflow_slot_limits(workflow_execution, MaxConcurrentWorkflows, MaxConcurrentOperations, tenants), dequeued)
+        if not blocked:
+            admitted.append(workflow_execution)
+            admitted_receipts.append(message['ReceiptHandle'])
+            result["WaitSeconds"].append(max(0.0, now - int(message['Attributes']['SentTimestamp']) / 1000.0))
+            running[tenant] = running.get(tenant, 0) + 1
+            if dequeued is not None and priority in queued:
+                queued[priority][tenant] = max(0, queued[priority].get(tenant, 0) - 1)
+        elif RUNNING_WORKFLOWS_COUNTER in blocked:
+            result["Full"] = True
+            logger.info("No slot available for workflow execution {}, leaving it on the queue".format(workflow_execution["Id"]))
+            returned_receipts.append((message['ReceiptHandle'], 0))
+        elif RUNNING_TENANT_COUNTER_PREFIX + tenant in blocked:
+            logger.info("Tenant {} is at its MaxConcurrentWorkflows, deferring workflow execution {}".format(tenant, workflow_execution["Id"]))
+            capped.append(tenant)
+            returned_receipts.append((message['ReceiptHandle'], SCHEDULER_DEFER_SECONDS))
+            result["Deferred"] += 1
+        else:
+            logger.info("Operation limit reached for {}, deferring workflow execution {}".format(
+                ", ".join([counter[len(OPERATION_COUNTER_PREFIX):] for counter in blocked]), workflow_execution["Id"]))
+            returned_receipts.append((message['ReceiptHandle'], SCHEDULER_DEFER_SECONDS))
+            result["Deferred"] += 1
+
+    if returned_receipts:
+        SQS_CLIENT.change_message_visibility_batch(
+            QueueUrl=queue_url,
+            Entries=[{'Id': str(i), 'ReceiptHandle': receipt, 'VisibilityTimeout': timeout} for i, (receipt, timeout) in enumerate(returned_receipts)]
+        )
+
+    if not admitted:
+        return result
+
+    # Start the state machines concurrently, the workflow executions that still need their asset are
+    # handed to the workflow asset lambda
+    with ThreadPoolExecutor(max_workers=min(len(admitted), SCHEDULER_MAX_START_WORKERS)) as executor:
+        errors = list(executor.map(hand_off_workflow_execution, admitted))
+
+    # next, we delete the messages from the queue so no one else will process them again,
+    # once they are in our hands they are going run or fail, no reprocessing.  A message is only deleted
+    # once its workflow execution was handed off, if the scheduler stops before that the message is
+    # delivered again and the workflow execution keeps the slot it already holds.
+    # Hung workflows are detected by workflow_reaper_lambda, which checks the state machines of the
+    # started workflow executions and the age of the slots of the queued ones
+    SQS_CLIENT.delete_message_batch(
+        QueueUrl=queue_url,
+        Entries=[{'Id': str(i), 'ReceiptHandle': receipt} for i, receipt in enumerate(admitted_receipts)]
+    )
+
+    for workflow_execution, error in zip(admitted, errors):
+        if error is not None:
+            logger.info(error)
+            update_workflow_execution_status(workflow_execution["Id"], awsmie.WORKFLOW_STATUS_ERROR, error)
+
+    return result
+
+
+def get_cancelled_workflow_executions(ids):
+    """
+    Find the workflow executions of a batch of queue messages that were cancelled while they were queued
+    :param ids: The ids of the workflow executions, at most 10
+    :return: List of the ids of the cancelled workflow executions
+    """
+    try:
+        response = DYNAMO_CLIENT.batch_get_item(
+            RequestItems={
+                WORKFLOW_EXECUTION_TABLE_NAME: {
+                    'Keys': [{'Id': {'S': id}} for id in set(ids)],
+                    'ProjectionExpression': 'Id, #workflow_status',
+                    'ExpressionAttributeNames': {'#workflow_status': "Status"}
+                }
+            }
+        )
+    except ClientError as e:
+        # A cancelled workflow execution that is started anyway is stopped by start_workflow_execution
+        logger.info("Unable to check for cancelled workflow executions: {}".format(e))
+        return []
+    return [item["Id"]["S"] for item in response["Responses"].get(WORKFLOW_EXECUTION_TABLE_NAME, [])
+            if item["Status"]["S"] == awsmie.WORKFLOW_STATUS_CANCELLED]
+
+
+def count_cancelled_queued_workflow(workflow_execution, queued):
+    """
+    Count a workflow execution that was cancelled while it was queued as no longer queued for its tenant
+    :param workflow_execution: The workflow execution from the queue message
+    :param queued: Dict of the queued workflows by priority and tenant, updated in place
+    """
+    priority = workflow_execution.get("Priority", "Normal")
+    tenant = workflow_execution["Tenant"]
+    try:
+        DYNAMO_CLIENT.update_item(
+            TableName=SYSTEM_TABLE_NAME,
+            Key={
+                'Name': {'S': QUEUED_TENANT_COUNTER_PREFIX + priority + ":" + tenant}
+            },
+            UpdateExpression='ADD #value :minus_one',
+            ExpressionAttributeNames={'#value': 'Value'},
+            ExpressionAttributeValues={':minus_one': {'N': '-1'}}
+        )
+    except ClientError as e:
+        logger.info("Unable to count cancelled workflow for tenant {}: {}".format(tenant, e))
+    if priority in queued:
+        queued[priority][tenant] = max(0, queued[priority].get(tenant, 0) - 1)
+
+
+def workflow_scheduler_lambda(event, context):
+
+    arn = ""
+
+    try:
+        logger.info("Workflow scheduler event: {}".format(json.dumps(event)))
+
+        # Clear the pending trigger so that status changes from here on trigger another run
+        DYNAMO_CLIENT.delete_item(
+            TableName=SYSTEM_TABLE_NAME,
+            Key={
+                'Name': {'S': SCHEDULER_TRIGGER}
+            }
+        )
+
+        # The configured MaxConcurrentWorkflows is the ceiling for the adaptive limit
+        MaxConcurrentWorkflows = get_adaptive_concurrency_limit(get_max_concurrent_workflows())
+        logger.info("Adaptive concurrency limit = {}".format(MaxConcurrentWorkflows))
+
+        MaxConcurrentOperations = get_max_concurrent_operations()
+        for operation, limit in MaxConcurrentOperations.items():
+            logger.info("Operation {} concurrency {}/{}".format(operation, get_system_counter(OPERATION_COUNTER_PREFIX + operation), limit))
+
+        tenants = get_tenant_configuration()
+        running, queued = get_tenant_counters(tenants)
+        for tenant, count in running.items():
+            logger.info("Tenant {} running workflows {}".format(tenant, count))
+
+        mode, weights = get_priority_scheduling()
+        priorities = priority_queues()
+        credits = get_priority_credits()
+        statistics = get_priority_queue_depths(priorities)
+        for priority in priorities:
+            statistics[priority]["WaitSeconds"] = []
+        logger.info("Priority scheduling {} with weights {}".format(mode, weights))
+
+        # Check if there are slots to run a workflow
+        num_started_workflows = get_system_counter(RUNNING_WORKFLOWS_COUNTER)
+        num_deferred = 0
         
         if num_started_workflows >= MaxConcurrentWorkflows:
             logger.info("MaxConcurrentWorkflows has been reached {}/{} - nothing to do".format(num_started_workflows, MaxConcurrentWorkflows))
 
         else:
-            # We can only read 10 messages at a time from the queue.  Loop reading from the queue until
-            # it is empty or we are out of slots
-            while (num_started_workflows < MaxConcurrentWorkflows and not empty):
+            # We can only read 10 messages at a time from a queue.  Loop reading batches from the
+            # priority queues until they are empty or we are out of slots
+            waiting = list(priorities)
+            while (num_started_workflows < MaxConcurrentWorkflows and waiting and num_deferred < SCHEDULER_MAX_DEFERRED):
 
                 capacity = min(int(MaxConcurrentWorkflows - num_started_workflows), 10)
+                priority = next_priority(waiting, mode, weights, credits)
 
-                logger.info("MaxConcurrentWorkflows has not been reached {}/{} - check if a workflow is available to run".format(num_started_workflows, MaxConcurrentWorkflows))
-                
-                # Check if there are workflows waiting to run on the STAGE_EXECUTION_QUEUE_URL
-                messages = SQS_CLIENT.receive_message(
-                    QueueUrl=STAGE_EXECUTION_QUEUE_URL,
-                    MaxNumberOfMessages=capacity
-                )
-                if 'Messages' in messages: # when the queue is exhausted, the response dict contains no 'Messages' key
-                    for message in messages['Messages']: # 'Messages' is a list
-                        # process the messages
-                        logger.info(message['Body'])
-                        # next, we delete the message from the queue so no one else will process it again, 
-                        # once it is in our hands it is going run or fail, no reprocessing
-                        # FIXME - we may want to delay deleting the message until complete_stage is called on the
-                        # final stage so we can detect hung workflows and time them out.  For now, do the simple thing.
-                        SQS_CLIENT.delete_message(QueueUrl=STAGE_EXECUTION_QUEUE_URL,ReceiptHandle=message['ReceiptHandle'])
-
-                        workflow_execution = json.loads(message['Body'])
-                        workflow_execution['Status'] = awsmie.WORKFLOW_STATUS_STARTED
-
-                        # Update the workflow status now to indicate we have taken it off the queue
-                        update_workflow_execution_status(workflow_execution["Id"], awsmie.WORKFLOW_STATUS_STARTED, "")
-
-                        # Kick off the state machine for the workflow
-                        response = SFN_CLIENT.start_execution(
-                            stateMachineArn=workflow_execution["Workflow"]["StateMachineArn"],
-                            name=workflow_execution["Workflow"]["Name"]+workflow_execution["Id"],
-                            input=json.dumps(workflow_execution["Workflow"]["Stages"][workflow_execution["CurrentStage"]])
-                        )
-
-                        workflow_execution["StateMachineExecutionArn"] = response["executionArn"]
-
-                        # Update the workflow with the state machine id 
-                        response = execution_table.update_item(
-                            Key={
-                                'Id': workflow_execution["Id"]
-                            },
-                            UpdateExpression='SET StateMachineExecutionArn = :arn',
-                            ExpressionAttributeValues={
-                                ':arn': response["executionArn"]
-                            }
-                        )
+                logger.info("MaxConcurrentWorkflows has not been reached {}/{} - check if a {} priority workflow is available to run".format(num_started_workflows, MaxConcurrentWorkflows, priority))
 
-                else:
-                    logger.info('Queue is empty')
-                    empty = True
+                result = schedule_workflow_executions(PRIORITY_QUEUE_URLS[priority], capacity, MaxConcurrentWorkflows, MaxConcurrentOperations, tenants, running, queued)
+                if result["Received"] == 0:
+                    logger.info('{} priority queue is empty'.format(priority))
+                    # An empty queue doesn't carry credit over to when it has work again
+                    waiting.remove(priority)
+                    credits[priority] = 0
+                    continue
 
-                started_workflows = list_workflow_executions_by_status(awsmie.WORKFLOW_STATUS_STARTED) 
-                num_started_workflows = len(started_workflows)
-            
+                statistics[priority]["WaitSeconds"].extend(result["WaitSeconds"])
+                num_deferred += result["Deferred"]
+                if result["Full"]:
+                    break
+
+                num_started_workflows = get_system_counter(RUNNING_WORKFLOWS_COUNTER)
+
+        save_queue_statistics(statistics, credits)
 
     except Exception as e:
 
         logger.info("Exception in scheduler {}".format(e))
-        if "Id" in workflow_execution:
-            
-            update_workflow_execution_status(workflow_execution["Id"], awsmie.WORKFLOW_STATUS_ERROR, "Exception in workflow_scheduler_lambda {}".format(e))
         raise 
 
     return arn 
 
+def reap_workflow_execution(workflow_execution):
+    """
+    Check the state machine of a Started workflow execution and mark the workflow execution as ended if the
+    state machine ended without it.  Runs on the reaper's thread pool, so it only uses the thread safe low
+    level clients.
+    :param workflow_execution: The workflow execution with at least its Id and StateMachineExecutionArn
+    :return: The status the workflow execution was marked with, or None if it is still running
+    """
+    try:
+        execution = SFN_CLIENT.describe_execution(executionArn=workflow_execution["StateMachineExecutionArn"])
+    except SFN_CLIENT.exceptions.ExecutionDoesNotExist:
+        # The execution history expired
+        execution = {"status": "DOES_NOT_EXIST"}
+
+    if execution["status"] == "RUNNING":
+        return None
+
+    if execution["status"] == "TIMED_OUT":
+        status = awsmie.WORKFLOW_STATUS_TIMED_OUT
+        message = "The state machine timed out"
+    else:
+        status = awsmie.WORKFLOW_STATUS_ERROR
+        message = "The state machine ended with status {} without completing the workflow execution".format(execution["status"])
+        if "error" in execution:
+            message += ": {} {}".format(execution["error"], execution.get("cause", ""))
+
+    try:
+        # The state machine ended, so the complete stage lambda won't change the status any more.  The
+        # condition guards against a status change since the status index was read.
+        DYNAMO_CLIENT.update_item(
+            TableName=WORKFLOW_EXECUTION_TABLE_NAME,
+            Key={
+                'Id': {'S': workflow_execution["Id"]}
+            },
+            UpdateExpression='SET #workflow_status = :workflow_status, Message = :message',
+            ConditionExpression='#workflow_status = :started AND StateMachineExecutionArn = :arn',
+            ExpressionAttributeNames={
+                '#workflow_status': "Status"
+            },
+            ExpressionAttributeValues={
+                ':workflow_status': {'S': status},
+                ':message': {'S': message},
+                ':started': {'S': awsmie.WORKFLOW_STATUS_STARTED},
+                ':arn': {'S': workflow_execution["StateMachineExecutionArn"]}
+            }
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return None
+
+    logger.info("Workflow execution {} set status = {}: {}".format(workflow_execution["Id"], status, message))
+    return status
+
+
+def get_unreleased_workflow_slots():
+    """
+    Find the workflow slots held by workflow executions that are neither queued nor started, and by
+    workflow executions still queued WORKFLOW_START_TIMEOUT_SECONDS after they took their slot
+    :return: Tuple of the lists of the ids of the orphaned and of the stalled workflow executions
+    """
+    slots = {}
+    scan_args = {
+        'TableName': SYSTEM_TABLE_NAME,
+        'ConsistentRead': True,
+        'FilterExpression': 'begins_with(#name, :slot)',
+        'ProjectionExpression': '#name, Acquired',
+        'ExpressionAttributeNames': {'#name': 'Name'},
+        'ExpressionAttributeValues': {':slot': {'S': WORKFLOW_SLOT_PREFIX}}
+    }
+    while True:
+        response = DYNAMO_CLIENT.scan(**scan_args)
+        for item in response["Items"]:
+            # Leases taken before they recorded when are never considered stalled
+            acquired = int(item["Acquired"]["N"]) if "Acquired" in item else None
+            slots[item["Name"]["S"][len(WORKFLOW_SLOT_PREFIX):]] = acquired
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    # A slot is taken while the workflow execution is still Queued, see acquire_workflow_slot
+    statuses = {}
+    ids = list(slots.keys())
+    for i in range(0, len(ids), 100):
+        keys = [{'Id': {'S': id}} for id in ids[i:i + 100]]
+        while keys:
+            response = DYNAMO_CLIENT.batch_get_item(
+                RequestItems={
+                    WORKFLOW_EXECUTION_TABLE_NAME: {
+                        'Keys': keys,
+                        'ProjectionExpression': 'Id, #workflow_status',
+                        'ExpressionAttributeNames': {'#workflow_status': "Status"},
+                        'ConsistentRead': True
+                    }
+                }
+            )
+            for item in response["Responses"].get(WORKFLOW_EXECUTION_TABLE_NAME, []):
+                statuses[item["Id"]["S"]] = item["Status"]["S"]
+            keys = response.get("UnprocessedKeys", {}).get(WORKFLOW_EXECUTION_TABLE_NAME, {}).get("Keys", [])
+
+    orphaned = [id for id in ids if statuses.get(id) not in [awsmie.WORKFLOW_STATUS_QUEUED, awsmie.WORKFLOW_STATUS_STARTED]]
+    now = int(time.time())
+    stalled = [id for id in ids if statuses.get(id) == awsmie.WORKFLOW_STATUS_QUEUED and slots[id] is not None
+               and now - slots[id] > WORKFLOW_START_TIMEOUT_SECONDS]
+    return orphaned, stalled
+
+
+def fail_stalled_workflow_execution(workflow_execution_id):
+    """
+    Mark a workflow execution that holds a slot but never started as Error and release its slot
+    :param workflow_execution_id: The id of the workflow execution
+    :return: True if the workflow execution was marked as Error
+    """
+    message = "The workflow execution did not start within {} seconds of taking its workflow slot".format(WORKFLOW_START_TIMEOUT_SECONDS)
+    try:
+        # The condition guards against a status change since the status was read
+        DYNAMO_CLIENT.update_item(
+            TableName=WORKFLOW_EXECUTION_TABLE_NAME,
+            Key={
+                'Id': {'S': workflow_execution_id}
+            },
+            UpdateExpression='SET #workflow_status = :workflow_status, Message = :message',
+            ConditionExpression='#workflow_status = :queued',
+            ExpressionAttributeNames={
+                '#workflow_status': "Status"
+            },
+            ExpressionAttributeValues={
+                ':workflow_status': {'S': awsmie.WORKFLOW_STATUS_ERROR},
+                ':message': {'S': message},
+                ':queued': {'S': awsmie.WORKFLOW_STATUS_QUEUED}
+            }
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return False
+
+    logger.info("Workflow execution {} set status = {}: {}".format(workflow_execution_id, awsmie.WORKFLOW_STATUS_ERROR, message))
+    release_workflow_slot(workflow_execution_id)
+    return True
+
+
+def workflow_reaper_lambda(event, context):
+    """
+    Reconcile the Started workflow executions with their state machines and release the slots of the ones
+    that ended, and fail the Queued workflow executions that took a slot but never started.  Runs on a
+    schedule.
+    :return: Dict with the number of workflow executions "Checked", the ids of the ones "Reaped" and
+             "Stalled" and the number of "ReclaimedSlots"
+    """
+    logger.info("Workflow reaper event: {}".format(json.dumps(event)))
+
+    result = {"Checked": 0, "Reaped": [], "Stalled": [], "ReclaimedSlots": 0}
+
+    workflow_executions = [workflow_execution for workflow_execution in list_workflow_executions_by_status(awsmie.WORKFLOW_STATUS_STARTED)
+                           if "StateMachineExecutionArn" in workflow_execution]
+    result["Checked"] = len(workflow_executions)
+
+    if workflow_executions:
+        with ThreadPoolExecutor(max_workers=min(len(workflow_executions), REAPER_MAX_WORKERS)) as executor:
+            statuses = list(executor.map(reap_workflow_execution, workflow_executions))
+        result["Reaped"] = [workflow_execution["Id"] for workflow_execution, status in zip(workflow_executions, statuses)
+                            if status is not None]
+
+    # The slots of the reaped workflow executions, and of any that ended without releasing theirs
+    orphaned, stalled = get_unreleased_workflow_slots()
+    for workflow_execution_id in orphaned:
+        if release_workflow_slot(workflow_execution_id):
+            result["ReclaimedSlots"] += 1
+
+    for workflow_execution_id in stalled:
+        if fail_stalled_workflow_execution(workflow_execution_id):
+            result["Stalled"].append(workflow_execution_id)
+            result["ReclaimedSlots"] += 1
+
+    logger.info("Checked {} started workflow executions, reaped {}, failed {} stalled and reclaimed {} workflow slots".format(
+        result["Checked"], len(result["Reaped"]), len(result["Stalled"]), result["ReclaimedSlots"]))
+
+    DYNAMO_RESOURCE.Table(SYSTEM_TABLE_NAME).put_item(
+        Item={
+            "Name": REAPER_STATISTICS,
+            "Value": {
+                "Checked": result["Checked"],
+                "Reaped": len(result["Reaped"]),
+                "Stalled": len(result["Stalled"]),
+                "ReclaimedSlots": result["ReclaimedSlots"]
+            },
+            "Updated": str(datetime.now().timestamp())
+        }
+    )
+
+    if result["ReclaimedSlots"]:
+        trigger_workflow_scheduler()
+
+    return result
+
+
 def filter_operation_lambda(event, context):
     '''
     event is 
@@ -221,11 +1486,116 @@ def filter_operation_lambda(event, context):
     
     return operation_object.return_output_object()
 
+def operation_job_id(outputs):
+    # Async operators record the id of the job they started in a <Job>JobId metadata key
+    for key, value in outputs.get("MetaData", {}).items():
+        if key.endswith("JobId"):
+            return str(value)
+    return None
+
+
+def resume_task(task_token, job):
+    """
+    Resume a state machine waiting for an async operator's job to complete
+    :param task_token: The task token of the waiting state
+    :param job: The job completion notification
+    """
+    try:
+        SFN_CLIENT.send_task_success(taskToken=task_token, output=json.dumps(job))
+    except (SFN_CLIENT.exceptions.TaskTimedOut, SFN_CLIENT.exceptions.TaskDoesNotExist, SFN_CLIENT.exceptions.InvalidToken) as e:
+        # The state already gave up waiting and fell back to polling the job
+        logger.info("Task for job {} is no longer waiting: {}".format(job["JobId"], e))
+    else:
+        logger.info("Resumed task waiting for job {}".format(job["JobId"]))
+
+    DYNAMO_CLIENT.delete_item(
+        TableName=TASK_TOKEN_TABLE_NAME,
+        Key={
+            'JobId': {'S': job["JobId"]}
+        }
+    )
+
+
+def register_task_token_lambda(event, context):
+    '''
+    event is
+    - TaskToken of the state waiting for the operator's job to complete
+    - Outputs of the operator's start lambda
+
+    Stores the task token under the operator's job id.  If the job already completed, the state machine
+    is resumed right away.  Failing here makes the state fall back to polling the job.
+    '''
+    logger.info(json.dumps(event))
+
+    job_id = operation_job_id(event["Outputs"])
+    if job_id is None:
+        raise MasExecutionError("No job id found in the outputs of operation {}".format(event["Outputs"].get("Name")))
+
+    response = DYNAMO_CLIENT.update_item(
+        TableName=TASK_TOKEN_TABLE_NAME,
+        Key={
+            'JobId': {'S': job_id}
+        },
+        UpdateExpression='SET TaskToken = :token, WorkflowExecutionId = :workflow_execution_id, Expires = :expires',
+        ExpressionAttributeValues={
+            ':token': {'S': event["TaskToken"]},
+            ':workflow_execution_id': {'S': event["Outputs"]["MetaData"].get("WorkflowExecutionId", "")},
+            ':expires': {'N': str(int(time.time()) + TASK_TOKEN_EXPIRATION_SECONDS)}
+        },
+        ReturnValues='ALL_NEW'
+    )
+
+    if "JobStatus" in response["Attributes"]:
+        resume_task(event["TaskToken"], {"JobId": job_id, "Status": response["Attributes"]["JobStatus"]["S"]})
+    else:
+        logger.info("Waiting for job {} to complete".format(job_id))
+
+    return {"JobId": job_id}
+
+
+def complete_task_token_lambda(event, context):
+    '''
+    event is an SNS notification of completed jobs, for example from Rekognition video analysis
+
+    Resumes the state machine waiting for the job, or records the job status for the state machine to
+    pick up if it didn't start waiting yet.
+    '''
+    logger.info(json.dumps(event))
+
+    for record in event["Records"]:
+        message = json.loads(record["Sns"]["Message"])
+        job = {"JobId": message["JobId"], "Status": message["Status"]}
+
+        response = DYNAMO_CLIENT.update_item(
+            TableName=TASK_TOKEN_TABLE_NAME,
+            Key={
+                'JobId': {'S': job["JobId"]}
+            },
+            UpdateExpression='SET JobStatus = :status, Expires = :expires',
+            ExpressionAttributeValues={
+                ':status': {'S': job["Status"]},
+                ':expires': {'N': str(int(time.time()) + TASK_TOKEN_EXPIRATION_SECONDS)}
+            },
+            ReturnValues='ALL_NEW'
+        )
+
+        if "TaskToken" in response["Attributes"]:
+            resume_task(response["Attributes"]["TaskToken"]["S"], job)
+        else:
+            logger.info("No task is waiting for job {} yet".format(job["JobId"]))
+
+
 def complete_stage_execution_lambda(event, context):
     '''
     event is a stage execution object
     '''
     logger.info(json.dumps(event))
+    # Workflows with stage dependencies pass the stages that run next, see build_dag_workflow in the
+    # workflow api
+    if "JoinStages" in event:
+        return join_dag_stage_executions(event)
+    if "NextStages" in event:
+        return complete_dag_stage_execution(event)
     return complete_stage_execution("lambda", event["Name"], event["Status"], event["Outputs"], event["WorkflowExecutionId"])
 
 
@@ -250,7 +1620,7 @@ def complete_stage_execution(trigger, stage_name, status, outputs, workflow_exec
                 "Exception: workflow execution id '%s' not found" % workflow_execution_id)
 
         logger.info("workflow_execution: {}".format(
-            json.dumps(workflow_execution)))
+            json.dumps(workflow_execution, default=decimal_default)))
 
 
         # Roll-up the results of the stage execution.  If anything fails here, we will fail the
@@ -260,7 +1630,15 @@ def complete_stage_execution(trigger, stage_name, status, outputs, workflow_exec
             # # if any operation did not complete successfully, the stage has failed
             opstatus = awsmie.STAGE_STATUS_COMPLETE
             errorMessage = "none"
+
+            # Bring back workflow metadata a previous stage stored in S3 so the outputs of this stage can be
+            # merged with it
+            resolve_workflow_execution_references(workflow_execution)
+
+            throttled = False
             for operation in outputs:
+                if operation_throttled(operation):
+                    throttled = True
                 if operation["Status"] not in [awsmie.OPERATION_STATUS_COMPLETE, awsmie.OPERATION_STATUS_SKIPPED]:
                     opstatus = awsmie.STAGE_STATUS_ERROR
                     if "Message" in operation:
@@ -279,48 +1657,17 @@ def complete_stage_execution(trigger, stage_name, status, outputs, workflow_exec
             workflow_execution["Workflow"]["Stages"][stage_name
                                                      ]["Outputs"] = outputs
 
-            if "MetaData" not in workflow_execution["Globals"]:
-                workflow_execution["Globals"]["MetaData"] = {}
-
-            # Roll up operation media and metadata outputs from this stage and add them to
-            # the global workflow metadata:
-            #
-            #     1. mediaType and metatdata output keys must be unique withina stage - if
-            #        non-unique keys are found across operations within a stage, then the
-            #        stage execution will fail.
-            #     2. if a stage has a duplicates a mediaType or metadata output key from the globals,
-            #        then the global value is replaced by the stage output value
-
-            # Roll up media
-            stageOutputMediaTypeKeys = []
-            for operation in outputs:
-                if "Media" in operation:
-                    for mediaType in operation["Media"].keys():
-                        # replace media with trasformed or created media from this stage
-                        print(mediaType)
-                        if mediaType in stageOutputMediaTypeKeys:
-
-                            raise ValueError(
-                                "Duplicate mediaType '%s' found in operation ouput media.  mediaType keys must be unique within a stage." % mediaType)
-                        else:
-                            workflow_execution["Globals"]["Media"][mediaType] = operation["Media"][mediaType]
-                            stageOutputMediaTypeKeys.append(mediaType)
-
-                # Roll up metadata
-                stageOutputMetadataKeys = []
-                if "MetaData" in operation:
-                    for key in operation["MetaData"].keys():
-                        print(key)
-                        if key in stageOutputMetadataKeys:
-                            raise ValueError(
-                                "Duplicate key '%s' found in operation ouput metadata.  Metadata keys must be unique within a stage." % key)
-                        else:
-                            workflow_execution["Globals"]["MetaData"][key] = operation["MetaData"][key]
-                            stageOutputMetadataKeys.append(key)
+            merge_stage_outputs(workflow_execution["Globals"], outputs)
 
             workflow_execution["Workflow"]["Stages"][stage_name
                                                      ]["Status"] = status
 
+            cache_stage_results(workflow_execution, stage_name, outputs)
+
+            record_stage_metrics(workflow_execution, stage_name)
+
+            offload_workflow_execution_values(workflow_execution, stage_name)
+
         # The status roll up failed.  Handle the error and fall through to update the workflow status
         except Exception as e:
 
@@ -348,6 +1695,16 @@ def complete_stage_execution(trigger, stage_name, status, outputs, workflow_exec
             }
         )
 
+        # Operations that no later stage runs don't need their slots any more
+        release_stage_operation_slots(workflow_execution, stage_name)
+
+        # Feed the outcome of the stage to the adaptive concurrency limit
+        if throttled or status == awsmie.STAGE_STATUS_COMPLETE:
+            try:
+                adjust_adaptive_concurrency_limit(throttled)
+            except Exception as e:
+                logger.info("Exception adjusting the adaptive concurrency limit {}".format(e))
+
         # Start the next stage for execution
         # FIXME - try always completing stage
         # status == awsmie.STAGE_STATUS_COMPLETE:
@@ -360,8 +1717,17 @@ def complete_stage_execution(trigger, stage_name, status, outputs, workflow_exec
     except Exception as e:
         logger.info("Exception {}".format(e))
         
-        # Need a try/catch here? Try to save the status
-        execution_table.put_item(Item=workflow_execution)
+        # Need a try/catch here? Try to save the status, unless the workflow execution was cancelled
+        try:
+            execution_table.put_item(
+                Item=workflow_execution,
+                ConditionExpression='#workflow_status <> :cancelled',
+                ExpressionAttributeNames={'#workflow_status': "Status"},
+                ExpressionAttributeValues={':cancelled': awsmie.WORKFLOW_STATUS_CANCELLED}
+            )
+        except ClientError as put_error:
+            if put_error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
         update_workflow_execution_status(workflow_execution["Id"], awsmie.WORKFLOW_STATUS_ERROR, "Exception while rolling up stage status {}".format(e))
 
         logger.info("Exception {}".format(e))
@@ -373,7 +1739,478 @@ def complete_stage_execution(trigger, stage_name, status, outputs, workflow_exec
     if workflow_execution["CurrentStage"] == "End":
         return {}
     else:
-        return workflow_execution["Workflow"]["Stages"][workflow_execution["CurrentStage"]]
+        # The stage read back from DynamoDB carries decimals, such as its metrics
+        return json.loads(json.dumps(workflow_execution["Workflow"]["Stages"][workflow_execution["CurrentStage"]],
+                                     default=decimal_default))
+
+
+def merge_stage_outputs(workflow_globals, outputs):
+    """
+    Add the media and metadata outputs of the operations of a stage to the workflow Globals
+    """
+    if "MetaData" not in workflow_globals:
+        workflow_globals["MetaData"] = {}
+
+    # Roll up operation media and metadata outputs from this stage and add them to
+    # the global workflow metadata:
+    #
+    #     1. mediaType and metatdata output keys must be unique withina stage - if
+    #        non-unique keys are found across operations within a stage, then the
+    #        stage execution will fail.
+    #     2. if a stage has a duplicates a mediaType or metadata output key from the globals,
+    #        then the global value is replaced by the stage output value
+
+    # Roll up media
+    stageOutputMediaTypeKeys = []
+    for operation in outputs:
+        if "Media" in operation:
+            for mediaType in operation["Media"].keys():
+                # replace media with trasformed or created media from this stage
+                print(mediaType)
+                if mediaType in stageOutputMediaTypeKeys:
+
+                    raise ValueError(
+                        "Duplicate mediaType '%s' found in operation ouput media.  mediaType keys must be unique within a stage." % mediaType)
+                else:
+                    workflow_globals["Media"][mediaType] = operation["Media"][mediaType]
+                    stageOutputMediaTypeKeys.append(mediaType)
+
+        # Roll up metadata
+        stageOutputMetadataKeys = []
+        if "MetaData" in operation:
+            for key in operation["MetaData"].keys():
+                print(key)
+                if key in stageOutputMetadataKeys:
+                    raise ValueError(
+                        "Duplicate key '%s' found in operation ouput metadata.  Metadata keys must be unique within a stage." % key)
+                else:
+                    workflow_globals["MetaData"][key] = operation["MetaData"][key]
+                    stageOutputMetadataKeys.append(key)
+
+
+def cache_stage_results(workflow_execution, stage_name, outputs):
+    """
+    Save the results of the cacheable operations of a stage in the result cache, so workflow executions on
+    media with the same fingerprint can reuse them, see lookup_cached_results in the workflow api.  The cache
+    entry holds the operation outputs and the dataplane metadata this workflow execution stored for the
+    operation.  Caching is best effort, a failure only means the next run executes the operation again.
+    """
+    stage = workflow_execution["Workflow"]["Stages"][stage_name]
+    if not RESULT_CACHE_TABLE_NAME or not DATAPLANE_TABLE_NAME or "Fingerprint" not in workflow_execution or "ResultCache" not in stage:
+        return
+
+    for operation in outputs:
+        if operation["Name"] not in stage["ResultCache"] or operation["Status"] != awsmie.OPERATION_STATUS_COMPLETE:
+            continue
+        # Results that came from the cache are already there
+        if operation.get("Cached", False):
+            continue
+        try:
+            dataplane_operator_name = stage["ResultCache"][operation["Name"]]["DataplaneOperatorName"]
+            response = DYNAMO_RESOURCE.Table(DATAPLANE_TABLE_NAME).get_item(
+                Key={
+                    'AssetId': workflow_execution["AssetId"]
+                },
+                ProjectionExpression='#operator',
+                ExpressionAttributeNames={
+                    '#operator': dataplane_operator_name
+                },
+                ConsistentRead=True)
+            pointers = []
+            if "Item" in response and dataplane_operator_name in response["Item"]:
+                for pointer in response["Item"][dataplane_operator_name]:
+                    if pointer["workflow"] == workflow_execution["Id"]:
+                        pointers.append(pointer["pointer"])
+
+            # The ids of the workflow that computed the results are recorded with the entry instead
+            metadata = dict((key, value) for key, value in operation.get("MetaData", {}).items()
+                            if key not in ["AssetId", "WorkflowExecutionId"])
+
+            DYNAMO_RESOURCE.Table(RESULT_CACHE_TABLE_NAME).put_item(
+                Item={
+                    "CacheKey": result_cache_key(workflow_execution["Fingerprint"], operation["Name"],
+                                                 stage["Configuration"][operation["Name"]]),
+                    "Operation": operation["Name"],
+                    "Fingerprint": workflow_execution["Fingerprint"],
+                    "AssetId": workflow_execution["AssetId"],
+                    "WorkflowExecutionId": workflow_execution["Id"],
+                    "Pointers": pointers,
+                    "Media": dynamo_value(operation.get("Media", {})),
+                    "MetaData": dynamo_value(metadata),
+                    "Created": str(datetime.now().timestamp())
+                }
+            )
+            logger.info("Cached the results of operation {}".format(operation["Name"]))
+        except Exception as e:
+            logger.info("Unable to cache the results of operation {}: {}".format(operation["Name"], e))
+
+
+def metrics_timestamp(timestamp=None):
+    """
+    Timestamps in the stage metrics are epoch seconds with millisecond precision
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    return decimal.Decimal("{:.3f}".format(timestamp))
+
+
+def record_stage_metrics(workflow_execution, stage_name):
+    """
+    Record the end time of a stage and the timing of each of its operations in the stage Metrics.  Metrics
+    are best effort, failing to collect them doesn't fail the stage.
+    """
+    metrics = workflow_execution["Workflow"]["Stages"][stage_name].setdefault("Metrics", {})
+    metrics["EndTime"] = metrics_timestamp()
+
+    if "StateMachineExecutionArn" not in workflow_execution:
+        return
+    try:
+        metrics["Operations"] = get_stage_operation_metrics(workflow_execution["StateMachineExecutionArn"],
+                                                            stage_name,
+                                                            workflow_execution["Workflow"]["Stages"][stage_name])
+    except Exception as e:
+        logger.info("Exception collecting the operation metrics of stage {}: {}".format(stage_name, e))
+
+
+# Names of the states of an operation branch, without their " (<stage name>)" suffix, as generated from the
+# %%OPERATION_NAME%% state machine templates of the workflow api
+OPERATION_STATE_NAMES = [
+    "Filter {} Media Type?", "Filter {}", "Skip {}?", "Skip {}", "Start {}", "{} Not Started", "Execute {}",
+    "{} Expected Duration?", "{} Wait Expected Duration", "Wait For {} Callback?", "{} Callback",
+    "Cached {}?", "{} Cached", "{} Failed", "{} Succeeded"
+]
+# Polling states, the steps after the first one of a polling policy append their step number to the name
+OPERATION_POLL_STATE_NAMES = ["{} Wait", "Get {} Status", "Did {} Complete"]
+OPERATION_MONITOR_STATE_NAME = "Get {} Status"
+
+
+def get_stage_operation_metrics(execution_arn, stage_name, stage):
+    """
+    Read the start time, end time and number of monitor polls of each operation of a stage from the state
+    machine execution history.  The history is read backwards from the end of the stage to its start, so
+    the cost doesn't grow with the number of stages before it.
+    :param execution_arn: The state machine execution of the workflow
+    :param stage_name: The stage that just completed
+    :param stage: The stage of the workflow execution
+    :return: Dict of operation name to its metrics
+    """
+    operations = stage.get("Configuration", {}).keys()
+    state_operations = {}
+    poll_state_operations = {}
+    for operation in operations:
+        for template in OPERATION_STATE_NAMES:
+            state_operations[template.format(operation)] = operation
+        for template in OPERATION_POLL_STATE_NAMES:
+            poll_state_operations[template.format(operation)] = operation
+    monitor_states = set(OPERATION_MONITOR_STATE_NAME.format(operation) for operation in operations)
+    suffix = " ({})".format(stage_name)
+    operation_metrics = {}
+
+    paginator = SFN_CLIENT.get_paginator('get_execution_history')
+    for page in paginator.paginate(executionArn=execution_arn, reverseOrder=True):
+        for event in page["events"]:
+            if "stateEnteredEventDetails" in event:
+                name = event["stateEnteredEventDetails"]["name"]
+                entered = True
+            elif "stateExitedEventDetails" in event:
+                name = event["stateExitedEventDetails"]["name"]
+                entered = False
+            else:
+                continue
+
+            if name == stage_name:
+                if entered:
+                    return operation_metrics
+                continue
+            if not name.endswith(suffix):
+                continue
+
+            state = name[:-len(suffix)]
+            # Polling states after the first step are named "<state> <step>"
+            step_state, _, step = state.rpartition(" ")
+            poll_state = step_state if step.isdigit() and step_state in poll_state_operations else state
+            if state in state_operations:
+                operation = state_operations[state]
+            elif poll_state in poll_state_operations:
+                operation = poll_state_operations[poll_state]
+            else:
+                continue
+
+            timestamp = metrics_timestamp(event["timestamp"].timestamp())
+            metrics = operation_metrics.setdefault(operation, {"MonitorPolls": 0})
+            if entered:
+                # Reading backwards, the last state entered is the first state of the operation
+                metrics["StartTime"] = timestamp
+                if poll_state in monitor_states:
+                    metrics["MonitorPolls"] += 1
+            elif "EndTime" not in metrics:
+                metrics["EndTime"] = timestamp
+
+    return operation_metrics
+
+
+def resolve_workflow_execution_references(workflow_execution):
+    resolve_globals_references(workflow_execution["Globals"])
+
+
+def resolve_globals_references(workflow_globals):
+    if "MetaDataLocation" in workflow_globals:
+        location = workflow_globals.pop("MetaDataLocation")
+        logger.info("Loading workflow metadata from {}".format(location))
+        workflow_globals["MetaData"] = load_workflow_reference(location, parse_float=decimal.Decimal)
+
+
+def workflow_reference_prefix(workflow_execution):
+    return "private/assets/{}/workflows/{}/references/".format(workflow_execution["AssetId"],
+                                                               workflow_execution["Id"])
+
+
+def offload_workflow_execution_values(workflow_execution, stage_name):
+    """
+    Store the Globals metadata and the stage outputs of a workflow execution in the dataplane bucket when
+    they are larger than WORKFLOW_REFERENCE_THRESHOLD_BYTES.  The stored value is replaced by an empty one
+    and its location is saved in a sibling MetaDataLocation or OutputsLocation key.  Media objects are
+    always kept inline since they are small and read by most operators.
+
+    Each stage writes its own objects so the references saved with earlier stages stay valid.
+    """
+    offload_globals(workflow_execution, workflow_execution["Globals"], stage_name)
+    offload_stage_outputs(workflow_execution, stage_name)
+
+
+def offload_globals(workflow_execution, workflow_globals, name):
+    if not DATAPLANE_BUCKET:
+        return
+
+    metadata = workflow_globals["MetaData"]
+    if len(json.dumps(metadata, default=str)) > WORKFLOW_REFERENCE_THRESHOLD_BYTES:
+        workflow_globals["MetaDataLocation"] = store_workflow_reference(
+            DATAPLANE_BUCKET, workflow_reference_prefix(workflow_execution) + name + "/Globals.json", metadata)
+        workflow_globals["MetaData"] = {}
+        logger.info("Stored workflow metadata in {}".format(workflow_globals["MetaDataLocation"]))
+
+
+def offload_stage_outputs(workflow_execution, stage_name):
+    if not DATAPLANE_BUCKET:
+        return
+
+    stage = workflow_execution["Workflow"]["Stages"][stage_name]
+    if "Outputs" in stage and len(json.dumps(stage["Outputs"], default=str)) > WORKFLOW_REFERENCE_THRESHOLD_BYTES:
+        stage["OutputsLocation"] = store_workflow_reference(
+            DATAPLANE_BUCKET, workflow_reference_prefix(workflow_execution) + stage_name + "/Outputs.json",
+            stage["Outputs"])
+        stage["Outputs"] = []
+        logger.info("Stored stage outputs in {}".format(stage["OutputsLocation"]))
+
+
+def get_workflow_execution(workflow_execution_id):
+    execution_table = DYNAMO_RESOURCE.Table(WORKFLOW_EXECUTION_TABLE_NAME)
+    response = execution_table.get_item(
+        Key={
+            'Id': workflow_execution_id
+        },
+        ConsistentRead=True)
+
+    if "Item" not in response:
+        raise ValueError(
+            "Exception: workflow execution id '%s' not found" % workflow_execution_id)
+    return response["Item"]
+
+
+def dynamo_value(value):
+    # Values that come from Step Functions carry floats, DynamoDB only takes decimals
+    return json.loads(json.dumps(value, default=decimal_default), parse_float=decimal.Decimal)
+
+
+def complete_dag_stage_execution(event):
+    """
+    Complete a stage of a workflow whose stages depend on each other.  Stages that run in a branch of a
+    group of parallel stages only update their own stage, since other stages of the group may complete at
+    the same time.  Their outputs are added to the Globals passed on to the next stage of the branch and
+    are merged into the workflow Globals when the group joins.
+    :param event: The stage, its outputs and the stages that run next, see build_dag_workflow in the
+    workflow api
+    :return: The Globals and the stages that run next
+    """
+    stage_name = event["Name"]
+    workflow_execution = get_workflow_execution(event["WorkflowExecutionId"])
+    stage = workflow_execution["Workflow"]["Stages"][stage_name]
+
+    try:
+        outputs = dynamo_value(event["Outputs"])
+        stage_globals = dynamo_value(event["Input"])
+        resolve_globals_references(stage_globals)
+
+        status = awsmie.STAGE_STATUS_COMPLETE
+        throttled = False
+        for operation in outputs:
+            if operation_throttled(operation):
+                throttled = True
+            if operation["Status"] not in [awsmie.OPERATION_STATUS_COMPLETE, awsmie.OPERATION_STATUS_SKIPPED]:
+                status = awsmie.STAGE_STATUS_ERROR
+        logger.info("Stage status: {}".format(status))
+
+        stage["Outputs"] = outputs
+        stage["Status"] = status
+        merge_stage_outputs(stage_globals, outputs)
+        cache_stage_results(workflow_execution, stage_name, outputs)
+
+        record_stage_metrics(workflow_execution, stage_name)
+        offload_stage_outputs(workflow_execution, stage_name)
+        offload_globals(workflow_execution, stage_globals, stage_name)
+
+    except Exception as e:
+        logger.info("Exception while rolling up stage status {}".format(e))
+        update_workflow_execution_status(workflow_execution["Id"], awsmie.WORKFLOW_STATUS_ERROR, "Exception while rolling up stage status {}".format(e))
+        raise ValueError("Error rolling up stage status: %s" % e)
+
+    update_expression = 'SET Workflow.Stages.#stage = :stage'
+    expression_values = {
+        ':stage': stage
+    }
+    if not event["Branch"]:
+        update_expression += ', Globals = :globals'
+        expression_values[':globals'] = stage_globals
+    DYNAMO_RESOURCE.Table(WORKFLOW_EXECUTION_TABLE_NAME).update_item(
+        Key={
+            'Id': workflow_execution["Id"]
+        },
+        UpdateExpression=update_expression,
+        ExpressionAttributeNames={
+            '#stage': stage_name
+        },
+        ExpressionAttributeValues=expression_values
+    )
+
+    release_stage_operation_slots(workflow_execution, stage_name)
+
+    if throttled or status == awsmie.STAGE_STATUS_COMPLETE:
+        try:
+            adjust_adaptive_concurrency_limit(throttled)
+        except Exception as e:
+            logger.info("Exception adjusting the adaptive concurrency limit {}".format(e))
+
+    if status == awsmie.STAGE_STATUS_ERROR:
+        end_dag_workflow_execution(workflow_execution, awsmie.WORKFLOW_STATUS_ERROR,
+                                   "stage completed with status {}".format(status))
+        # Failing the state machine stops the stages running in parallel with this one
+        raise Exception("Stage {} encountered and error during execution, aborting the workflow".format(stage_name))
+
+    return start_dag_stages(workflow_execution, event["NextStages"], stage_globals, event["Branch"],
+                            "stage completed with status {}".format(status))
+
+
+def join_dag_stage_executions(event):
+    """
+    Merge the outputs of a group of parallel stages into the Globals the group started with.  The stages are
+    merged in the topological order of the workflow, with independent stages ordered by name, so the result
+    doesn't depend on the order the stages completed in: when two stages output the same media type or
+    metadata key, the stage that comes later in that order wins.
+    :param event: The Globals at the start of the group, the stages of the group and the stages that run
+    next, see build_dag_workflow in the workflow api
+    :return: The Globals and the stages that run next
+    """
+    workflow_execution = get_workflow_execution(event["WorkflowExecutionId"])
+
+    try:
+        join_globals = dynamo_value(event["Globals"])
+        resolve_globals_references(join_globals)
+        for stage_name in event["JoinStages"]:
+            stage = workflow_execution["Workflow"]["Stages"][stage_name]
+            if "OutputsLocation" in stage:
+                outputs = load_workflow_reference(stage["OutputsLocation"], parse_float=decimal.Decimal)
+            else:
+                outputs = stage.get("Outputs", [])
+            merge_stage_outputs(join_globals, outputs)
+        offload_globals(workflow_execution, join_globals, event["Name"])
+
+    except Exception as e:
+        logger.info("Exception while joining stages {}".format(e))
+        update_workflow_execution_status(workflow_execution["Id"], awsmie.WORKFLOW_STATUS_ERROR, "Exception while joining stages {}".format(e))
+        raise ValueError("Error joining stages: %s" % e)
+
+    if not event["Branch"]:
+        DYNAMO_RESOURCE.Table(WORKFLOW_EXECUTION_TABLE_NAME).update_item(
+            Key={
+                'Id': workflow_execution["Id"]
+            },
+            UpdateExpression='SET Globals = :globals',
+            ExpressionAttributeValues={
+                ':globals': join_globals
+            }
+        )
+
+    return start_dag_stages(workflow_execution, event["NextStages"], join_globals, event["Branch"],
+                            "stages {} completed".format(", ".join(event["JoinStages"])))
+
+
+def start_dag_stages(workflow_execution, next_stages, stage_globals, branch, message):
+    """
+    Mark the stages that run next as started and return their inputs.  The end of the last stage or group
+    of the workflow completes the workflow execution.
+    """
+    stages = workflow_execution["Workflow"]["Stages"]
+    result = {
+        "WorkflowExecutionId": workflow_execution["Id"],
+        "Globals": stage_globals,
+        "Stages": []
+    }
+
+    if not next_stages:
+        if not branch:
+            end_dag_workflow_execution(workflow_execution, awsmie.WORKFLOW_STATUS_COMPLETE, message)
+        return result
+
+    start_time = metrics_timestamp()
+    update_expression = []
+    expression_names = {}
+    expression_values = {
+        ':input': stage_globals,
+        ':started': awsmie.STAGE_STATUS_STARTED,
+        ':start_time': start_time,
+        ':current_stage': next_stages[0]
+    }
+    for index, stage_name in enumerate(next_stages):
+        stage = stages[stage_name]
+        stage["Input"] = stage_globals
+        stage["Status"] = awsmie.STAGE_STATUS_STARTED
+        stage.setdefault("Metrics", {})["StartTime"] = start_time
+        result["Stages"].append(stage)
+
+        expression_names['#stage{}'.format(index)] = stage_name
+        update_expression.append('Workflow.Stages.#stage{index}.Input = :input, Workflow.Stages.#stage{index}.#stage_status = :started, Workflow.Stages.#stage{index}.Metrics.StartTime = :start_time'.format(index=index))
+    expression_names['#stage_status'] = "Status"
+
+    DYNAMO_RESOURCE.Table(WORKFLOW_EXECUTION_TABLE_NAME).update_item(
+        Key={
+            'Id': workflow_execution["Id"]
+        },
+        UpdateExpression='SET CurrentStage = :current_stage, ' + ', '.join(update_expression),
+        ExpressionAttributeNames=expression_names,
+        ExpressionAttributeValues=expression_values
+    )
+    logger.info("Started stages {} of workflow execution {}".format(next_stages, workflow_execution["Id"]))
+
+    return json.loads(json.dumps(result, default=decimal_default))
+
+
+def decimal_default(value):
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError("Object of type {} is not JSON serializable".format(type(value).__name__))
+
+
+def end_dag_workflow_execution(workflow_execution, status, message):
+    DYNAMO_RESOURCE.Table(WORKFLOW_EXECUTION_TABLE_NAME).update_item(
+        Key={
+            'Id': workflow_execution["Id"]
+        },
+        UpdateExpression='SET CurrentStage = :current_stage',
+        ExpressionAttributeValues={
+            ':current_stage': "End"
+        }
+    )
+    update_workflow_execution_status(workflow_execution["Id"], status, message)
 
 
 def start_next_stage_execution(trigger, stage_name, workflow_execution):
@@ -429,14 +2266,14 @@ def start_next_stage_execution(trigger, stage_name, workflow_execution):
                 "Workflow"]["Stages"][current_stage]["Next"]
 
             workflow_execution["Workflow"]["Stages"][current_stage]["Input"] = workflow_execution["Globals"]
-            # workflow_execution["Workflow"]["Stages"][current_stage]["metrics"]["queue_time"] = int(
-            #    time.time())
+            # Stages follow each other in the same state machine, so the next stage starts right away
+            workflow_execution["Workflow"]["Stages"][current_stage]["Metrics"]["StartTime"] = metrics_timestamp()
             workflow_execution["Workflow"]["Stages"][current_stage]["Status"] = awsmie.STAGE_STATUS_STARTED
 
             try:
                 logger.info(
                     "Updating workflow with new current stage")
-                logger.info(json.dumps(workflow_execution))
+                logger.info(json.dumps(workflow_execution, default=decimal_default))
 
                 workitem = {
                     "WorkflowExecutionId": workflow_execution["Id"],
@@ -463,7 +2300,7 @@ def start_next_stage_execution(trigger, stage_name, workflow_execution):
                 )
                 
                 update_workflow_execution_status(workflow_execution["Id"], workflow_execution["Status"], message)
-                print(json.dumps(workitem))
+                print(json.dumps(workitem, default=decimal_default))
 
             except Exception as e:
                 message = "Exception queuing work item: {} ".format(e)
@@ -488,54 +2325,24 @@ def start_next_stage_execution(trigger, stage_name, workflow_execution):
         
 
     logger.info("workflow_execution: {}".format(
-        json.dumps(workflow_execution)))
+        json.dumps(workflow_execution, default=decimal_default)))
     return workflow_execution
 
     
 def update_workflow_execution_status(id, status, message):
     """
-    Get the workflow execution by id from dyanamo and assign to this object
+    Set the status of a workflow execution unless it was cancelled, see
+    WorkflowScheduling.update_workflow_execution_status
     :param id: The id of the workflow execution
     :param status: The new status of the workflow execution
-
+    :return: True if the status was set
     """
-    print("Update workflow execution {} set status = {}".format(id, status))
-    execution_table = DYNAMO_RESOURCE.Table(WORKFLOW_EXECUTION_TABLE_NAME)
-    
-    if status == awsmie.WORKFLOW_STATUS_ERROR:
-        response = execution_table.update_item(
-            Key={
-                'Id': id
-            },
-            UpdateExpression='SET #workflow_status = :workflow_status, Message = :message',
-            ExpressionAttributeNames={
-                '#workflow_status': "Status"
-            },
-            ExpressionAttributeValues={
-                ':workflow_status': status,
-                ':message': message
-
-            }
-        )
-    else:
-        response = execution_table.update_item(
-            Key={
-                'Id': id
-            },
-            UpdateExpression='SET #workflow_status = :workflow_status',
-            ExpressionAttributeNames={
-                '#workflow_status': "Status"
-            },
-            ExpressionAttributeValues={
-                ':workflow_status': status
-            }
-        )
-
-    if status in [awsmie.WORKFLOW_STATUS_QUEUED, awsmie.WORKFLOW_STATUS_COMPLETE, awsmie.WORKFLOW_STATUS_ERROR]:
-        # Trigger the workflow_scheduler
-        response = LAMBDA_CLIENT.invoke(
-            FunctionName=WORKFLOW_SCHEDULER_LAMBDA_ARN,
-            InvocationType='Event'
-        )
+    return WORKFLOW_SCHEDULING.update_workflow_execution_status(id, status, message)
 
 
+def trigger_workflow_scheduler():
+    """
+    Invoke the workflow scheduler unless a trigger is already pending, see
+    WorkflowScheduling.trigger_workflow_scheduler
+    """
+    WORKFLOW_SCHEDULING.trigger_workflow_scheduler()
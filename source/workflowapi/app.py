@@ -9,6 +9,7 @@ from botocore.client import ClientError
 from boto3.dynamodb.conditions import Key, Attr
 
 import uuid
+import hashlib
 import logging
 import os
 # from datetime import date
@@ -18,11 +19,15 @@ import json
 import time
 import decimal
 import signal
+import copy
+from concurrent.futures import ThreadPoolExecutor
 from jsonschema import validate, ValidationError
 # from urllib2 import build_opener, HTTPHandler, Request
 from urllib.request import build_opener, HTTPHandler, Request
 from MediaInsightsEngineLambdaHelper import DataPlane
 from MediaInsightsEngineLambdaHelper import Status as awsmie
+from MediaInsightsEngineLambdaHelper import result_cache_key
+from MediaInsightsEngineLambdaHelper import workflow_scheduling
 import os
 
 APP_NAME = "workflowapi"
@@ -54,12 +59,46 @@ OPERATION_TABLE_NAME = os.environ["OPERATION_TABLE_NAME"]
 WORKFLOW_EXECUTION_TABLE_NAME = os.environ["WORKFLOW_EXECUTION_TABLE_NAME"]
 HISTORY_TABLE_NAME = os.environ["HISTORY_TABLE_NAME"]
 STAGE_EXECUTION_QUEUE_URL = os.environ["STAGE_EXECUTION_QUEUE_URL"]
+# High and Low priority workflow executions have queues of their own, they share the Normal priority
+# queue when those are not configured
+if "HIGH_PRIORITY_STAGE_EXECUTION_QUEUE_URL" in os.environ and os.environ["HIGH_PRIORITY_STAGE_EXECUTION_QUEUE_URL"]:
+    HIGH_PRIORITY_STAGE_EXECUTION_QUEUE_URL = os.environ["HIGH_PRIORITY_STAGE_EXECUTION_QUEUE_URL"]
+else:
+    HIGH_PRIORITY_STAGE_EXECUTION_QUEUE_URL = STAGE_EXECUTION_QUEUE_URL
+if "LOW_PRIORITY_STAGE_EXECUTION_QUEUE_URL" in os.environ and os.environ["LOW_PRIORITY_STAGE_EXECUTION_QUEUE_URL"]:
+    LOW_PRIORITY_STAGE_EXECUTION_QUEUE_URL = os.environ["LOW_PRIORITY_STAGE_EXECUTION_QUEUE_URL"]
+else:
+    LOW_PRIORITY_STAGE_EXECUTION_QUEUE_URL = STAGE_EXECUTION_QUEUE_URL
 STAGE_EXECUTION_ROLE = os.environ["STAGE_EXECUTION_ROLE"]
 # FIXME testing NoQ execution
 COMPLETE_STAGE_LAMBDA_ARN = os.environ["COMPLETE_STAGE_LAMBDA_ARN"] 
 FILTER_OPERATION_LAMBDA_ARN = os.environ["FILTER_OPERATION_LAMBDA_ARN"]
 OPERATOR_FAILED_LAMBDA_ARN = os.environ["OPERATOR_FAILED_LAMBDA_ARN"]
 WORKFLOW_SCHEDULER_LAMBDA_ARN = os.environ["WORKFLOW_SCHEDULER_LAMBDA_ARN"]
+if "REGISTER_TASK_TOKEN_LAMBDA_ARN" in os.environ:
+    REGISTER_TASK_TOKEN_LAMBDA_ARN = os.environ["REGISTER_TASK_TOKEN_LAMBDA_ARN"]
+else:
+    REGISTER_TASK_TOKEN_LAMBDA_ARN = ""
+# Operations with CacheResults set reuse the results of a previous run on identical media, see
+# lookup_cached_results
+if "RESULT_CACHE_TABLE_NAME" in os.environ:
+    RESULT_CACHE_TABLE_NAME = os.environ["RESULT_CACHE_TABLE_NAME"]
+else:
+    RESULT_CACHE_TABLE_NAME = ""
+# Workflow execution requests with an Idempotency-Key are recorded so a retried request returns the
+# workflow execution it created, see claim_idempotency_key
+if "IDEMPOTENCY_TABLE_NAME" in os.environ:
+    IDEMPOTENCY_TABLE_NAME = os.environ["IDEMPOTENCY_TABLE_NAME"]
+else:
+    IDEMPOTENCY_TABLE_NAME = ""
+if "DATAPLANE_TABLE_NAME" in os.environ:
+    DATAPLANE_TABLE_NAME = os.environ["DATAPLANE_TABLE_NAME"]
+else:
+    DATAPLANE_TABLE_NAME = ""
+if "DATAPLANE_BUCKET" in os.environ:
+    DATAPLANE_BUCKET = os.environ["DATAPLANE_BUCKET"]
+else:
+    DATAPLANE_BUCKET = ""
 
 # DynamoDB
 DYNAMO_CLIENT = boto3.client("dynamodb")
@@ -78,6 +117,62 @@ IAM_RESOURCE = boto3.resource('iam')
 
 # Lambda
 LAMBDA_CLIENT = boto3.client("lambda")
+
+# Workflow execution status changes, slot releases and scheduler triggers shared with the workflow lambdas
+WORKFLOW_SCHEDULING = workflow_scheduling.WorkflowScheduling(SYSTEM_TABLE_NAME, WORKFLOW_EXECUTION_TABLE_NAME,
+                                                             WORKFLOW_SCHEDULER_LAMBDA_ARN)
+
+# S3
+S3_CLIENT = boto3.client("s3")
+
+# Scheduler invocations are coalesced, see trigger_workflow_scheduler
+SCHEDULER_TRIGGER = workflow_scheduling.SCHEDULER_TRIGGER
+
+# Workflow executions belong to a tenant, the scheduler shares workflow slots fairly between tenants
+# using a count of each tenant's queued workflows at each priority
+DEFAULT_TENANT = "default"
+QUEUED_TENANT_COUNTER_PREFIX = "QueuedTenant:"
+
+# Slots held by running workflow executions, see acquire_workflow_slot in the workflow lambdas
+WORKFLOW_SLOT_PREFIX = workflow_scheduling.WORKFLOW_SLOT_PREFIX
+
+# Workflow executions that can be cancelled, and how many are cancelled at a time in bulk
+CANCELLABLE_WORKFLOW_STATUSES = [awsmie.WORKFLOW_STATUS_QUEUED, awsmie.WORKFLOW_STATUS_STARTED]
+CANCEL_MAX_WORKERS = 10
+
+# Workflow executions the workflow reaper found with a timed out state machine can be resumed like failed ones
+RESUMABLE_WORKFLOW_STATUSES = [awsmie.WORKFLOW_STATUS_ERROR, awsmie.WORKFLOW_STATUS_TIMED_OUT]
+
+# Workflow executions submitted in one batch request, and how many of their assets are created at a time.
+# SQS takes at most 10 messages and 256 KB per SendMessageBatch and DynamoDB at most 25 items per
+# BatchWriteItem.
+BATCH_MAX_WORKFLOW_EXECUTIONS = 500
+BATCH_MAX_WORKERS = 20
+SQS_BATCH_MAX_MESSAGES = 10
+SQS_BATCH_MAX_BYTES = 262144
+DYNAMO_BATCH_WRITE_MAX_ITEMS = 25
+DYNAMO_BATCH_WRITE_ATTEMPTS = 5
+
+# How long an Idempotency-Key refers to the workflow execution it created, and its longest accepted value
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_KEY_TTL_SECONDS = 86400
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+# A key is pending while its request creates the workflow execution.  A retry can take over a pending key once
+# the lease runs out, which is longer than the workflow api lambda can run, so the first request has ended.
+IDEMPOTENCY_PENDING_SECONDS = 120
+IDEMPOTENCY_CLAIM_ATTEMPTS = 3
+
+# Workflow executions of an image sequence process a set of images with one asset, see create_asset in the
+# dataplane api
+IMAGE_SEQUENCE_MEDIA_TYPE = "ImageSequence"
+
+# Workflow execution priorities and the queue for each
+DEFAULT_WORKFLOW_PRIORITY = "Normal"
+STAGE_EXECUTION_QUEUE_URLS = {
+    "High": HIGH_PRIORITY_STAGE_EXECUTION_QUEUE_URL,
+    "Normal": STAGE_EXECUTION_QUEUE_URL,
+    "Low": LOW_PRIORITY_STAGE_EXECUTION_QUEUE_URL
+}
 # Helper class to convert a DynamoDB item to JSON.
 
 # cognito
@@ -96,6 +191,13 @@ class DecimalEncoder(json.JSONEncoder):
         return super(DecimalEncoder, self).default(o)
 
 
+def decimal_default(value):
+    # Keeps the numbers of values read from DynamoDB, such as cached results, numbers in JSON
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError("Object of type {} is not JSON serializable".format(type(value).__name__))
+
+
 def checkRequiredInput(key, dict, objectname):
     if key not in dict:
         raise BadRequestError("Key '%s' is required in '%s' input" % (
@@ -155,6 +257,55 @@ def create_system_configuration_api():
             This setting is checked each time the WorkflowSchedulerLambda is run and may
             take up to 60 seconds to take effect.
 
+        MaxConcurrentOperations
+
+            Sets the maximum number of workflows that may run an operation concurrently, for
+            example {"labelDetection": 20, "Transcribe": 100}.  Operations that are not listed
+            are only limited by MaxConcurrentWorkflows.  A workflow is admitted when there is
+            a slot for it and for every limited operation enabled in its stages, and each
+            operation slot is freed when the last stage running the operation completes.
+
+    The RunningWorkflows and RunningOperations:<operation> parameters are maintained by the
+    workflow scheduler and report the number of workflows currently holding a slot.  They can
+    be read but not set.
+
+        PriorityScheduling
+
+            Sets how the workflow scheduler shares free workflow slots between the High, Normal
+            and Low priority queues, for example {"Mode": "Weighted", "Weights": {"High": 6,
+            "Normal": 3, "Low": 1}}.  In Weighted mode, the default, each queue with waiting
+            workflows gets batches of slots in proportion to its weight so low priority work is
+            never starved.  In Strict mode a queue is only drawn from when all higher priority
+            queues are empty.
+
+        TenantConfiguration
+
+            Sets how the workflow scheduler shares workflow slots between the tenants that
+            submit workflows, for example {"teamA": {"Weight": 3}, "teamB": {"Weight": 1,
+            "MaxConcurrentWorkflows": 5}}.  Within each priority, workflows are admitted by
+            weighted fair queuing across tenants, and a tenant that holds its share of the slots
+            waits while other tenants are below theirs.  MaxConcurrentWorkflows optionally caps
+            the number of running workflows of a tenant.  Tenants that are not listed have a
+            Weight of 1 and no cap.
+
+    The RunningTenant:<tenant> and QueuedTenant:<priority>:<tenant> parameters are maintained by
+    the workflow scheduler and report the running and queued workflows of each tenant.  They can
+    be read but not set.
+
+    The AdaptiveConcurrencyLimit parameter is the scheduler's current admission limit.  It is
+    raised while stages complete cleanly, cut in half when operations fail with throttling
+    errors, and never exceeds MaxConcurrentWorkflows.  It can be read but not set.
+
+    The SchedulerQueueStatistics parameter is written by each scheduler run and reports the depth
+    of each priority queue, the number of workflows admitted from it and how long they waited on
+    the queue.  It can be read but not set.
+
+    The WorkflowReaperStatistics parameter is written by each run of the workflow reaper and reports
+    the number of started workflow executions it checked, the number it marked Error or Timed Out
+    because their state machine ended without them, the number of queued workflow executions it marked
+    Error because they never started, and the number of workflow slots it reclaimed.
+    It can be read but not set.
+
     Returns:
         None
 
@@ -176,7 +327,44 @@ def create_system_configuration_api():
             if config["Value"] < 1:
                 raise BadRequestError("MaxConcurrentWorkflows must be a value > 1")
 
+        if config["Name"] == "MaxConcurrentOperations":
+            if not isinstance(config["Value"], dict):
+                raise BadRequestError("MaxConcurrentOperations must be a map of operation name to concurrency limit")
+            for operation, limit in config["Value"].items():
+                if not isinstance(limit, int) or limit < 1:
+                    raise BadRequestError("MaxConcurrentOperations limit for {} must be a value >= 1".format(operation))
+
+        if config["Name"] == "PriorityScheduling":
+            if not isinstance(config["Value"], dict):
+                raise BadRequestError("PriorityScheduling must be a map with the scheduling Mode and priority Weights")
+            if config["Value"].get("Mode", "Weighted") not in ["Weighted", "Strict"]:
+                raise BadRequestError("PriorityScheduling Mode must be Weighted or Strict")
+            for priority, weight in config["Value"].get("Weights", {}).items():
+                if priority not in STAGE_EXECUTION_QUEUE_URLS:
+                    raise BadRequestError("PriorityScheduling Weights priority must be one of {}".format(", ".join(STAGE_EXECUTION_QUEUE_URLS)))
+                if not isinstance(weight, int) or weight < 1:
+                    raise BadRequestError("PriorityScheduling weight for {} must be a value >= 1".format(priority))
+
+        if config["Name"] == "TenantConfiguration":
+            if not isinstance(config["Value"], dict):
+                raise BadRequestError("TenantConfiguration must be a map of tenant to tenant settings")
+            for tenant, settings in config["Value"].items():
+                if not isinstance(settings, dict):
+                    raise BadRequestError("TenantConfiguration settings for {} must be a map".format(tenant))
+                for key in ["Weight", "MaxConcurrentWorkflows"]:
+                    if key in settings and (not isinstance(settings[key], int) or settings[key] < 1):
+                        raise BadRequestError("TenantConfiguration {} for {} must be a value >= 1".format(key, tenant))
+
+        # The scheduler keeps its slot accounting in the system table, don't let it be overwritten
+        if config["Name"] in ["RunningWorkflows", "SchedulerTrigger", workflow_scheduling.SCHEDULER_TENANTS, "AdaptiveConcurrencyLimit", "SchedulerQueueStatistics", "WorkflowReaperStatistics"] or config["Name"].startswith(WORKFLOW_SLOT_PREFIX) \
+                or config["Name"].startswith("RunningOperations:") or config["Name"].startswith("RunningTenant:") \
+                or config["Name"].startswith(QUEUED_TENANT_COUNTER_PREFIX):
+            raise BadRequestError("{} is maintained by the workflow scheduler and can't be set".format(config["Name"]))
+
         system_table.put_item(Item=config)
+    except BadRequestError as e:
+        logger.info("Exception {}".format(e))
+        raise
     except Exception as e:
         logger.info("Exception {}".format(e))
         raise ChaliceViewError("Exception '%s'" % e)
@@ -205,19 +393,30 @@ def get_system_configuration_api():
         500: Internal server error 
     """
 
+    configuration = []
     try:
 
         system_table = DYNAMO_RESOURCE.Table(SYSTEM_TABLE_NAME)
 
-        # Check if any configuration has been added yet
-        response = system_table.scan(
-            ConsistentRead=True)
-    
+        # Leave out the per-workflow slot leases, the pending trigger and the tenant registry kept by the scheduler
+        scan_args = {
+            'ConsistentRead': True,
+            'FilterExpression': ~Attr('Name').begins_with(WORKFLOW_SLOT_PREFIX) & Attr('Name').ne(SCHEDULER_TRIGGER) &
+                                Attr('Name').ne(workflow_scheduling.SCHEDULER_TENANTS)
+        }
+        while True:
+            response = system_table.scan(**scan_args)
+            configuration.extend(response["Items"])
+            if 'LastEvaluatedKey' not in response:
+                break
+            scan_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
     except Exception as e:
         logger.info("Exception {}".format(e))
         operation = None
         raise ChaliceViewError("Exception '%s'" % e)
-    return response["Items"]
+
+    return configuration
 
 ##############################################################################
 #    ___                       _
@@ -242,6 +441,27 @@ def create_operation_api():
     when the operation is successfully initiated, but not complete. Asynchronous operators require 
     an additional monitoring task to check the status of the operation.
 
+    The operation state machine skips the operation when it is disabled or the stage input has no
+    media of its MediaType.  Operations that need custom filtering logic can set FilterLambdaArn to a
+    lambda that returns the operation input with Status "Started" or "Skipped" instead.
+
+    Asynchronous operators poll the monitoring task until the operation completes, every 10 seconds
+    unless a PollingPolicy is set.  The policy's first poll is after ExpectedDurationSeconds, if set,
+    then after InitialDelaySeconds, with the interval growing by BackoffRate up to MaxIntervalSeconds.
+    A start lambda can also estimate its job duration, for example from the media duration, and report
+    it with MediaInsightsOperationHelper.add_expected_duration.  Operators whose
+    jobs publish a completion notification, such as Rekognition video jobs, can set Callback to wait
+    for the notification instead.  The state machine then runs the monitoring task once, when the
+    job completes, and falls back to polling if no notification arrives within CallbackTimeoutSeconds
+    (default 3600).
+
+    Operations whose results only depend on their input media and configuration can set CacheResults.
+    A workflow execution then reuses the results of an earlier run of the operation, with the same
+    configuration, on media with the same content fingerprint: the dataplane metadata of that run is
+    copied to the new asset and the operation completes without starting its job.  Operators that
+    store their dataplane metadata under a name other than the operation name set it in
+    DataplaneOperatorName.
+
     For more information on how to implemenent lambdas to be used in MIE operators, please
     refer to the MIE Developer Quick Start.
       
@@ -263,7 +483,18 @@ def create_operation_api():
                 }
             "StartLambdaArn":arn,
             "MonitorLambdaArn":arn,
-            "SfnExecutionRole": arn
+            "FilterLambdaArn":arn,
+            "SfnExecutionRole": arn,
+            "Callback": boolean,
+            "CallbackTimeoutSeconds": integer,
+            "PollingPolicy": {
+                "InitialDelaySeconds": number,
+                "BackoffRate": number,
+                "MaxIntervalSeconds": number,
+                "ExpectedDurationSeconds": number
+            },
+            "CacheResults": boolean,
+            "DataplaneOperatorName": string
             }
 
     Returns:
@@ -329,6 +560,15 @@ def create_operation(operation):
         else:
             raise BadRequestError('Operation Type must in ["Async"|"Sync"]')
 
+        if operation.get("Callback", False):
+            if operation["Type"] != "Async":
+                raise BadRequestError("Callback is only supported for Async operations")
+            if not REGISTER_TASK_TOKEN_LAMBDA_ARN:
+                raise BadRequestError("Callback operations are not supported, REGISTER_TASK_TOKEN_LAMBDA_ARN is not configured")
+
+        if "DataplaneOperatorName" in operation and not operation.get("CacheResults", False):
+            raise BadRequestError("DataplaneOperatorName is only used by operations that set CacheResults")
+
         # Check if this operation already exists
         response = operation_table.get_item(
             Key={
@@ -343,9 +583,21 @@ def create_operation(operation):
         # Build the operation state machine. 
 
         if operation["Type"] == "Async":
-            operationAsl = ASYNC_OPERATION_ASL
+            operationAsl = polling_operation_asl(operation.get("PollingPolicy", {}))
+            if operation.get("Callback", False):
+                operationAsl = callback_operation_asl(operationAsl, operation.get("CallbackTimeoutSeconds", DEFAULT_CALLBACK_TIMEOUT_SECONDS))
         elif operation["Type"] == "Sync":
-            operationAsl = SYNC_OPERATION_ASL
+            operationAsl = copy.deepcopy(SYNC_OPERATION_ASL)
+
+        # Operations with custom filtering logic run their own filter lambda, the others decide if they
+        # run in the state machine
+        if "FilterLambdaArn" in operation:
+            operationAsl["States"]["Filter %%OPERATION_NAME%% Media Type? (%%STAGE_NAME%%)"]["Resource"] = operation["FilterLambdaArn"]
+        else:
+            operationAsl = choice_filter_operation_asl(operationAsl, operation["Configuration"]["MediaType"])
+
+        if operation.get("CacheResults", False):
+            operationAsl = cached_operation_asl(operationAsl)
 
         # Setup task parameters in step function.  This filters out the paramters from
         # the stage data structure that belong to this specific operation and passes the
@@ -370,6 +622,10 @@ def create_operation(operation):
         operationAslString = operationAslString.replace("%%OPERATION_FAILED_LAMBDA%%", OPERATOR_FAILED_LAMBDA_ARN)
         operation["StateMachineAsl"] = operationAslString
 
+        if "PollingPolicy" in operation:
+            # DynamoDB doesn't take floats
+            operation["PollingPolicy"] = dict((key, decimal.Decimal(str(value))) for key, value in operation["PollingPolicy"].items())
+
         logger.info(json.dumps(operation["StateMachineAsl"]))
 
         operation["Version"] = "v0"
@@ -407,6 +663,9 @@ def create_operation(operation):
     except ConflictError as e:
         logger.error ("got CoonflictError: {}".format (e))
         raise 
+    except BadRequestError as e:
+        logger.error("got bad request error: {}".format(e))
+        raise
     except ValidationError as e:
         logger.error("got bad request error: {}".format(e))
         raise BadRequestError(e) 
@@ -553,6 +812,251 @@ ASYNC_OPERATION_ASL =         {
     }
 }
 
+def choice_filter_operation_asl(asl, media_type):
+    """
+    Replace the filter lambda at the start of an operation state machine with Choice states.
+
+    The operation runs when it is Enabled and the stage input has media of its MediaType, the same
+    test filter_operation_lambda makes.  The Pass states build the operation input the filter lambda
+    would have returned.  Configurations the Choice states can't decide on, such as a MediaType that
+    was changed for the workflow or a non boolean Enabled, still go to the filter lambda.
+    """
+    states = asl["States"]
+    states["Filter %%OPERATION_NAME%% (%%STAGE_NAME%%)"] = states.pop("Filter %%OPERATION_NAME%% Media Type? (%%STAGE_NAME%%)")
+
+    standard_configuration = [
+        {"Variable": "$.Configuration.%%OPERATION_NAME%%.MediaType", "IsPresent": True},
+        {"Variable": "$.Configuration.%%OPERATION_NAME%%.MediaType", "StringEquals": "%%OPERATION_MEDIA_TYPE%%"},
+        {"Variable": "$.Configuration.%%OPERATION_NAME%%.Enabled", "IsPresent": True},
+        {"Variable": "$.Configuration.%%OPERATION_NAME%%.Enabled", "IsBoolean": True}
+    ]
+    disabled = standard_configuration + [{"Variable": "$.Configuration.%%OPERATION_NAME%%.Enabled", "BooleanEquals": False}]
+    enabled = standard_configuration + [{"Variable": "$.Configuration.%%OPERATION_NAME%%.Enabled", "BooleanEquals": True}]
+
+    choices = [{"And": disabled, "Next": "Skip %%OPERATION_NAME%% (%%STAGE_NAME%%)"}]
+    if media_type == "MetadataOnly":
+        choices.append({"And": enabled, "Next": "Start %%OPERATION_NAME%% (%%STAGE_NAME%%)"})
+    else:
+        has_media = {"Variable": "$.Input.Media.%%OPERATION_MEDIA_TYPE%%", "IsPresent": True}
+        choices.append({"And": enabled + [has_media], "Next": "Start %%OPERATION_NAME%% (%%STAGE_NAME%%)"})
+        choices.append({"And": enabled + [{"Not": has_media}], "Next": "Skip %%OPERATION_NAME%% (%%STAGE_NAME%%)"})
+
+    states["Filter %%OPERATION_NAME%% Media Type? (%%STAGE_NAME%%)"] = {
+        "Type": "Choice",
+        "Choices": choices,
+        "Default": "Filter %%OPERATION_NAME%% (%%STAGE_NAME%%)"
+    }
+
+    for name, status, next_state in [("Start", awsmie.OPERATION_STATUS_STARTED, "Execute %%OPERATION_NAME%% (%%STAGE_NAME%%)"),
+                                     ("Skip", awsmie.OPERATION_STATUS_SKIPPED, "%%OPERATION_NAME%% Not Started (%%STAGE_NAME%%)")]:
+        states["{} %%OPERATION_NAME%% (%%STAGE_NAME%%)".format(name)] = {
+            "Type": "Pass",
+            "Parameters": {
+                "Name": "%%OPERATION_NAME%%",
+                "AssetId.$": "$.AssetId",
+                "WorkflowExecutionId.$": "$.WorkflowExecutionId",
+                "Input.$": "$.Input",
+                "Configuration.$": "$.Configuration.%%OPERATION_NAME%%",
+                "Status": status,
+                "MetaData": {},
+                "Media": {}
+            },
+            "Next": next_state
+        }
+    return asl
+
+
+def cached_operation_asl(asl):
+    """
+    Start an operation state machine with a Choice state that completes the operation from the result
+    cache.  lookup_cached_results adds the cached outputs of the operation to the CachedResults of its
+    stage when the workflow execution starts.
+    """
+    states = asl["States"]
+    states["Cached %%OPERATION_NAME%%? (%%STAGE_NAME%%)"] = {
+        "Type": "Choice",
+        "Choices": [{
+            "Variable": "$.CachedResults.%%OPERATION_NAME%%",
+            "IsPresent": True,
+            "Next": "%%OPERATION_NAME%% Cached (%%STAGE_NAME%%)"
+        }],
+        "Default": asl["StartAt"]
+    }
+    states["%%OPERATION_NAME%% Cached (%%STAGE_NAME%%)"] = {
+        "Type": "Pass",
+        "Parameters": {
+            "Name": "%%OPERATION_NAME%%",
+            "AssetId.$": "$.AssetId",
+            "WorkflowExecutionId.$": "$.WorkflowExecutionId",
+            "Input.$": "$.Input",
+            "Configuration.$": "$.Configuration.%%OPERATION_NAME%%",
+            "Status": awsmie.OPERATION_STATUS_COMPLETE,
+            "Cached": True,
+            "MetaData.$": "$.CachedResults.%%OPERATION_NAME%%.MetaData",
+            "Media.$": "$.CachedResults.%%OPERATION_NAME%%.Media"
+        },
+        "End": True
+    }
+    asl["StartAt"] = "Cached %%OPERATION_NAME%%? (%%STAGE_NAME%%)"
+    return asl
+
+
+DEFAULT_CALLBACK_TIMEOUT_SECONDS = 3600
+
+# Async operations poll their monitor lambda on the schedule of their PollingPolicy.  The default policy
+# polls every 10 seconds.  The polling loop is unrolled into one Wait, Get Status and Choice state per
+# interval, up to MAX_POLLING_STEPS, and the last interval repeats until the operation completes.
+DEFAULT_POLLING_INTERVAL_SECONDS = 10
+MAX_POLLING_STEPS = 20
+# Step Functions executions run for at most a year
+MAX_EXPECTED_DURATION_SECONDS = 365 * 24 * 60 * 60
+
+
+def polling_intervals(polling_policy):
+    """
+    Compute the wait before each poll of an async operation from its polling policy
+    :param polling_policy: Dict with the optional InitialDelaySeconds, BackoffRate, MaxIntervalSeconds
+                           and ExpectedDurationSeconds of the operation
+    :return: List of wait intervals in seconds, the last one repeats
+    """
+    initial_delay = float(polling_policy.get("InitialDelaySeconds", DEFAULT_POLLING_INTERVAL_SECONDS))
+    backoff_rate = float(polling_policy.get("BackoffRate", 1.0))
+    max_interval = float(polling_policy.get("MaxIntervalSeconds", max(initial_delay, DEFAULT_POLLING_INTERVAL_SECONDS)))
+
+    intervals = []
+    # Don't poll before the job can be expected to finish
+    if "ExpectedDurationSeconds" in polling_policy:
+        intervals.append(max(1, int(polling_policy["ExpectedDurationSeconds"])))
+
+    interval = initial_delay
+    while len(intervals) < MAX_POLLING_STEPS:
+        intervals.append(max(1, int(min(interval, max_interval))))
+        if backoff_rate <= 1.0 or interval >= max_interval:
+            break
+        interval = interval * backoff_rate
+    return intervals
+
+
+def polling_operation_asl(polling_policy):
+    """
+    Build the state machine of an async operation that polls its monitor lambda on the schedule of
+    its polling policy.
+
+    The start lambda can report an estimate of how long its job will take, for example from the media
+    duration, in the ExpectedDurationSeconds metadata key.  The first poll then waits for the estimate.
+    Choice rules can't test for integers, which a Wait state requires, so start lambdas report the
+    estimate with MediaInsightsOperationHelper.add_expected_duration, which rounds it up.  Estimates
+    that are missing, negative or too large fall back to the polling policy.
+    """
+    intervals = polling_intervals(polling_policy)
+    asl = copy.deepcopy(ASYNC_OPERATION_ASL)
+    states = asl["States"]
+
+    def step_name(name, step):
+        # The first step keeps the state names of the fixed interval state machine
+        if step == 0:
+            return name + " (%%STAGE_NAME%%)"
+        return "{} {} (%%STAGE_NAME%%)".format(name, step + 1)
+
+    wait = states.pop("%%OPERATION_NAME%% Wait (%%STAGE_NAME%%)")
+    get_status = states.pop("Get %%OPERATION_NAME%% Status (%%STAGE_NAME%%)")
+    did_complete = states.pop("Did %%OPERATION_NAME%% Complete (%%STAGE_NAME%%)")
+
+    for step, interval in enumerate(intervals):
+        next_step = min(step + 1, len(intervals) - 1)
+
+        step_wait = copy.deepcopy(wait)
+        step_wait["Seconds"] = interval
+        step_wait["Next"] = step_name("Get %%OPERATION_NAME%% Status", step)
+        states[step_name("%%OPERATION_NAME%% Wait", step)] = step_wait
+
+        step_get_status = copy.deepcopy(get_status)
+        step_get_status["Next"] = step_name("Did %%OPERATION_NAME%% Complete", step)
+        states[step_name("Get %%OPERATION_NAME%% Status", step)] = step_get_status
+
+        step_did_complete = copy.deepcopy(did_complete)
+        step_did_complete["Choices"][0]["Next"] = step_name("%%OPERATION_NAME%% Wait", next_step)
+        states[step_name("Did %%OPERATION_NAME%% Complete", step)] = step_did_complete
+
+    states["Execute %%OPERATION_NAME%% (%%STAGE_NAME%%)"]["Next"] = "%%OPERATION_NAME%% Expected Duration? (%%STAGE_NAME%%)"
+    states["%%OPERATION_NAME%% Expected Duration? (%%STAGE_NAME%%)"] = {
+        "Type": "Choice",
+        "Choices": [{
+            "And": [
+                {
+                    "Variable": "$.MetaData.ExpectedDurationSeconds",
+                    "IsPresent": True
+                },
+                {
+                    "Variable": "$.MetaData.ExpectedDurationSeconds",
+                    "IsNumeric": True
+                },
+                {
+                    "Variable": "$.MetaData.ExpectedDurationSeconds",
+                    "NumericGreaterThanEquals": 0
+                },
+                {
+                    "Variable": "$.MetaData.ExpectedDurationSeconds",
+                    "NumericLessThanEquals": MAX_EXPECTED_DURATION_SECONDS
+                }
+            ],
+            "Next": "%%OPERATION_NAME%% Wait Expected Duration (%%STAGE_NAME%%)"
+        }],
+        "Default": step_name("%%OPERATION_NAME%% Wait", 0)
+    }
+    states["%%OPERATION_NAME%% Wait Expected Duration (%%STAGE_NAME%%)"] = {
+        "Type": "Wait",
+        "SecondsPath": "$.MetaData.ExpectedDurationSeconds",
+        "Next": step_name("Get %%OPERATION_NAME%% Status", 0)
+    }
+    return asl
+
+
+def callback_operation_asl(asl, timeout_seconds):
+    """
+    Make an async operation state machine wait for a callback when its job completes.
+
+    After the start lambda, the state machine registers a task token for the job and waits.  When the
+    job completion notification resumes it, the monitor lambda runs once to collect the results.  If the
+    registration fails or no notification arrives within timeout_seconds, it polls the monitor lambda
+    like any other async operation.
+    """
+    # The callback replaces waiting for the expected duration
+    asl["States"].pop("%%OPERATION_NAME%% Expected Duration? (%%STAGE_NAME%%)", None)
+    asl["States"].pop("%%OPERATION_NAME%% Wait Expected Duration (%%STAGE_NAME%%)", None)
+    asl["States"]["Wait For %%OPERATION_NAME%% Callback? (%%STAGE_NAME%%)"] = {
+        "Type": "Choice",
+        "Choices": [{
+            "Variable": "$.Status",
+            "StringEquals": "Executing",
+            "Next": "%%OPERATION_NAME%% Callback (%%STAGE_NAME%%)"
+        }],
+        "Default": "Did %%OPERATION_NAME%% Complete (%%STAGE_NAME%%)"
+    }
+    asl["States"]["Execute %%OPERATION_NAME%% (%%STAGE_NAME%%)"]["Next"] = "Wait For %%OPERATION_NAME%% Callback? (%%STAGE_NAME%%)"
+    asl["States"]["%%OPERATION_NAME%% Callback (%%STAGE_NAME%%)"] = {
+        "Type": "Task",
+        "Resource": "arn:aws:states:::lambda:invoke.waitForTaskToken",
+        "Parameters": {
+            "FunctionName": REGISTER_TASK_TOKEN_LAMBDA_ARN,
+            "Payload": {
+                "TaskToken.$": "$$.Task.Token",
+                "Outputs.$": "$"
+            }
+        },
+        "TimeoutSeconds": int(timeout_seconds),
+        "ResultPath": None,
+        "Next": "Get %%OPERATION_NAME%% Status (%%STAGE_NAME%%)",
+        "Catch": [
+        {
+            "ErrorEquals": ["States.ALL"],
+            "Next": "%%OPERATION_NAME%% Wait (%%STAGE_NAME%%)",
+            "ResultPath": None
+        }
+        ]
+    }
+    return asl
+
 SYNC_OPERATION_ASL = {
     "StartAt": "Filter %%OPERATION_NAME%% Media Type? (%%STAGE_NAME%%)",
     "States": {
@@ -903,6 +1407,7 @@ def create_stage(stage):
     try:
         stage_table = DYNAMO_RESOURCE.Table(STAGE_TABLE_NAME)
         Configuration = {}
+        ResultCache = {}
 
         logger.info(stage)
         
@@ -959,6 +1464,8 @@ def create_stage(stage):
             stageAsl["States"][Name]["Branches"].append(
                 json.loads(operation["StateMachineAsl"]))
             Configuration[op] = operation["Configuration"]
+            if operation.get("CacheResults", False):
+                ResultCache[op] = {"DataplaneOperatorName": operation.get("DataplaneOperatorName", op)}
 
             stageStateMachineExecutionRoleArn = operation["StateMachineExecutionRoleArn"]
         
@@ -968,6 +1475,8 @@ def create_stage(stage):
         logger.info(json.dumps(stageAsl))
 
         stage["Configuration"] = Configuration
+        if ResultCache:
+            stage["ResultCache"] = ResultCache
 
         # Build stage
         response = SFN_CLIENT.create_state_machine(
@@ -1183,6 +1692,25 @@ def create_workflow_api():
     "Next" key indicating the next stage to execute or and "End" key indicating it
     is the last stage.
 
+    Instead of Next and End keys, the stages of a workflow can list the stages they depend on in
+    a "DependsOn" key.  Stages that don't depend on each other run in parallel.  The StartAt stage
+    must be the only stage without dependencies.  The workflow metadata is merged when parallel
+    stages join, in dependency order with independent stages ordered by name: when two parallel
+    stages output the same media type or metadata key, the stage that comes later in that order wins.
+
+    .. code-block:: python
+
+        {
+            "Name": string,
+            "StartAt": string - name of starting stage,
+            "Stages": {
+                "stage-name": {
+                    "DependsOn": ["string - name of a stage that must complete first", ...]
+                },
+                ...
+            }
+        }
+
     Body:
 
     .. code-block:: python
@@ -1292,6 +1820,9 @@ def create_workflow(trigger, workflow):
         else:
             raise
 
+    except BadRequestError:
+        raise
+
     except Exception as e:
 
         if "StateMachineArn" in workflow:
@@ -1306,6 +1837,10 @@ def create_workflow(trigger, workflow):
 
 def build_workflow(workflow):
 
+    # Workflows that declare the dependencies between their stages run independent stages in parallel
+    if any("DependsOn" in stage for stage in workflow["Stages"].values()):
+        return build_dag_workflow(workflow)
+
     logger.info("Sanity Check for End of workflow")
     endcount = 0
     for Name, stage in workflow["Stages"].items():
@@ -1323,25 +1858,7 @@ def build_workflow(workflow):
         raise BadRequestError("Workflow %s must have exactly 1 'End' key within its stages" % (
             workflow["Name"]))
 
-    logger.info("Get stage state machines")
-    for Name, stage in workflow["Stages"].items():
-        s = get_stage_by_name(Name)
-
-        logger.info(json.dumps(s))
-
-        response = SFN_CLIENT.describe_state_machine(
-            stateMachineArn=s["StateMachineArn"]
-        )
-
-        s["stateMachineAsl"] = json.loads(response["definition"])
-        stage.update(s)
-
-        # save the operators for this stage to the list of operators in the 
-        # workflow.  This list is maintained to make finding workflows that
-        # use an operator easier later
-        workflow["Operations"].extend(stage["Operations"])
-
-        logger.info(json.dumps(s))
+    get_workflow_stage_state_machines(workflow)
 
     # Build the workflow state machine.
     startStageAsl = workflow["Stages"][workflow["StartAt"]]["stateMachineAsl"]
@@ -1354,6 +1871,24 @@ def build_workflow(workflow):
         }
     }
 
+    # Resumed workflow executions start at the stage that failed, the state machine input is the stage
+    # that runs first, see resume_workflow_execution
+    resumeChoices = []
+    for workflowStageName, workflowStage in workflow["Stages"].items():
+        if workflowStageName != workflow["StartAt"]:
+            resumeChoices.append({
+                "Variable": "$.Name",
+                "StringEquals": workflowStageName,
+                "Next": workflowStage["stateMachineAsl"]["StartAt"]
+            })
+    if resumeChoices:
+        workflowAsl["StartAt"] = RESUME_WORKFLOW_STATE
+        workflowAsl["States"][RESUME_WORKFLOW_STATE] = {
+            "Type": "Choice",
+            "Choices": resumeChoices,
+            "Default": startAt
+        }
+
     logger.info("Merge stages into workflow state machine")
     for workflowStageName, workflowStage in workflow["Stages"].items():
         logger.info("LOOP OVER WORKFLOW STAGES")
@@ -1400,6 +1935,264 @@ def build_workflow(workflow):
 
     return workflow
 
+
+RESUME_WORKFLOW_STATE = "Resume Workflow?"
+
+
+def get_workflow_stage_state_machines(workflow):
+
+    logger.info("Get stage state machines")
+    for Name, stage in workflow["Stages"].items():
+        s = get_stage_by_name(Name)
+
+        logger.info(json.dumps(s))
+
+        response = SFN_CLIENT.describe_state_machine(
+            stateMachineArn=s["StateMachineArn"]
+        )
+
+        s["stateMachineAsl"] = json.loads(response["definition"])
+        stage.update(s)
+
+        # save the operators for this stage to the list of operators in the 
+        # workflow.  This list is maintained to make finding workflows that
+        # use an operator easier later
+        workflow["Operations"].extend(stage["Operations"])
+
+        logger.info(json.dumps(s))
+
+
+def build_dag_workflow(workflow):
+    """
+    Build the state machine of a workflow whose stages declare the stages they depend on with DependsOn
+    instead of Next and End keys.
+
+    The dependency graph is decomposed into sequences of stages and groups of independent sequences.  Each
+    group is compiled into a Parallel state with one branch per sequence, followed by a join task that merges
+    the outputs of the stages of the group into the workflow Globals.  Dependency graphs that aren't
+    series-parallel are cut into groups at the point that adds the fewest extra dependencies.
+    """
+    stages = workflow["Stages"]
+
+    logger.info("Sanity Check for workflow stage dependencies")
+    dependencies = {}
+    for Name, stage in stages.items():
+        if "Next" in stage or "End" in stage:
+            raise BadRequestError("Stage %s must not have 'Next' or 'End' keys in a workflow with stage dependencies" % (
+                Name))
+        depends_on = stage.get("DependsOn", [])
+        if not isinstance(depends_on, list):
+            raise BadRequestError("DependsOn of stage %s must be a list of stage names" % Name)
+        for dependency in depends_on:
+            if dependency not in stages or dependency == Name:
+                raise BadRequestError("Stage %s depends on an invalid stage '%s'" % (Name, dependency))
+        dependencies[Name] = list(depends_on)
+
+    roots = [Name for Name in stages if not dependencies[Name]]
+    if len(roots) != 1 or roots[0] != workflow["StartAt"]:
+        raise BadRequestError("StartAt of workflow %s must be the only stage without dependencies" % (
+            workflow["Name"]))
+
+    order = stage_topological_order(dependencies)
+    if order is None:
+        raise BadRequestError("Stage dependencies of workflow %s must not contain a cycle" % (
+            workflow["Name"]))
+
+    get_workflow_stage_state_machines(workflow)
+
+    sequence = decompose_stage_dependencies(set(order), order, stage_ancestors(dependencies, order))
+    logger.info("Workflow stage sequence {}".format(json.dumps(sequence)))
+
+    workflowAsl = {
+        "StartAt": stages[order[0]]["stateMachineAsl"]["StartAt"],
+        "States": {
+        }
+    }
+    group_count = [0]
+
+    def element_stages(element):
+        if isinstance(element, list):
+            return [Name for branch in element for e in branch for Name in element_stages(e)]
+        return [element]
+
+    def element_heads(element):
+        # The stages an element starts with, in the order the previous task returns their inputs
+        if isinstance(element, list):
+            return [Name for branch in element for Name in element_heads(branch[0])]
+        return [element]
+
+    def add_sequence(states, sequence, input_index, branch, next_heads):
+        """ Add the states of a sequence of stages, return the name of its first state """
+        start = None
+        for position, element in enumerate(sequence):
+            if position + 1 < len(sequence):
+                heads = element_heads(sequence[position + 1])
+            else:
+                heads = next_heads
+            first = add_element(states, element, input_index if position == 0 else 0, branch, heads)
+            if start is None:
+                start = first
+            else:
+                states[last]["Next"] = first
+                states[last].pop("End")
+            last = end_state
+        return start
+
+    def add_element(states, element, input_index, branch, next_heads):
+        nonlocal end_state
+        if isinstance(element, list):
+            group_count[0] += 1
+            group_name = "Parallel Stages {}".format(group_count[0])
+            join_name = "Join Stages {}".format(group_count[0])
+            branches = []
+            index = input_index
+            for sequence in element:
+                branch_states = {}
+                branch_start = add_sequence(branch_states, sequence, index, True, [])
+                branches.append({"StartAt": branch_start, "States": branch_states})
+                index += len(element_heads(sequence[0]))
+            states[group_name] = {
+                "Type": "Parallel",
+                "Branches": branches,
+                "ResultPath": None,
+                "Next": join_name
+            }
+            states[join_name] = {
+                "Type": "Task",
+                "Resource": COMPLETE_STAGE_LAMBDA_ARN,
+                "Parameters": {
+                    "Name": join_name,
+                    "WorkflowExecutionId.$": "$.WorkflowExecutionId",
+                    "Globals.$": "$.Globals",
+                    "JoinStages": [Name for Name in order if Name in element_stages(element)],
+                    "NextStages": next_heads,
+                    "Branch": branch
+                },
+                "End": True
+            }
+            end_state = join_name
+            return group_name
+
+        stageAsl = stages[element]["stateMachineAsl"]
+        complete_name = "Complete Stage {}".format(element)
+        stageAsl["States"][complete_name]["Parameters"] = {
+            "Name": element,
+            "Status.$": "$.Status",
+            "Outputs.$": "$.Outputs",
+            "WorkflowExecutionId.$": "$.WorkflowExecutionId",
+            "Input.$": "$.Input",
+            "NextStages": next_heads,
+            "Branch": branch
+        }
+        states.update(stageAsl["States"])
+        end_state = complete_name
+        if element == order[0]:
+            # The execution input is the first stage
+            return stageAsl["StartAt"]
+
+        # Stages after the first one take their input from the list returned by the previous task
+        start_name = "Start Stage {}".format(element)
+        states[start_name] = {
+            "Type": "Pass",
+            "InputPath": "$.Stages[{}]".format(input_index),
+            "Next": stageAsl["StartAt"]
+        }
+        return start_name
+
+    end_state = None
+    add_sequence(workflowAsl["States"], sequence, 0, False, [])
+
+    for Name, stage in stages.items():
+        stage.pop("stateMachineAsl")
+
+    logger.info(json.dumps(workflowAsl))
+    workflow["WorkflowAsl"] = workflowAsl
+
+    return workflow
+
+
+def stage_topological_order(dependencies):
+    """
+    Order stages so every stage comes after the stages it depends on, independent stages are ordered by name
+    :return: List of stage names, None if the dependencies contain a cycle
+    """
+    remaining = {Name: set(depends_on) for Name, depends_on in dependencies.items()}
+    order = []
+    while remaining:
+        ready = sorted(Name for Name, depends_on in remaining.items() if not depends_on)
+        if not ready:
+            return None
+        Name = ready[0]
+        order.append(Name)
+        del remaining[Name]
+        for depends_on in remaining.values():
+            depends_on.discard(Name)
+    return order
+
+
+def stage_ancestors(dependencies, order):
+    ancestors = {}
+    for Name in order:
+        ancestors[Name] = set()
+        for dependency in dependencies[Name]:
+            ancestors[Name].add(dependency)
+            ancestors[Name].update(ancestors[dependency])
+    return ancestors
+
+
+def decompose_stage_dependencies(names, order, ancestors):
+    """
+    Decompose a set of stages into a sequence whose elements are either a stage name or a group of independent
+    sequences, given as a list of sequences, that run in parallel.
+    """
+    names = [Name for Name in order if Name in names]
+    if len(names) == 1:
+        return names
+
+    def ordered(a, b):
+        return a in ancestors[b] or b in ancestors[a]
+
+    # A stage that every other stage runs before or after splits the sequence in two
+    for Name in names:
+        if all(other == Name or ordered(Name, other) for other in names):
+            before = set(other for other in names if other in ancestors[Name])
+            after = set(other for other in names if Name in ancestors[other])
+            sequence = []
+            if before:
+                sequence.extend(decompose_stage_dependencies(before, order, ancestors))
+            sequence.append(Name)
+            if after:
+                sequence.extend(decompose_stage_dependencies(after, order, ancestors))
+            return sequence
+
+    # Sets of stages that don't depend on each other run in parallel
+    components = []
+    for Name in names:
+        connected = [component for component in components if any(ordered(Name, other) for other in component)]
+        merged = set([Name])
+        for component in connected:
+            merged.update(component)
+            components.remove(component)
+        components.append(merged)
+    if len(components) > 1:
+        components.sort(key=lambda component: order.index(min(component, key=order.index)))
+        return [[decompose_stage_dependencies(component, order, ancestors) for component in components]]
+
+    # Otherwise wait for the stages up to some depth before starting the others, at the depth that makes
+    # the fewest stages wait for a stage they don't depend on
+    depth = {}
+    for Name in names:
+        depth[Name] = max([depth[other] + 1 for other in names if other in ancestors[Name]] + [0])
+    best = None
+    for cut in range(1, max(depth.values()) + 1):
+        before = set(Name for Name in names if depth[Name] < cut)
+        after = set(names) - before
+        extra = len([1 for a in before for b in after if a not in ancestors[b]])
+        if best is None or extra < best[0]:
+            best = (extra, before, after)
+    return decompose_stage_dependencies(best[1], order, ancestors) + \
+        decompose_stage_dependencies(best[2], order, ancestors)
+
 @app.route('/workflow', cors=True, methods=['PUT'], authorizer=authorizer)
 def update_workflow_api():
     """ Update a workflow from a list of existing stages.  
@@ -1528,6 +2321,9 @@ def update_workflow(trigger, new_workflow):
         else:
             raise
 
+    except BadRequestError:
+        raise
+
     except Exception as e:
 
         logger.info("Exception {}".format(e))
@@ -1754,6 +2550,11 @@ def create_workflow_execution_api():
         {
         "Name":"Default",
         "Input": media-object
+        "Priority": "High"|"Normal"|"Low"
+        "Tenant": "tenant-name"
+        "CacheResults": True|False
+        "Async": True|False
+        "IdempotencyKey": "client-request-id"
         "Configuration": {
             {
             "stage-name": {
@@ -1771,7 +2572,27 @@ def create_workflow_execution_api():
            ...
            }
         }
-    
+
+    Priority is optional and defaults to Normal.  Workflow executions of each priority are queued
+    separately and the workflow scheduler shares free workflow slots between the queues as set by the
+    PriorityScheduling system configuration.
+
+    Tenant is optional and names the team or owner the workflow runs for.  The scheduler shares
+    workflow slots fairly between tenants as set by the TenantConfiguration system configuration.
+
+    CacheResults is optional and defaults to true.  Operations that set CacheResults reuse the results
+    of an earlier run on media with the same content fingerprint and configuration, set it to false to
+    run every operation of the workflow again.
+
+    Async is optional and defaults to false.  When it is true the workflow execution is queued without
+    waiting for the input media to be copied to a new asset, the workflow asset lambda creates the asset
+    once the workflow scheduler admits the workflow execution.  The response is then a 202 with the workflow execution, which has no
+    AssetId until the workflow starts.  Async workflow executions don't reuse cached results.
+
+    IdempotencyKey is optional and can also be passed in the Idempotency-Key header.  A request that
+    repeats the key of an earlier request within 24 hours returns the workflow execution the earlier
+    request created instead of creating a new one, so a client can safely retry a request that timed out.
+    The key can't be reused with a different request body.
 
     Returns:
         A dict mapping keys to the corresponding workflow execution created including 
@@ -1802,101 +2623,201 @@ def create_workflow_execution_api():
 
     Raises:
         200: The workflow execution was created successfully.
+        202: The workflow execution was queued, its asset is created when it starts.
         400: Bad Request - the input workflow was not found or was invalid
+        409: Conflict - the workflow execution of the Idempotency-Key is still being created
         500: Internal server error  
     """
 
     logger.info(app.current_request.json_body)
     workflow_execution = app.current_request.json_body
 
-    return create_workflow_execution("api", workflow_execution)
+    Async = workflow_execution["Async"] if "Async" in workflow_execution else False
+    if not isinstance(Async, bool):
+        raise BadRequestError("Async must be a boolean")
+
+    IdempotencyKey = workflow_execution["IdempotencyKey"] if "IdempotencyKey" in workflow_execution else None
+    header_key = app.current_request.headers.get(IDEMPOTENCY_HEADER) if app.current_request.headers else None
+    if header_key is not None:
+        if IdempotencyKey is not None and IdempotencyKey != header_key:
+            raise BadRequestError("IdempotencyKey does not match the {} header".format(IDEMPOTENCY_HEADER))
+        IdempotencyKey = header_key
+    if IdempotencyKey is not None and (not isinstance(IdempotencyKey, str) or not IdempotencyKey or len(IdempotencyKey) > IDEMPOTENCY_KEY_MAX_LENGTH):
+        raise BadRequestError("IdempotencyKey must be a non-empty string of at most {} characters".format(IDEMPOTENCY_KEY_MAX_LENGTH))
+
+    status_code = 202 if Async else 200
+
+    Id = None
+    if IdempotencyKey is not None and IDEMPOTENCY_TABLE_NAME:
+        Id = str(uuid.uuid4())
+        request = {k: v for k, v in workflow_execution.items() if k != "IdempotencyKey"}
+        request_hash = hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+        claim = claim_idempotency_key(IdempotencyKey, request_hash, Id)
+        if claim is not None:
+            if claim["RequestHash"] != request_hash:
+                raise BadRequestError("IdempotencyKey '{}' was already used with a different request".format(IdempotencyKey))
+            logger.info("Idempotency key {} already created workflow execution {}".format(IdempotencyKey, claim["WorkflowExecutionId"]))
+            execution_table = DYNAMO_RESOURCE.Table(WORKFLOW_EXECUTION_TABLE_NAME)
+            response = execution_table.get_item(Key={'Id': claim["WorkflowExecutionId"]}, ConsistentRead=True)
+            if "Item" not in response:
+                raise ConflictError("Workflow execution '{}' of IdempotencyKey '{}' is still being created, retry later".format(
+                    claim["WorkflowExecutionId"], IdempotencyKey))
+            return Response(body=response["Item"], status_code=status_code)
+    elif IdempotencyKey is not None:
+        logger.info("Idempotency table is not configured, ignoring idempotency key {}".format(IdempotencyKey))
+
+    try:
+        workflow_execution = create_workflow_execution("api", workflow_execution, defer_asset=Async, Id=Id)
+    except Exception:
+        # Let a retry of the request create the workflow execution
+        if Id is not None:
+            release_idempotency_key(IdempotencyKey, Id)
+        raise
+    if Id is not None:
+        complete_idempotency_key(IdempotencyKey, Id)
+
+    if Async:
+        return Response(body=workflow_execution, status_code=status_code)
+
+    return workflow_execution
 
 
-def create_workflow_execution(trigger, workflow_execution):
+def claim_idempotency_key(IdempotencyKey, request_hash, Id):
+    """
+    Record that an idempotency key creates the workflow execution Id, unless an earlier request that has
+    not expired already recorded it.  The key is recorded before the workflow execution is created so a
+    retry that arrives while the asset of the first request is still being copied finds it.  Expired keys
+    are removed by the table's time to live, which can lag, so the condition also checks the expiry.
+
+    The key stays pending until complete_idempotency_key is called.  If the earlier request ended without
+    creating its workflow execution, such as when its lambda timed out, a retry of the same request takes
+    the key over once the pending lease runs out.
+    :param IdempotencyKey: The idempotency key of the request
+    :param request_hash: Hash of the request body, a key can't be reused for a different request
+    :param Id: Id of the workflow execution the request creates
+    :return: None if the key was recorded, otherwise the item of the earlier request
+    """
     execution_table = DYNAMO_RESOURCE.Table(WORKFLOW_EXECUTION_TABLE_NAME)
-    dynamo_status_queued = False
+    item = {
+        'IdempotencyKey': {'S': IdempotencyKey},
+        'RequestHash': {'S': request_hash},
+        'WorkflowExecutionId': {'S': Id}
+    }
 
-    create_asset = None
+    for attempt in range(IDEMPOTENCY_CLAIM_ATTEMPTS):
+        now = int(time.time())
+        item['Expires'] = {'N': str(now + IDEMPOTENCY_KEY_TTL_SECONDS)}
+        item['PendingUntil'] = {'N': str(now + IDEMPOTENCY_PENDING_SECONDS)}
+        try:
+            DYNAMO_CLIENT.put_item(
+                TableName=IDEMPOTENCY_TABLE_NAME,
+                Item=item,
+                ConditionExpression='attribute_not_exists(IdempotencyKey) OR Expires < :now',
+                ExpressionAttributeValues={':now': {'N': str(now)}}
+            )
+            return None
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+        response = DYNAMO_CLIENT.get_item(
+            TableName=IDEMPOTENCY_TABLE_NAME,
+            Key={'IdempotencyKey': {'S': IdempotencyKey}},
+            ConsistentRead=True
+        )
+        if "Item" not in response:
+            # The earlier request failed and released the key in the meantime
+            continue
+        claim = {
+            "RequestHash": response["Item"]["RequestHash"]["S"],
+            "WorkflowExecutionId": response["Item"]["WorkflowExecutionId"]["S"]
+        }
+        if claim["RequestHash"] != request_hash or "PendingUntil" not in response["Item"] \
+                or int(response["Item"]["PendingUntil"]["N"]) >= now:
+            return claim
+        # The earlier request may have created its workflow execution before it ended
+        if "Item" in execution_table.get_item(Key={'Id': claim["WorkflowExecutionId"]}, ConsistentRead=True):
+            return claim
+
+        logger.info("Taking over idempotency key {} of workflow execution {} that was never created".format(
+            IdempotencyKey, claim["WorkflowExecutionId"]))
+        try:
+            DYNAMO_CLIENT.put_item(
+                TableName=IDEMPOTENCY_TABLE_NAME,
+                Item=item,
+                ConditionExpression='WorkflowExecutionId = :earlier AND PendingUntil < :now',
+                ExpressionAttributeValues={
+                    ':earlier': {'S': claim["WorkflowExecutionId"]},
+                    ':now': {'N': str(now)}
+                }
+            )
+            return None
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            # Another retry took the key over first, read it again
 
+    raise ConflictError("IdempotencyKey '{}' is being used by concurrent requests, retry later".format(IdempotencyKey))
 
-    if "Media" in workflow_execution["Input"]:
-        create_asset = True
-    else:
-        create_asset = False
 
+def complete_idempotency_key(IdempotencyKey, Id):
+    """
+    Mark an idempotency key as no longer pending once its workflow execution has been created
+    :param IdempotencyKey: The idempotency key of the request
+    :param Id: Id of the workflow execution the key was recorded for
+    """
     try:
-        Name = workflow_execution["Name"]
+        DYNAMO_CLIENT.update_item(
+            TableName=IDEMPOTENCY_TABLE_NAME,
+            Key={'IdempotencyKey': {'S': IdempotencyKey}},
+            UpdateExpression='REMOVE PendingUntil',
+            ConditionExpression='WorkflowExecutionId = :id',
+            ExpressionAttributeValues={':id': {'S': Id}}
+        )
+    except ClientError as e:
+        # A pending key whose workflow execution exists is never taken over, so this is only tidying up
+        logger.info("Unable to complete idempotency key {}: {}".format(IdempotencyKey, e))
 
-        Configuration = workflow_execution["Configuration"] if "Configuration" in workflow_execution  else {}
-        
-        # BRANDON - make an asset
-        dataplane = DataPlane()
-        if create_asset is True:
-            try:
-                input = workflow_execution["Input"]["Media"]
-                media_type = list(input.keys())[0]
-                s3bucket = input[media_type]["S3Bucket"]
-                s3key = input[media_type]["S3Key"]
-            except KeyError as e:
-                logger.info("Exception {}".format(e))
-                raise ChaliceViewError("Exception '%s'" % e)
-            else:
-                asset_creation = dataplane.create_asset(s3bucket, s3key)
-                asset_input = {
-                    "Media": {
-                        media_type: {
-                            "S3Bucket": asset_creation["S3Bucket"],
-                            "S3Key": asset_creation["S3Key"]
-                        }
-                    }
-                }
-                asset_id = asset_creation["AssetId"]
-        else:
-            # TODO: Probably just accept the media type as input parameter
-            data_type_mapping = {"mp4": "Video", "mp3": "Audio", "txt": "Text", "json": "Text", "ogg": "Video"}
-            try:
-                input = workflow_execution["Input"]["AssetId"]
-            except KeyError as e:
-                logger.info("Exception {}".format(e))
-                raise ChaliceViewError("Exception '%s'" % e)
-            else:
-                asset_id = input
-                retrieve_asset = dataplane.retrieve_asset_metadata(asset_id)
-                if "results" in retrieve_asset:
-                    s3key = retrieve_asset["results"]["S3Key"]
-                    media_type = s3key.split('.')[-1]
-                    s3bucket = retrieve_asset["results"]["S3Bucket"]
-
-                    if media_type.lower() not in data_type_mapping:
-                        raise ChaliceViewError("Unsupported media type for input asset: {e}".format(e=media_type))
-                    else:
-                        asset_input = {
-                            "Media": {
-                                data_type_mapping[media_type.lower()]: {
-                                    "S3Bucket": s3bucket,
-                                    "S3Key": s3key
-                                }
-                            }
-                        }
-                else:
-                    raise ChaliceViewError("Unable to retrieve asset: {e}".format(e=asset_id))
 
-        workflow_execution = initialize_workflow_execution(trigger, Name, asset_input, Configuration, asset_id)
+def release_idempotency_key(IdempotencyKey, Id):
+    """
+    Remove the record of an idempotency key whose workflow execution could not be created
+    :param IdempotencyKey: The idempotency key of the request
+    :param Id: Id of the workflow execution the key was recorded for
+    """
+    try:
+        DYNAMO_CLIENT.delete_item(
+            TableName=IDEMPOTENCY_TABLE_NAME,
+            Key={'IdempotencyKey': {'S': IdempotencyKey}},
+            ConditionExpression='WorkflowExecutionId = :id',
+            ExpressionAttributeValues={':id': {'S': Id}}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            logger.info("Unable to release idempotency key {}: {}".format(IdempotencyKey, e))
+
+
+def create_workflow_execution(trigger, workflow_execution, defer_asset=False, Id=None):
+    execution_table = DYNAMO_RESOURCE.Table(WORKFLOW_EXECUTION_TABLE_NAME)
+    dynamo_status_queued = False
+
+    try:
+        workflow_execution, CacheResults = prepare_workflow_execution(trigger, workflow_execution, DataPlane(), defer_asset=defer_asset, Id=Id)
+        if CacheResults and "Fingerprint" in workflow_execution:
+            lookup_cached_results(workflow_execution)
 
         execution_table.put_item(Item=workflow_execution)
         dynamo_status_queued = True
 
         # FIXME - must set workflow status to error if this fails since we marked it as QUeued .  we had to do that to avoid
         # race condition on status with the execution itself.  Once we hand it off to the state machine, we can't touch the status again.
-        response = SQS_CLIENT.send_message(QueueUrl=STAGE_EXECUTION_QUEUE_URL, MessageBody=json.dumps(workflow_execution))
-        # the response contains MD5 of the body, a message Id, MD5 of message attributes, and a sequence number (for FIFO queues)
-        logger.info('Message ID : {}'.format(response['MessageId']))
-
-        # Trigger the workflow_scheduler
-        response = LAMBDA_CLIENT.invoke(
-            FunctionName=WORKFLOW_SCHEDULER_LAMBDA_ARN,
-            InvocationType='Event'
-        )
+        enqueue_workflow_execution(workflow_execution)
+
+        trigger_workflow_scheduler()
+
+    except BadRequestError as e:
+        logger.info("Exception {}".format(e))
+        raise
 
     except Exception as e:
         logger.info("Exception {}".format(e))
@@ -1909,12 +2830,436 @@ def create_workflow_execution(trigger, workflow_execution):
     return workflow_execution
 
 
-def initialize_workflow_execution(trigger, Name, input, Configuration, asset_id):
+def prepare_workflow_execution(trigger, workflow_execution, dataplane, workflow=None, defer_asset=False, Id=None):
+    """
+    Validate a workflow execution request, create or look up its asset and initialize the workflow execution
+    :param trigger: What requested the workflow execution
+    :param workflow_execution: The workflow execution request
+    :param dataplane: The DataPlane to create the asset with, a DataPlane is not thread safe
+    :param workflow: Optional workflow definition that was already read, otherwise it is read by name
+    :param defer_asset: Leave the creation of an asset for the input media to the workflow scheduler, see
+                        create_deferred_asset in the workflow lambdas
+    :param Id: Optional Id of the workflow execution, otherwise a new one is generated
+    :return: The workflow execution and whether it uses the result cache
+    """
+    create_asset = None
+
+
+    if "Media" in workflow_execution["Input"]:
+        create_asset = True
+    else:
+        create_asset = False
+
+    Name = workflow_execution["Name"]
+
+    Configuration = workflow_execution["Configuration"] if "Configuration" in workflow_execution  else {}
+
+    Priority = workflow_execution["Priority"] if "Priority" in workflow_execution else DEFAULT_WORKFLOW_PRIORITY
+    if Priority not in STAGE_EXECUTION_QUEUE_URLS:
+        raise BadRequestError("Priority must be one of {}".format(", ".join(STAGE_EXECUTION_QUEUE_URLS)))
+
+    Tenant = workflow_execution["Tenant"] if "Tenant" in workflow_execution else DEFAULT_TENANT
+    if not isinstance(Tenant, str) or not Tenant:
+        raise BadRequestError("Tenant must be a non-empty string")
+
+    CacheResults = workflow_execution["CacheResults"] if "CacheResults" in workflow_execution else True
+    if not isinstance(CacheResults, bool):
+        raise BadRequestError("CacheResults must be a boolean")
+    
+    # BRANDON - make an asset
+    if create_asset is True:
+        try:
+            input = workflow_execution["Input"]["Media"]
+            media_type = list(input.keys())[0]
+            if media_type == IMAGE_SEQUENCE_MEDIA_TYPE:
+                # A list of images or the images under a prefix, see create_asset in the dataplane api
+                sequence = input[media_type]
+                if "Items" not in sequence:
+                    sequence = {"S3Bucket": sequence["S3Bucket"], "S3Prefix": sequence["S3Prefix"]}
+            else:
+                s3bucket = input[media_type]["S3Bucket"]
+                s3key = input[media_type]["S3Key"]
+        except KeyError as e:
+            logger.info("Exception {}".format(e))
+            raise ChaliceViewError("Exception '%s'" % e)
+        if defer_asset:
+            # The workflow asset lambda creates the asset and copies the media before it starts the workflow
+            if media_type == IMAGE_SEQUENCE_MEDIA_TYPE:
+                asset_input = {"Media": {media_type: sequence}}
+            else:
+                asset_input = {
+                    "Media": {
+                        media_type: {
+                            "S3Bucket": s3bucket,
+                            "S3Key": s3key
+                        }
+                    }
+                }
+            asset_id = None
+            fingerprint = None
+        else:
+            if media_type == IMAGE_SEQUENCE_MEDIA_TYPE:
+                asset_creation = dataplane.create_image_sequence_asset(sequence.get("Items"), sequence.get("S3Bucket"), sequence.get("S3Prefix"))
+                if "AssetId" not in asset_creation:
+                    if asset_creation.get("Code") == "BadRequestError":
+                        raise BadRequestError(asset_creation["Message"])
+                    raise ChaliceViewError("Unable to create image sequence asset: {e}".format(e=asset_creation))
+            else:
+                asset_creation = dataplane.create_asset(s3bucket, s3key)
+            asset_input = {
+                "Media": {
+                    media_type: {
+                        "S3Bucket": asset_creation["S3Bucket"],
+                        "S3Key": asset_creation["S3Key"]
+                    }
+                }
+            }
+            asset_id = asset_creation["AssetId"]
+            fingerprint = asset_creation.get("Fingerprint")
+    else:
+        # TODO: Probably just accept the media type as input parameter
+        data_type_mapping = {"mp4": "Video", "mp3": "Audio", "txt": "Text", "json": "Text", "ogg": "Video"}
+        try:
+            input = workflow_execution["Input"]["AssetId"]
+        except KeyError as e:
+            logger.info("Exception {}".format(e))
+            raise ChaliceViewError("Exception '%s'" % e)
+        else:
+            asset_id = input
+            retrieve_asset = dataplane.retrieve_asset_metadata(asset_id)
+            if "results" in retrieve_asset:
+                # Assets created before the dataplane fingerprinted media have no fingerprint
+                fingerprint = retrieve_asset["results"].get("Fingerprint")
+                s3key = retrieve_asset["results"]["S3Key"]
+                media_type = s3key.split('.')[-1]
+                s3bucket = retrieve_asset["results"]["S3Bucket"]
+
+                # The media object of an image sequence asset is the manifest of its images
+                if retrieve_asset["results"].get("MediaType") == IMAGE_SEQUENCE_MEDIA_TYPE:
+                    asset_input = {
+                        "Media": {
+                            IMAGE_SEQUENCE_MEDIA_TYPE: {
+                                "S3Bucket": s3bucket,
+                                "S3Key": s3key
+                            }
+                        }
+                    }
+                elif media_type.lower() not in data_type_mapping:
+                    raise ChaliceViewError("Unsupported media type for input asset: {e}".format(e=media_type))
+                else:
+                    asset_input = {
+                        "Media": {
+                            data_type_mapping[media_type.lower()]: {
+                                "S3Bucket": s3bucket,
+                                "S3Key": s3key
+                            }
+                        }
+                    }
+            else:
+                raise ChaliceViewError("Unable to retrieve asset: {e}".format(e=asset_id))
+
+    workflow_execution = initialize_workflow_execution(trigger, Name, asset_input, Configuration, asset_id, workflow, Id)
+    workflow_execution["Priority"] = Priority
+    workflow_execution["Tenant"] = Tenant
+    if fingerprint:
+        workflow_execution["Fingerprint"] = fingerprint
+    if asset_id is None:
+        # The AssetId is set with the asset, it can't be null since it is the key of an index
+        workflow_execution["DeferredInput"] = asset_input
+        del workflow_execution["AssetId"]
+        for stage in workflow_execution["Workflow"]["Stages"].values():
+            del stage["AssetId"]
+
+    return workflow_execution, CacheResults
+
+
+def enqueue_workflow_execution(workflow_execution):
+    """
+    Send a workflow execution to the stage execution queue of its priority and count it as queued for its
+    tenant.  The caller triggers the workflow scheduler.
+    """
+    Priority = workflow_execution["Priority"] if "Priority" in workflow_execution else DEFAULT_WORKFLOW_PRIORITY
+
+    response = SQS_CLIENT.send_message(QueueUrl=STAGE_EXECUTION_QUEUE_URLS[Priority], MessageBody=json.dumps(workflow_execution, default=decimal_default))
+    # the response contains MD5 of the body, a message Id, MD5 of message attributes, and a sequence number (for FIFO queues)
+    logger.info('Message ID : {}'.format(response['MessageId']))
+
+    # The scheduler only counts down workflows queued with a tenant
+    if "Tenant" not in workflow_execution:
+        return
+    Tenant = workflow_execution["Tenant"]
+
+    try:
+        # Count the queued workflow for the scheduler's fair share between tenants
+        WORKFLOW_SCHEDULING.register_tenants([Tenant])
+        DYNAMO_CLIENT.update_item(
+            TableName=SYSTEM_TABLE_NAME,
+            Key={
+                'Name': {'S': QUEUED_TENANT_COUNTER_PREFIX + Priority + ":" + Tenant}
+            },
+            UpdateExpression='ADD #value :one',
+            ExpressionAttributeNames={'#value': 'Value'},
+            ExpressionAttributeValues={':one': {'N': '1'}}
+        )
+    except Exception as e:
+        # The workflow is queued all the same, the fair share just doesn't see it waiting
+        logger.info("Unable to count queued workflow for tenant {}: {}".format(Tenant, e))
+
+
+@app.route('/workflow/execution/batch', cors=True, methods=['POST'], authorizer=authorizer)
+def create_workflow_executions_api():
+    """ Execute workflows in bulk
+
+    Body:
+
+    .. code-block:: python
+
+        {
+            "Executions": [
+                workflow-execution-request,
+                ...
+            ]
+        }
+
+    Each workflow execution request has the same format as the body of POST /workflow/execution.  Up
+    to BATCH_MAX_WORKFLOW_EXECUTIONS workflow executions can be submitted at a time.  Each workflow is
+    read once for the batch and the workflow executions are stored and queued in batches.
+
+    Batch workflow executions are always Async: the workflow asset lambda creates the asset of a Media
+    input before it starts the workflow, so the request doesn't wait for the media to be copied.  Async can only
+    be true and IdempotencyKey is not supported, submit requests that need one to POST /workflow/execution.
+
+    Returns:
+        A dict with the result of each workflow execution request, in the order of the request.  The
+        result is the Id, AssetId and Status of the workflow execution that was queued, or the Error
+        that kept the workflow execution from being queued.  The AssetId of a Media input is null until
+        the workflow execution starts.
+
+        .. code-block:: python
+
+            {
+                "Executions": [
+                    {"Id": string, "AssetId": string, "Status": "Queued"},
+                    {"Error": string},
+                    ...
+                ]
+            }
+
+    Raises:
+        200: The workflow execution requests were processed, check each result.
+        400: Bad Request - Executions is missing, empty or too long
+        500: Internal server error
+    """
+    body = app.current_request.json_body or {}
+    requests = body["Executions"] if "Executions" in body else None
+    if not isinstance(requests, list) or not requests:
+        raise BadRequestError("Executions must be a non-empty list of workflow execution requests")
+    if len(requests) > BATCH_MAX_WORKFLOW_EXECUTIONS:
+        raise BadRequestError("At most {} workflow executions can be submitted at a time".format(BATCH_MAX_WORKFLOW_EXECUTIONS))
+
+    return {"Executions": create_workflow_executions("api", requests)}
+
+
+def create_workflow_executions(trigger, requests):
+    """
+    Create, store and queue a batch of workflow executions
+    :param trigger: What requested the workflow executions
+    :param requests: List of workflow execution requests
+    :return: List with the result of each request, in order
+    """
+    results = [None] * len(requests)
+
+    # Read each workflow once
+    workflow_table = DYNAMO_RESOURCE.Table(WORKFLOW_TABLE_NAME)
+    workflows = {}
+    for index, request in enumerate(requests):
+        if not isinstance(request, dict) or "Name" not in request or "Input" not in request:
+            results[index] = {"Error": "A workflow execution request needs a Name and an Input"}
+            continue
+        if "IdempotencyKey" in request:
+            results[index] = {"Error": "IdempotencyKey is not supported for batch workflow executions"}
+            continue
+        if "Async" in request and request["Async"] is not True:
+            results[index] = {"Error": "Batch workflow executions are always Async, Async can only be true"}
+            continue
+        if request["Name"] not in workflows:
+            try:
+                response = workflow_table.get_item(Key={'Name': request["Name"]}, ConsistentRead=True)
+            except ClientError as e:
+                logger.info("Exception {}".format(e))
+                raise ChaliceViewError("Exception '%s'" % e)
+            workflows[request["Name"]] = response["Item"] if "Item" in response else None
+        if workflows[request["Name"]] is None:
+            results[index] = {"Error": "Exception: workflow name '{}' not found".format(request["Name"])}
+
+    # Prepare the workflow executions concurrently, the workflow asset lambda creates the assets of Media inputs.  Inputs
+    # that are an existing asset are looked up in the dataplane.  A DataPlane is not thread safe, so each
+    # worker has its own and takes every nth request.
+    pending = [index for index in range(len(requests)) if results[index] is None]
+    workflow_executions = {}
+    if pending:
+        num_workers = min(len(pending), BATCH_MAX_WORKERS)
+        dataplanes = [DataPlane() for worker in range(num_workers)]
+
+        def prepare(worker):
+            prepared = {}
+            for index in pending[worker::num_workers]:
+                request = requests[index]
+                try:
+                    prepared[index] = prepare_workflow_execution(trigger, request, dataplanes[worker], workflows[request["Name"]],
+                                                                 defer_asset=True)
+                except Exception as e:
+                    logger.info("Exception {}".format(e))
+                    prepared[index] = e
+            return prepared
+
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            for prepared in executor.map(prepare, range(num_workers)):
+                for index, outcome in prepared.items():
+                    if isinstance(outcome, Exception):
+                        results[index] = {"Error": str(outcome)}
+                    else:
+                        workflow_execution, CacheResults = outcome
+                        if CacheResults and "Fingerprint" in workflow_execution:
+                            lookup_cached_results(workflow_execution)
+                        workflow_executions[index] = workflow_execution
+
+    # Store the workflow executions, only the ones DynamoDB did not store fail
+    written = []
+    indexes = sorted(workflow_executions.keys())
+    for start in range(0, len(indexes), DYNAMO_BATCH_WRITE_MAX_ITEMS):
+        chunk = indexes[start:start + DYNAMO_BATCH_WRITE_MAX_ITEMS]
+        unprocessed, error = batch_write_workflow_executions([workflow_executions[index] for index in chunk])
+        for index in chunk:
+            if workflow_executions[index]["Id"] in unprocessed:
+                results[index] = {"Error": "Exception '{}'".format(error)}
+            else:
+                written.append(index)
+
+    # Queue the stored workflow executions by priority
+    by_priority = {}
+    for index in written:
+        by_priority.setdefault(workflow_executions[index]["Priority"], []).append(index)
+
+    queued = []
+    for Priority, priority_indexes in by_priority.items():
+        for batch in sqs_message_batches([(index, json.dumps(workflow_executions[index], default=decimal_default)) for index in priority_indexes]):
+            try:
+                response = SQS_CLIENT.send_message_batch(
+                    QueueUrl=STAGE_EXECUTION_QUEUE_URLS[Priority],
+                    Entries=[{'Id': str(index), 'MessageBody': message_body} for index, message_body in batch]
+                )
+                failed = dict((int(failure['Id']), failure.get('Message', failure['Code'])) for failure in response.get('Failed', []))
+            except Exception as e:
+                logger.info("Exception {}".format(e))
+                failed = dict((index, str(e)) for index, message_body in batch)
+
+            for index, message_body in batch:
+                if index in failed:
+                    # The workflow execution was stored as Queued but never reached the queue
+                    error = "Exception '{}'".format(failed[index])
+                    update_workflow_execution_status(workflow_executions[index]["Id"], awsmie.WORKFLOW_STATUS_ERROR, error)
+                    results[index] = {"Error": error}
+                else:
+                    queued.append(index)
+
+    # Count the queued workflows for the scheduler's fair share between tenants, once per tenant
+    queued_tenants = {}
+    for index in queued:
+        key = workflow_executions[index]["Priority"] + ":" + workflow_executions[index]["Tenant"]
+        queued_tenants[key] = queued_tenants.get(key, 0) + 1
+        results[index] = {
+            "Id": workflow_executions[index]["Id"],
+            "AssetId": workflow_executions[index].get("AssetId"),
+            "Status": workflow_executions[index]["Status"]
+        }
+
+    if queued_tenants:
+        try:
+            WORKFLOW_SCHEDULING.register_tenants([key.split(":", 1)[1] for key in queued_tenants])
+        except Exception as e:
+            logger.info("Unable to register queued tenants: {}".format(e))
+    for key, count in queued_tenants.items():
+        try:
+            DYNAMO_CLIENT.update_item(
+                TableName=SYSTEM_TABLE_NAME,
+                Key={
+                    'Name': {'S': QUEUED_TENANT_COUNTER_PREFIX + key}
+                },
+                UpdateExpression='ADD #value :count',
+                ExpressionAttributeNames={'#value': 'Value'},
+                ExpressionAttributeValues={':count': {'N': str(count)}}
+            )
+        except Exception as e:
+            # The workflows are queued all the same, the fair share just doesn't see them waiting
+            logger.info("Unable to count queued workflows {}: {}".format(key, e))
+
+    logger.info("Queued {} of {} workflow executions".format(len(queued), len(requests)))
+    if queued:
+        trigger_workflow_scheduler()
+
+    return results
+
+
+def batch_write_workflow_executions(workflow_executions):
+    """
+    Store up to DYNAMO_BATCH_WRITE_MAX_ITEMS workflow executions, retrying the items DynamoDB leaves
+    unprocessed
+    :return: Tuple of the set of Ids of the workflow executions that were not stored and the error that kept
+             them from being stored
+    """
+    request_items = {
+        WORKFLOW_EXECUTION_TABLE_NAME: [{'PutRequest': {'Item': workflow_execution}} for workflow_execution in workflow_executions]
+    }
+    error = None
+    for attempt in range(DYNAMO_BATCH_WRITE_ATTEMPTS):
+        try:
+            response = DYNAMO_RESOURCE.batch_write_item(RequestItems=request_items)
+        except Exception as e:
+            # A rejected request stores none of its items, the ones stored by earlier attempts stay stored
+            logger.info("Exception {}".format(e))
+            error = e
+            break
+        request_items = response.get('UnprocessedItems', {})
+        if not request_items:
+            return set(), None
+        time.sleep(0.1 * 2 ** attempt)
+
+    unprocessed = set(request['PutRequest']['Item']['Id'] for request in request_items[WORKFLOW_EXECUTION_TABLE_NAME])
+    if error is None:
+        error = "Unable to store the workflow execution, DynamoDB left it unprocessed"
+    logger.info("Unable to store {} of {} workflow executions: {}".format(len(unprocessed), len(workflow_executions), error))
+    return unprocessed, error
+
+
+def sqs_message_batches(messages):
+    """
+    Split messages into batches that fit in a SendMessageBatch call
+    :param messages: List of (index, message body) tuples
+    :return: List of batches of (index, message body) tuples
+    """
+    batches = []
+    batch = []
+    size = 0
+    for index, message_body in messages:
+        message_size = len(message_body.encode('utf-8'))
+        if batch and (len(batch) == SQS_BATCH_MAX_MESSAGES or size + message_size > SQS_BATCH_MAX_BYTES):
+            batches.append(batch)
+            batch = []
+            size = 0
+        batch.append((index, message_body))
+        size += message_size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def initialize_workflow_execution(trigger, Name, input, Configuration, asset_id, workflow=None, Id=None):
     
     workflow_table = DYNAMO_RESOURCE.Table(WORKFLOW_TABLE_NAME)
 
     workflow_execution = {}
-    workflow_execution["Id"] = str(uuid.uuid4())
+    workflow_execution["Id"] = Id if Id is not None else str(uuid.uuid4())
     workflow_execution["Trigger"] = trigger
     workflow_execution["CurrentStage"] = None
     workflow_execution["Globals"] = {"Media": {}, "MetaData": {}}
@@ -1926,18 +3271,21 @@ def initialize_workflow_execution(trigger, Name, input, Configuration, asset_id)
     workflow_execution["ResourceType"] = "WORKFLOW_EXECUTION"
     workflow_execution["ApiVersion"] = API_VERSION
 
-    # lookup base workflow
-    response = workflow_table.get_item(
-        Key={
-            'Name': Name
-        },
-        ConsistentRead=True)
-
-    if "Item" in response:
-        workflow = response["Item"]
+    # lookup base workflow, a workflow that was already read is shared between workflow executions
+    if workflow is not None:
+        workflow = copy.deepcopy(workflow)
     else:
-        raise ChaliceViewError(
-            "Exception: workflow name '%s' not found" % Name)
+        response = workflow_table.get_item(
+            Key={
+                'Name': Name
+            },
+            ConsistentRead=True)
+
+        if "Item" in response:
+            workflow = response["Item"]
+        else:
+            raise ChaliceViewError(
+                "Exception: workflow name '%s' not found" % Name)
 
     print(workflow)
     # Override the default configuration with Configuration key-value pairs that are input to the 
@@ -1979,6 +3327,117 @@ def initialize_workflow_execution(trigger, Name, input, Configuration, asset_id)
     return workflow_execution
 
 
+def lookup_cached_results(workflow_execution):
+    """
+    Complete the cacheable operations of a workflow execution from the result cache.  The cache is keyed by
+    the fingerprint of the asset media, the operation and its effective configuration, see cache_stage_results
+    in the workflow lambdas.  On a hit the dataplane metadata and media of the earlier run are copied to the
+    new asset and the cached outputs are added to the CachedResults of the stage, the operation state machine
+    then completes the operation without starting it.  Lookup failures only cost a cache miss.
+    """
+    if not RESULT_CACHE_TABLE_NAME or not DATAPLANE_TABLE_NAME or not DATAPLANE_BUCKET:
+        return
+
+    cached_operations = {}
+    for stage_name, stage in workflow_execution["Workflow"]["Stages"].items():
+        if "ResultCache" not in stage:
+            continue
+        for operation_name, cache in stage["ResultCache"].items():
+            configuration = stage["Configuration"][operation_name]
+            if "Enabled" in configuration and configuration["Enabled"] != True:
+                continue
+            key = result_cache_key(workflow_execution["Fingerprint"], operation_name, configuration)
+            cached_operations[key] = (stage_name, operation_name, cache["DataplaneOperatorName"])
+
+    keys = list(cached_operations.keys())
+    # BatchGetItem reads at most 100 items per call
+    for start in range(0, len(keys), 100):
+        try:
+            response = DYNAMO_RESOURCE.batch_get_item(
+                RequestItems={
+                    RESULT_CACHE_TABLE_NAME: {
+                        "Keys": [{"CacheKey": key} for key in keys[start:start + 100]]
+                    }
+                }
+            )
+        except ClientError as e:
+            logger.info("Unable to look up cached results: {}".format(e))
+            return
+
+        for item in response["Responses"].get(RESULT_CACHE_TABLE_NAME, []):
+            stage_name, operation_name, dataplane_operator_name = cached_operations[item["CacheKey"]]
+            try:
+                media = link_cached_results(workflow_execution, dataplane_operator_name, item)
+            except Exception as e:
+                # The asset that computed the results may have been deleted, run the operation again
+                logger.info("Unable to reuse cached results of operation {}: {}".format(operation_name, e))
+                continue
+
+            stage = workflow_execution["Workflow"]["Stages"][stage_name]
+            if "CachedResults" not in stage:
+                stage["CachedResults"] = {}
+            stage["CachedResults"][operation_name] = {"Media": media, "MetaData": item["MetaData"]}
+            logger.info("Operation {} of workflow execution {} reuses the results of workflow execution {}".format(
+                operation_name, workflow_execution["Id"], item["WorkflowExecutionId"]))
+
+
+def link_cached_results(workflow_execution, dataplane_operator_name, item):
+    """
+    Copy the dataplane metadata and the media of a result cache entry to the asset of a workflow execution
+    and add the copied metadata to the pointers of the operator
+    :return: The media of the cache entry at its new location
+    """
+    source_prefix = "private/assets/{}/workflows/{}/".format(item["AssetId"], item["WorkflowExecutionId"])
+    target_prefix = "private/assets/{}/workflows/{}/".format(workflow_execution["AssetId"], workflow_execution["Id"])
+
+    media = copy.deepcopy(item["Media"])
+    for media_object in media.values():
+        if media_object["S3Key"].startswith(source_prefix):
+            media_object["S3Key"] = copy_cached_object(media_object["S3Key"], source_prefix, target_prefix)
+
+    pointers = []
+    for pointer in item["Pointers"]:
+        if pointer.endswith("/manifest.json"):
+            # Paginated metadata, the manifest lists the page objects
+            response = S3_CLIENT.get_object(Bucket=DATAPLANE_BUCKET, Key=pointer)
+            manifest = json.loads(response["Body"].read().decode('utf-8'))
+            for page in manifest["Pages"]:
+                page["Key"] = copy_cached_object(page["Key"], source_prefix, target_prefix)
+            target = target_prefix + pointer[len(source_prefix):]
+            S3_CLIENT.put_object(Bucket=DATAPLANE_BUCKET, Key=target, Body=json.dumps(manifest))
+        else:
+            target = copy_cached_object(pointer, source_prefix, target_prefix)
+        pointers.append({"workflow": workflow_execution["Id"], "pointer": target})
+
+    if pointers:
+        DYNAMO_RESOURCE.Table(DATAPLANE_TABLE_NAME).update_item(
+            Key={
+                "AssetId": workflow_execution["AssetId"]
+            },
+            UpdateExpression='SET #operator = list_append(:pointers, if_not_exists(#operator, :empty))',
+            ExpressionAttributeNames={
+                '#operator': dataplane_operator_name
+            },
+            ExpressionAttributeValues={
+                ':pointers': pointers,
+                ':empty': []
+            }
+        )
+    return media
+
+
+def copy_cached_object(key, source_prefix, target_prefix):
+    if not key.startswith(source_prefix):
+        raise ValueError("Cached object {} is not stored with the workflow execution that created it".format(key))
+    target = target_prefix + key[len(source_prefix):]
+    S3_CLIENT.copy_object(
+        Bucket=DATAPLANE_BUCKET,
+        Key=target,
+        CopySource={'Bucket': DATAPLANE_BUCKET, 'Key': key}
+    )
+    return target
+
+
 @app.route('/workflow/execution', cors=True, methods=['PUT'], authorizer=authorizer)
 def update_workflow_execution():
     """ Update a workflow execution NOT IMPLEMENTED 
@@ -2042,7 +3501,19 @@ def list_workflow_executions_by_status(Status):
     
     workflow_executions = response['Items']
     while 'LastEvaluatedKey' in response:
-        response = table.query(ExclusiveStartKey=response['LastEvaluatedKey'])
+        response = table.query(
+            IndexName='WorkflowExecutionStatus',
+            ExpressionAttributeNames={
+                '#workflow_status': "Status",
+                '#workflow_name': "Name"
+            },
+            ExpressionAttributeValues={
+                ':workflow_status': Status
+            },
+            KeyConditionExpression='#workflow_status = :workflow_status',
+            ProjectionExpression=projection_expression,
+            ExclusiveStartKey=response['LastEvaluatedKey']
+        )
         workflow_executions.extend(response['Items'])
 
     return workflow_executions
@@ -2078,7 +3549,19 @@ def list_workflow_executions_by_assetid(AssetId):
     
     workflow_executions = response['Items']
     while 'LastEvaluatedKey' in response:
-        response = table.query(ExclusiveStartKey=response['LastEvaluatedKey'])
+        response = table.query(
+            IndexName='WorkflowExecutionAssetId',
+            ExpressionAttributeNames={
+                '#workflow_status': "Status",
+                '#workflow_name': "Name"
+            },
+            ExpressionAttributeValues={
+                ':assetid': AssetId
+            },
+            KeyConditionExpression='AssetId = :assetid',
+            ProjectionExpression=projection_expression,
+            ExclusiveStartKey=response['LastEvaluatedKey']
+        )
         workflow_executions.extend(response['Items'])
 
     return workflow_executions
@@ -2112,6 +3595,446 @@ def get_workflow_execution_by_id(Id):
     return workflow_execution
 
 
+@app.route('/workflow/execution/{Id}/resume', cors=True, methods=['POST'], authorizer=authorizer)
+def resume_workflow_execution_api(Id):
+    """ Resume a failed or timed out workflow execution from the stage that failed
+
+    The stages that completed before the failed stage keep their outputs and are not run again.  The
+    failed stage and the stages after it run again with the Globals the workflow execution had when
+    the stage failed.  The workflow execution is queued with its original priority and tenant.
+
+    Workflows whose stages declare DependsOn can't be resumed, and workflows created before resuming was
+    supported must be updated before their executions can be resumed from a stage other than the first.
+
+    Returns:
+        A dict mapping keys to the corresponding workflow execution, with the stage it resumes from
+        in CurrentStage.
+
+    Raises:
+        200: The workflow execution was queued.
+        400: Bad Request - the workflow of the execution can't be resumed
+        404: Not found
+        409: Conflict - the workflow execution did not fail or time out
+        500: Internal server error
+    """
+    return resume_workflow_execution(Id)
+
+
+def resume_workflow_execution(Id):
+    execution_table = DYNAMO_RESOURCE.Table(WORKFLOW_EXECUTION_TABLE_NAME)
+
+    workflow_execution = get_workflow_execution_by_id(Id)
+    status = workflow_execution["Status"]
+    if status not in RESUMABLE_WORKFLOW_STATUSES:
+        raise ConflictError("Workflow execution {} has status {}, only failed workflow executions can be resumed".format(
+            Id, status))
+
+    workflow = workflow_execution["Workflow"]
+    stages = workflow["Stages"]
+    if any("DependsOn" in stage for stage in stages.values()):
+        raise BadRequestError("Executions of workflow {} can't be resumed, its stages declare DependsOn".format(workflow["Name"]))
+
+    # The first stage in workflow order that didn't complete is the one that failed
+    stage_name = workflow["StartAt"]
+    while stages[stage_name]["Status"] == awsmie.STAGE_STATUS_COMPLETE and "Next" in stages[stage_name]:
+        stage_name = stages[stage_name]["Next"]
+
+    if stage_name != workflow["StartAt"]:
+        try:
+            response = SFN_CLIENT.describe_state_machine(stateMachineArn=workflow["StateMachineArn"])
+        except ClientError as e:
+            raise ChaliceViewError("Exception '%s'" % e)
+        resume_state = json.loads(response["definition"])["States"].get(RESUME_WORKFLOW_STATE, {"Choices": []})
+        if stage_name not in [choice["StringEquals"] for choice in resume_state["Choices"]]:
+            raise BadRequestError("Workflow {} can't resume at stage {}, update the workflow to resume its executions".format(
+                workflow["Name"], stage_name))
+
+    # Reset the stages that run again, the completed stages keep their outputs
+    resume_stage = stage_name
+    while True:
+        stage = stages[stage_name]
+        stage["Status"] = awsmie.STAGE_STATUS_NOT_STARTED
+        stage["Metrics"] = {}
+        for key in ["Outputs", "OutputsLocation", "Input"]:
+            stage.pop(key, None)
+        if "Next" not in stage:
+            break
+        stage_name = stage["Next"]
+
+    stages[resume_stage]["Input"] = workflow_execution["Globals"]
+    stages[resume_stage]["Status"] = awsmie.STAGE_STATUS_STARTED
+    workflow_execution["CurrentStage"] = resume_stage
+    workflow_execution["Status"] = awsmie.WORKFLOW_STATUS_QUEUED
+    # Each state machine execution needs a name of its own, see start_workflow_execution
+    workflow_execution["ResumeCount"] = workflow_execution.get("ResumeCount", 0) + 1
+    workflow_execution.pop("Message", None)
+
+    try:
+        execution_table.put_item(
+            Item=workflow_execution,
+            ConditionExpression="#workflow_status = :status",
+            ExpressionAttributeNames={
+                '#workflow_status': "Status"
+            },
+            ExpressionAttributeValues={
+                ':status': status
+            })
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            raise ConflictError("Workflow execution {} was resumed or changed status".format(Id))
+        raise ChaliceViewError("Exception '%s'" % e)
+
+    try:
+        enqueue_workflow_execution(workflow_execution)
+    except Exception as e:
+        logger.info("Exception {}".format(e))
+        update_workflow_execution_status(Id, awsmie.WORKFLOW_STATUS_ERROR, "Exception {}".format(e))
+        raise ChaliceViewError("Exception '%s'" % e)
+
+    logger.info("Resumed workflow execution {} at stage {}".format(Id, resume_stage))
+    trigger_workflow_scheduler()
+
+    return workflow_execution
+
+
+@app.route('/workflow/execution/{Id}/cancel', cors=True, methods=['POST'], authorizer=authorizer)
+def cancel_workflow_execution_api(Id):
+    """ Cancel a queued or running workflow execution
+
+    The state machine of a running workflow execution is stopped, a queued workflow execution is dropped
+    when the workflow scheduler takes it off the queue.  The workflow execution is marked Cancelled and its
+    workflow slot is released right away, so queued workflow executions can start.
+
+    Returns:
+        A dict with the Id and Status of the workflow execution.
+
+    Raises:
+        200: The workflow execution was cancelled.
+        404: Not found
+        409: Conflict - the workflow execution already ended
+        500: Internal server error
+    """
+    workflow_execution = get_workflow_execution_by_id(Id)
+    if workflow_execution["Status"] not in CANCELLABLE_WORKFLOW_STATUSES:
+        raise ConflictError("Workflow execution {} has status {}, only queued or running workflow executions can be cancelled".format(
+            Id, workflow_execution["Status"]))
+
+    try:
+        cancelled = cancel_workflow_execution(workflow_execution)
+    except Exception as e:
+        logger.info("Exception {}".format(e))
+        raise ChaliceViewError("Exception '%s'" % e)
+    if not cancelled:
+        raise ConflictError("Workflow execution {} changed status while it was being cancelled".format(Id))
+
+    trigger_workflow_scheduler()
+
+    return {"Id": Id, "Status": awsmie.WORKFLOW_STATUS_CANCELLED}
+
+
+@app.route('/workflow/execution/cancel', cors=True, methods=['POST'], authorizer=authorizer)
+def cancel_workflow_executions_api():
+    """ Cancel the queued and running workflow executions of an asset or with a status
+
+    Body:
+
+    .. code-block:: python
+
+        {
+            "AssetId": "asset-id",
+            "Status": "Queued"|"Started"
+        }
+
+    At least one of AssetId and Status is required.  When both are set, only the workflow executions of
+    the asset with that status are cancelled.
+
+    Returns:
+        A dict with the Ids of the workflow executions that were "Cancelled" and the "Errors" of those
+        that could not be.
+
+    Raises:
+        200: The workflow executions were cancelled.
+        400: Bad Request - neither AssetId nor Status was set, or Status can't be cancelled
+        500: Internal server error
+    """
+    body = app.current_request.json_body or {}
+    if "AssetId" not in body and "Status" not in body:
+        raise BadRequestError("AssetId or Status is required")
+    if "Status" in body and body["Status"] not in CANCELLABLE_WORKFLOW_STATUSES:
+        raise BadRequestError("Status must be one of {}".format(", ".join(CANCELLABLE_WORKFLOW_STATUSES)))
+
+    try:
+        if "AssetId" in body:
+            workflow_executions = list_workflow_executions_by_assetid(body["AssetId"])
+        else:
+            workflow_executions = list_workflow_executions_by_status(body["Status"])
+    except Exception as e:
+        logger.info("Exception {}".format(e))
+        raise ChaliceViewError("Exception '%s'" % e)
+
+    statuses = [body["Status"]] if "Status" in body else CANCELLABLE_WORKFLOW_STATUSES
+    workflow_executions = [workflow_execution for workflow_execution in workflow_executions
+                           if workflow_execution["Status"] in statuses]
+
+    result = {"Cancelled": [], "Errors": []}
+    if not workflow_executions:
+        return result
+
+    def cancel(workflow_execution):
+        try:
+            if cancel_workflow_execution(workflow_execution):
+                return None
+            return "The workflow execution changed status while it was being cancelled"
+        except Exception as e:
+            logger.info("Exception cancelling workflow execution {}: {}".format(workflow_execution["Id"], e))
+            return str(e)
+
+    with ThreadPoolExecutor(max_workers=min(len(workflow_executions), CANCEL_MAX_WORKERS)) as executor:
+        errors = list(executor.map(cancel, workflow_executions))
+
+    for workflow_execution, error in zip(workflow_executions, errors):
+        if error is None:
+            result["Cancelled"].append(workflow_execution["Id"])
+        else:
+            result["Errors"].append({"Id": workflow_execution["Id"], "Message": error})
+
+    # One scheduler run starts the queued workflow executions for all the slots that were released
+    if result["Cancelled"]:
+        trigger_workflow_scheduler()
+
+    return result
+
+
+def cancel_workflow_execution(workflow_execution):
+    """
+    Mark a workflow execution Cancelled, stop its state machine and release its workflow slot.  Runs on a
+    thread pool for bulk cancellation, so it only uses the thread safe low level clients.
+    :param workflow_execution: The workflow execution with at least its Id, Status and StateMachineExecutionArn
+    :return: False if the workflow execution changed status since it was read
+    """
+    Id = workflow_execution["Id"]
+    try:
+        # The workflow lambdas don't overwrite the Cancelled status, see update_workflow_execution_status
+        DYNAMO_CLIENT.update_item(
+            TableName=WORKFLOW_EXECUTION_TABLE_NAME,
+            Key={
+                'Id': {'S': Id}
+            },
+            UpdateExpression='SET #workflow_status = :cancelled, Message = :message',
+            ConditionExpression='#workflow_status = :workflow_status',
+            ExpressionAttributeNames={
+                '#workflow_status': "Status"
+            },
+            ExpressionAttributeValues={
+                ':cancelled': {'S': awsmie.WORKFLOW_STATUS_CANCELLED},
+                ':workflow_status': {'S': workflow_execution["Status"]},
+                ':message': {'S': "Cancelled while {}".format(workflow_execution["Status"])}
+            }
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+
+    # A queued workflow execution has no state machine yet, the scheduler drops it from the queue
+    if "StateMachineExecutionArn" in workflow_execution:
+        try:
+            SFN_CLIENT.stop_execution(
+                executionArn=workflow_execution["StateMachineExecutionArn"],
+                error="Cancelled",
+                cause="Workflow execution {} was cancelled".format(Id)
+            )
+        except ClientError as e:
+            # The state machine already ended
+            logger.info("Unable to stop the state machine of workflow execution {}: {}".format(Id, e))
+
+    release_workflow_slot(Id)
+    logger.info("Cancelled workflow execution {}".format(Id))
+    return True
+
+
+def release_workflow_slot(workflow_execution_id):
+    """
+    Release the slot held by a workflow execution, if it holds one
+    :param workflow_execution_id: The id of the workflow execution
+    :return: True if a slot was released
+    """
+    return WORKFLOW_SCHEDULING.release_workflow_slot(workflow_execution_id)
+
+
+@app.route('/workflow/execution/{Id}/metrics', cors=True, methods=['GET'], authorizer=authorizer)
+def get_workflow_execution_metrics(Id):
+    """ Get the latency breakdown of a workflow execution
+
+    Times are epoch seconds and durations are seconds.  Stages and operations that are still running
+    are measured up to the time of the request.
+
+    Returns:
+        A dictionary containing the latency breakdown of the workflow execution:
+
+        .. code-block:: python
+
+            {
+                "WorkflowExecutionId": string,
+                "Status": string,
+                "QueueWaitSeconds": number - time between the execution request and the start of its first stage,
+                "DurationSeconds": number - time between the execution request and the end of its last stage,
+                "Stages": [
+                    {
+                        "Name": string,
+                        "Status": string,
+                        "StartTime": number,
+                        "EndTime": number,
+                        "DurationSeconds": number,
+                        "Operations": [
+                            {
+                                "Name": string,
+                                "StartTime": number,
+                                "EndTime": number,
+                                "DurationSeconds": number,
+                                "MonitorPolls": number - number of times the monitor lambda checked the job
+                            },
+                            ...
+                        ]
+                    },
+                    ...
+                ],
+                "CriticalPath": [
+                    {
+                        "Segment": "Queue" | "Operation" | "StageOverhead",
+                        "Stage": string,
+                        "Operation": string,
+                        "DurationSeconds": number,
+                        "Share": number - fraction of the workflow duration
+                    },
+                    ...
+                ],
+                "DominantOperation": the Operation segment of the critical path with the longest duration
+            }
+
+        The critical path runs back from the stage that ended last through the predecessor of each stage that
+        ended last.  Within a stage it follows the operation that finished last, since the stage waits for it,
+        and counts the rest of the stage and any wait for the stage to start as stage overhead.
+
+    Raises:
+        200: Workflow execution metrics returned sucessfully.
+        404: Not found
+        500: Internal server error
+    """
+    workflow_execution = get_workflow_execution_by_id(Id)
+
+    try:
+        return workflow_execution_metrics(workflow_execution)
+    except Exception as e:
+        logger.info("Exception {}".format(e))
+        raise ChaliceViewError("Exception: '%s'" % e)
+
+
+def workflow_execution_metrics(workflow_execution):
+    now = time.time()
+    workflow = workflow_execution["Workflow"]
+    created = float(workflow_execution["Created"])
+
+    def duration(start, end):
+        return round(end - start, 3)
+
+    # Stages run after the stages they depend on, or after the previous stage of a linear workflow
+    predecessors = {}
+    for stage_name, stage in workflow["Stages"].items():
+        predecessors.setdefault(stage_name, [])
+        if "DependsOn" in stage:
+            predecessors[stage_name].extend(stage["DependsOn"])
+        elif "Next" in stage and stage.get("End") != True:
+            predecessors.setdefault(stage["Next"], []).append(stage_name)
+
+    stages = {}
+    for stage_name, stage in workflow["Stages"].items():
+        metrics = stage.get("Metrics", {})
+        stage_metrics = {"Name": stage_name, "Status": stage.get("Status"), "Operations": []}
+        stages[stage_name] = stage_metrics
+        if "StartTime" not in metrics:
+            continue
+
+        stage_start = float(metrics["StartTime"])
+        stage_end = float(metrics["EndTime"]) if "EndTime" in metrics else now
+        stage_metrics.update({"StartTime": stage_start, "EndTime": stage_end,
+                              "DurationSeconds": duration(stage_start, stage_end)})
+        if "QueuedTime" in metrics:
+            stage_metrics["QueuedTime"] = float(metrics["QueuedTime"])
+
+        for name, operation in metrics.get("Operations", {}).items():
+            operation_metrics = {"Name": name, "MonitorPolls": int(operation.get("MonitorPolls", 0))}
+            if "StartTime" in operation:
+                operation_start = float(operation["StartTime"])
+                operation_end = float(operation["EndTime"]) if "EndTime" in operation else stage_end
+                operation_metrics.update({"StartTime": operation_start, "EndTime": operation_end,
+                                          "DurationSeconds": duration(operation_start, operation_end)})
+            stage_metrics["Operations"].append(operation_metrics)
+        stage_metrics["Operations"].sort(key=lambda op: op.get("DurationSeconds", 0), reverse=True)
+
+    started = [stage for stage in stages.values() if "StartTime" in stage]
+    started.sort(key=lambda stage: stage["StartTime"])
+    not_started = sorted([stage for stage in stages.values() if "StartTime" not in stage], key=lambda stage: stage["Name"])
+
+    # Walk back from the stage that ended last through the predecessor that ended last
+    path = []
+    if started:
+        stage = max(started, key=lambda stage: stage["EndTime"])
+        while stage is not None:
+            path.insert(0, stage)
+            previous = [stages[name] for name in predecessors.get(stage["Name"], []) if "EndTime" in stages.get(name, {})]
+            stage = max(previous, key=lambda stage: stage["EndTime"]) if previous else None
+
+    critical_path = []
+    queue_wait = None
+    if path:
+        first = started[0]
+        queue_wait = duration(first.get("QueuedTime", created), first["StartTime"])
+        critical_path.append({"Segment": "Queue", "DurationSeconds": queue_wait})
+    previous_end = None
+    for stage in path:
+        # Time a stage waited after its last predecessor ended, e.g. for the other stages of a parallel group
+        if previous_end is not None and stage["StartTime"] - previous_end >= 0.001:
+            critical_path.append({"Segment": "StageOverhead", "Stage": stage["Name"],
+                                  "DurationSeconds": duration(previous_end, stage["StartTime"])})
+        previous_end = stage["EndTime"]
+
+        # The stage waits for its slowest branch, time before and after it is stage overhead
+        timed = [operation for operation in stage["Operations"] if "EndTime" in operation]
+        if timed:
+            critical_operation = max(timed, key=lambda operation: operation["EndTime"])
+            critical_path.append({"Segment": "Operation", "Stage": stage["Name"],
+                                  "Operation": critical_operation["Name"],
+                                  "DurationSeconds": duration(stage["StartTime"], critical_operation["EndTime"])})
+            critical_path.append({"Segment": "StageOverhead", "Stage": stage["Name"],
+                                  "DurationSeconds": duration(critical_operation["EndTime"], stage["EndTime"])})
+        else:
+            critical_path.append({"Segment": "StageOverhead", "Stage": stage["Name"],
+                                  "DurationSeconds": stage["DurationSeconds"]})
+
+    total = duration(created, path[-1]["EndTime"]) if path else duration(created, now)
+    for segment in critical_path:
+        segment["Share"] = round(segment["DurationSeconds"] / total, 3) if total > 0 else 0
+
+    operation_segments = [segment for segment in critical_path if segment["Segment"] == "Operation"]
+    dominant_operation = None
+    if operation_segments:
+        dominant_operation = max(operation_segments, key=lambda segment: segment["DurationSeconds"])
+
+    for stage in started:
+        stage.pop("QueuedTime", None)
+
+    return {
+        "WorkflowExecutionId": workflow_execution["Id"],
+        "Status": workflow_execution["Status"],
+        "QueueWaitSeconds": queue_wait,
+        "DurationSeconds": total,
+        "Stages": started + not_started,
+        "CriticalPath": critical_path,
+        "DominantOperation": dominant_operation
+    }
+
+
 @app.route('/workflow/execution/{Id}', cors=True, methods=['DELETE'], authorizer=authorizer)
 def delete_workflow_execution(Id):
     """ Delete a workflow executions
@@ -2154,49 +4077,21 @@ def delete_workflow_execution(Id):
 
 def update_workflow_execution_status(id, status, message):
     """
-    Get the workflow execution by id from dyanamo and assign to this object
+    Set the status of a workflow execution unless it was cancelled, see
+    WorkflowScheduling.update_workflow_execution_status
     :param id: The id of the workflow execution
     :param status: The new status of the workflow execution
-
+    :return: True if the status was set
     """
-    print("Update workflow execution {} set status = {}".format(id, status))
-    execution_table = DYNAMO_RESOURCE.Table(WORKFLOW_EXECUTION_TABLE_NAME)
-    
-    if status == awsmie.WORKFLOW_STATUS_ERROR:
-        response = execution_table.update_item(
-            Key={
-                'Id': id
-            },
-            UpdateExpression='SET #workflow_status = :workflow_status, Message = :message',
-            ExpressionAttributeNames={
-                '#workflow_status': "Status"
-            },
-            ExpressionAttributeValues={
-                ':workflow_status': status,
-                ':message': message
+    return WORKFLOW_SCHEDULING.update_workflow_execution_status(id, status, message)
 
-            }
-        )
-    else:
-        response = execution_table.update_item(
-            Key={
-                'Id': id
-            },
-            UpdateExpression='SET #workflow_status = :workflow_status',
-            ExpressionAttributeNames={
-                '#workflow_status': "Status"
-            },
-            ExpressionAttributeValues={
-                ':workflow_status': status
-            }
-        )
 
-    if status in [awsmie.WORKFLOW_STATUS_QUEUED, awsmie.WORKFLOW_STATUS_COMPLETE, awsmie.WORKFLOW_STATUS_ERROR]:
-        # Trigger the workflow_scheduler
-        response = LAMBDA_CLIENT.invoke(
-            FunctionName=WORKFLOW_SCHEDULER_LAMBDA_ARN,
-            InvocationType='Event'
-        )
+def trigger_workflow_scheduler():
+    """
+    Invoke the workflow scheduler unless a trigger is already pending, see
+    WorkflowScheduling.trigger_workflow_scheduler
+    """
+    WORKFLOW_SCHEDULING.trigger_workflow_scheduler()
 
 
 # ================================================================================================
@@ -2253,6 +4148,14 @@ def operation_resource(event, context):
 
         # boolean type comes in as text from cloudformation - must decode string or take string for anabled parameter
         operation["Configuration"]["Enabled"] = bool(operation["Configuration"]["Enabled"])
+        if "Callback" in operation:
+            operation["Callback"] = str(operation["Callback"]).lower() == "true"
+        if "CallbackTimeoutSeconds" in operation:
+            operation["CallbackTimeoutSeconds"] = int(operation["CallbackTimeoutSeconds"])
+        if "PollingPolicy" in operation:
+            operation["PollingPolicy"] = dict((key, float(value)) for key, value in operation["PollingPolicy"].items())
+        if "CacheResults" in operation:
+            operation["CacheResults"] = str(operation["CacheResults"]).lower() == "true"
         operation = create_operation(operation)
         send_response(event, context, "SUCCESS",
                       {"Message": "Resource creation successful!", "Name": event["ResourceProperties"]["Name"],
@@ -0,0 +1,114 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+# Helpers to inspect the state machines the workflow api builds
+
+import json
+
+
+def transitions(state):
+    # Every state name a state can go to next
+    targets = []
+    if "Next" in state:
+        targets.append(state["Next"])
+    if "Default" in state:
+        targets.append(state["Default"])
+    for choice in state.get("Choices", []):
+        targets.append(choice["Next"])
+    for catch in state.get("Catch", []):
+        targets.append(catch["Next"])
+    return targets
+
+
+def dangling_transitions(asl):
+    states = asl["States"]
+    dangling = [asl["StartAt"]] if asl["StartAt"] not in states else []
+    for name, state in states.items():
+        dangling.extend(target for target in transitions(state) if target not in states)
+    return dangling
+
+
+def reachable_states(asl):
+    states = asl["States"]
+    reached = set()
+    pending = [asl["StartAt"]]
+    while pending:
+        name = pending.pop()
+        if name in reached:
+            continue
+        reached.add(name)
+        pending.extend(transitions(states[name]))
+    return reached
+
+
+def operation_asl(asl, name, media_type):
+    # Fill in the placeholders the workflow api replaces when it creates an operation
+    asl_string = json.dumps(asl)
+    asl_string = asl_string.replace("%%OPERATION_NAME%%", name)
+    asl_string = asl_string.replace("%%OPERATION_MEDIA_TYPE%%", media_type)
+    asl_string = asl_string.replace("%%STAGE_NAME%%", "{} Stage".format(name))
+    return json.loads(asl_string)
+
+
+def read_path(data, path):
+    # Read a simple JSONPath like $.Configuration.Name.Enabled, returns (found, value)
+    value = data
+    for key in path.split(".")[1:]:
+        if not isinstance(value, dict) or key not in value:
+            return False, None
+        value = value[key]
+    return True, value
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def matches(rule, data):
+    # Evaluate a Choice rule the way Step Functions does, for the comparison operators the engine uses
+    if "And" in rule:
+        return all(matches(r, data) for r in rule["And"])
+    if "Or" in rule:
+        return any(matches(r, data) for r in rule["Or"])
+    if "Not" in rule:
+        return not matches(rule["Not"], data)
+
+    found, value = read_path(data, rule["Variable"])
+    if "IsPresent" in rule:
+        return found == rule["IsPresent"]
+    if not found:
+        raise KeyError("Invalid path {}".format(rule["Variable"]))
+    if "IsBoolean" in rule:
+        return isinstance(value, bool) == rule["IsBoolean"]
+    if "IsNumeric" in rule:
+        return is_number(value) == rule["IsNumeric"]
+    if "StringEquals" in rule:
+        return isinstance(value, str) and value == rule["StringEquals"]
+    if "BooleanEquals" in rule:
+        return isinstance(value, bool) and value == rule["BooleanEquals"]
+    if "NumericGreaterThanEquals" in rule:
+        return is_number(value) and value >= rule["NumericGreaterThanEquals"]
+    if "NumericLessThanEquals" in rule:
+        return is_number(value) and value <= rule["NumericLessThanEquals"]
+    raise ValueError("Unsupported rule {}".format(rule))
+
+
+def choose(state, data):
+    for choice in state["Choices"]:
+        if matches(choice, data):
+            return choice["Next"]
+    return state["Default"]
+
+
+def parameters(template, data):
+    # Build the input of a Task or the output of a Pass state from its Parameters
+    result = {}
+    for key, value in template.items():
+        if key.endswith(".$"):
+            found, value = read_path(data, value)
+            result[key[:-2]] = value
+        elif isinstance(value, dict):
+            result[key] = parameters(value, data)
+        else:
+            result[key] = value
+    return result
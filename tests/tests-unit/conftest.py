@@ -0,0 +1,60 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+# Unit tests of the workflow engine that run without an MIE deployment.  The lambdas are imported
+# with placeholder resource names, and tests replace the boto3 clients they call with stubs.
+
+import pytest
+import importlib.util
+import os
+import sys
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "source")
+LIB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "lib", "MediaInsightsEngineLambdaHelper")
+
+ENVIRONMENT = {
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "AWS_REGION": "us-east-1",
+    "AWS_ACCESS_KEY_ID": "testing",
+    "AWS_SECRET_ACCESS_KEY": "testing",
+    "SYSTEM_TABLE_NAME": "mie-system",
+    "WORKFLOW_TABLE_NAME": "mie-workflow",
+    "STAGE_TABLE_NAME": "mie-stage",
+    "OPERATION_TABLE_NAME": "mie-operation",
+    "WORKFLOW_EXECUTION_TABLE_NAME": "mie-workflow-execution",
+    "HISTORY_TABLE_NAME": "mie-history",
+    "STAGE_EXECUTION_QUEUE_URL": "https://sqs.us-east-1.amazonaws.com/123456789012/mie-stage-execution",
+    "HIGH_PRIORITY_STAGE_EXECUTION_QUEUE_URL": "https://sqs.us-east-1.amazonaws.com/123456789012/mie-stage-execution-high",
+    "LOW_PRIORITY_STAGE_EXECUTION_QUEUE_URL": "https://sqs.us-east-1.amazonaws.com/123456789012/mie-stage-execution-low",
+    "STAGE_EXECUTION_ROLE": "arn:aws:iam::123456789012:role/mie-stage-execution",
+    "COMPLETE_STAGE_LAMBDA_ARN": "arn:aws:lambda:us-east-1:123456789012:function:mie-complete-stage",
+    "FILTER_OPERATION_LAMBDA_ARN": "arn:aws:lambda:us-east-1:123456789012:function:mie-filter-operation",
+    "OPERATOR_FAILED_LAMBDA_ARN": "arn:aws:lambda:us-east-1:123456789012:function:mie-operator-failed",
+    "WORKFLOW_SCHEDULER_LAMBDA_ARN": "arn:aws:lambda:us-east-1:123456789012:function:mie-workflow-scheduler",
+    "USER_POOL_ARN": "arn:aws:cognito-idp:us-east-1:123456789012:userpool/us-east-1_test",
+    "DataplaneEndpoint": "mie-dataplane"
+}
+
+for key, value in ENVIRONMENT.items():
+    os.environ.setdefault(key, value)
+
+sys.path.insert(0, LIB_DIR)
+
+
+def load_lambda(name, path):
+    # Both the workflow lambdas and the workflow api live in an app.py, so load them under distinct names
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope='session')
+def workflow_app():
+    return load_lambda("workflow_app", os.path.join(SOURCE_DIR, "workflow", "app.py"))
+
+
+@pytest.fixture(scope='session')
+def workflowapi_app():
+    sys.path.insert(0, os.path.join(SOURCE_DIR, "workflowapi"))
+    return load_lambda("workflowapi_app", os.path.join(SOURCE_DIR, "workflowapi", "app.py"))
@@ -0,0 +1,52 @@
+#!/bin/bash
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+###############################################################################
+# PURPOSE: This script runs the unit tests of the workflow engine.
+#
+# PRELIMINARY:
+#  None. The unit tests don't need an MIE deployment or AWS credentials.
+#
+# USAGE:
+#  ./run_tests.sh
+#
+###############################################################################
+
+# Create and activate a temporary Python environment for this script.
+echo "------------------------------------------------------------------------------"
+echo "Creating a temporary Python virtualenv for this script"
+echo "------------------------------------------------------------------------------"
+python -c "import os; print (os.getenv('VIRTUAL_ENV'))" | grep -q None
+if [ $? -ne 0 ]; then
+    echo "ERROR: Do not run this script inside Virtualenv. Type \`deactivate\` and run again.";
+    exit 1;
+fi
+which python3
+if [ $? -ne 0 ]; then
+    echo "ERROR: install Python3 before running this script"
+    exit 1
+fi
+VENV=$(mktemp -d)
+python3 -m venv $VENV
+source $VENV/bin/activate
+pip install -r requirements.txt
+if [ $? -ne 0 ]; then
+    echo "ERROR: Failed to install required Python libraries."
+    exit 1
+fi
+
+echo "------------------------------------------------------------------------------"
+echo "Running tests"
+pytest -s -W ignore::DeprecationWarning -p no:cacheprovider
+result=$?
+
+echo "------------------------------------------------------------------------------"
+echo "Cleaning up"
+echo "------------------------------------------------------------------------------"
+
+# Deactivate and remove the temporary python virtualenv used to run this script
+deactivate
+rm -rf $VENV
+rm -rf  __pycache__
+exit $result
@@ -0,0 +1,132 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+# In memory stand-ins for the boto3 clients and resources the workflow lambdas call
+
+import copy
+from botocore.exceptions import ClientError
+
+
+def client_error(code, operation):
+    return ClientError({"Error": {"Code": code, "Message": code}}, operation)
+
+
+class TableStub:
+    """
+    A DynamoDB table resource keyed by Name, like the system table.  put_item supports the condition
+    expressions the workflow lambdas use on the system table.
+    """
+    def __init__(self, items=None):
+        self.items = {}
+        self.puts = []
+        for item in items or []:
+            self.items[item["Name"]] = copy.deepcopy(item)
+
+    def get_item(self, Key, ConsistentRead=False):
+        if Key["Name"] in self.items:
+            return {"Item": copy.deepcopy(self.items[Key["Name"]])}
+        return {}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None):
+        existing = self.items.get(Item["Name"])
+        if ConditionExpression == "attribute_not_exists(#name)":
+            passed = existing is None
+        elif ConditionExpression == "#value = :value":
+            passed = existing is not None and existing["Value"] == ExpressionAttributeValues[":value"]
+        elif ConditionExpression is None:
+            passed = True
+        else:
+            raise NotImplementedError(ConditionExpression)
+        if not passed:
+            raise client_error("ConditionalCheckFailedException", "PutItem")
+        self.puts.append(copy.deepcopy(Item))
+        self.items[Item["Name"]] = copy.deepcopy(Item)
+
+
+class DynamoResourceStub:
+    def __init__(self, tables):
+        self.tables = tables
+
+    def Table(self, name):
+        return self.tables[name]
+
+
+class DynamoClientStub:
+    """
+    A low level DynamoDB client over tables of items in the DynamoDB JSON format.  update_item supports
+    conditions that AND together equality tests, scan supports a begins_with filter on the Name key.
+    """
+    def __init__(self, tables, page_size=100, unprocessed=0):
+        self.tables = tables
+        self.page_size = page_size
+        self.unprocessed = unprocessed
+        self.updates = []
+
+    def key(self, table, key):
+        name, value = list(key.items())[0]
+        return name, list(value.values())[0]
+
+    def find(self, table, key):
+        name, value = self.key(table, key)
+        for item in self.tables[table]:
+            if name in item and list(item[name].values())[0] == value:
+                return item
+        return None
+
+    def update_item(self, TableName, Key, UpdateExpression, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None):
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        item = self.find(TableName, Key)
+        if ConditionExpression is not None:
+            for test in ConditionExpression.split(" AND "):
+                attribute, value = [part.strip() for part in test.split("=")]
+                attribute = names.get(attribute, attribute)
+                if item is None or item.get(attribute) != values[value]:
+                    raise client_error("ConditionalCheckFailedException", "UpdateItem")
+        if item is None:
+            item = dict(Key)
+            self.tables[TableName].append(item)
+        assert UpdateExpression.startswith("SET ")
+        for assignment in UpdateExpression[len("SET "):].split(","):
+            attribute, value = [part.strip() for part in assignment.split("=")]
+            item[names.get(attribute, attribute)] = values[value]
+        self.updates.append({"TableName": TableName, "Key": Key, "Item": copy.deepcopy(item)})
+        return {}
+
+    def scan(self, TableName, FilterExpression, ExpressionAttributeNames, ExpressionAttributeValues, ExclusiveStartKey=None, **kwargs):
+        assert FilterExpression == "begins_with(#name, :slot)"
+        prefix = ExpressionAttributeValues[":slot"]["S"]
+        items = self.tables[TableName]
+        start = 0 if ExclusiveStartKey is None else items.index(self.find(TableName, ExclusiveStartKey)) + 1
+        page = items[start:start + self.page_size]
+        response = {"Items": [copy.deepcopy(item) for item in page if item["Name"]["S"].startswith(prefix)]}
+        if start + self.page_size < len(items):
+            response["LastEvaluatedKey"] = {"Name": page[-1]["Name"]}
+        return response
+
+    def batch_get_item(self, RequestItems):
+        responses = {}
+        unprocessed = {}
+        for table, request in RequestItems.items():
+            keys = request["Keys"]
+            # Leave some keys for the caller to retry, like a throttled table would
+            processed, left = keys[:len(keys) - self.unprocessed], keys[len(keys) - self.unprocessed:]
+            self.unprocessed = 0
+            responses[table] = [copy.deepcopy(item) for item in [self.find(table, key) for key in processed] if item is not None]
+            if left:
+                unprocessed[table] = dict(request, Keys=left)
+        return {"Responses": responses, "UnprocessedKeys": unprocessed}
+
+
+class StepFunctionsClientStub:
+    class exceptions:
+        class ExecutionDoesNotExist(Exception):
+            pass
+
+    def __init__(self, executions):
+        self.executions = executions
+
+    def describe_execution(self, executionArn):
+        if executionArn not in self.executions:
+            raise self.exceptions.ExecutionDoesNotExist(executionArn)
+        return dict(self.executions[executionArn], executionArn=executionArn)
@@ -0,0 +1,129 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import pytest
+from decimal import Decimal
+from stubs import TableStub, DynamoResourceStub
+
+NOW = 1600000000
+
+
+@pytest.fixture
+def system_table(workflow_app, monkeypatch):
+    table = TableStub([{"Name": "MaxConcurrentWorkflows", "Value": Decimal(10)}])
+    monkeypatch.setattr(workflow_app, "DYNAMO_RESOURCE", DynamoResourceStub({workflow_app.SYSTEM_TABLE_NAME: table}))
+    monkeypatch.setattr(workflow_app.time, "time", lambda: float(NOW))
+    return table
+
+
+def set_limit(table, value, last_decrease=0):
+    table.items["AdaptiveConcurrencyLimit"] = {
+        "Name": "AdaptiveConcurrencyLimit",
+        "Value": Decimal(str(value)),
+        "Ceiling": 10,
+        "LastDecrease": last_decrease
+    }
+
+
+def limit(table):
+    return table.items["AdaptiveConcurrencyLimit"]["Value"]
+
+
+def test_limit_starts_at_ceiling(workflow_app, system_table):
+    assert workflow_app.get_adaptive_concurrency_limit(10) == 10
+
+    # A clean stage can't raise the limit above the ceiling
+    workflow_app.adjust_adaptive_concurrency_limit(False)
+    assert system_table.puts == []
+
+
+def test_limit_increases_additively(workflow_app, system_table):
+    set_limit(system_table, 4)
+
+    workflow_app.adjust_adaptive_concurrency_limit(False)
+    assert limit(system_table) == Decimal("4.25")
+
+    # Each clean stage adds 1 / limit, so the limit grows by about one per limit stages
+    for i in range(3):
+        workflow_app.adjust_adaptive_concurrency_limit(False)
+    assert limit(system_table) == Decimal("4.92")
+    assert workflow_app.get_adaptive_concurrency_limit(10) == 4
+
+
+def test_limit_increase_is_capped_at_ceiling(workflow_app, system_table):
+    set_limit(system_table, 9.95)
+
+    workflow_app.adjust_adaptive_concurrency_limit(False)
+    assert limit(system_table) == Decimal("10.0")
+
+    workflow_app.adjust_adaptive_concurrency_limit(False)
+    assert len(system_table.puts) == 1
+
+
+def test_limit_decreases_multiplicatively(workflow_app, system_table):
+    set_limit(system_table, 8)
+
+    workflow_app.adjust_adaptive_concurrency_limit(True)
+    assert limit(system_table) == Decimal("4.0")
+    assert system_table.items["AdaptiveConcurrencyLimit"]["LastDecrease"] == NOW
+    assert system_table.items["AdaptiveConcurrencyLimit"]["Ceiling"] == 10
+
+
+def test_limit_decrease_starts_at_ceiling(workflow_app, system_table):
+    workflow_app.adjust_adaptive_concurrency_limit(True)
+    assert limit(system_table) == Decimal("5.0")
+
+
+def test_limit_decrease_cooldown(workflow_app, system_table):
+    set_limit(system_table, 8, last_decrease=NOW - workflow_app.AIMD_DECREASE_COOLDOWN_SECONDS + 1)
+
+    # Throttling from the workflows that ran before the last decrease doesn't cut the limit again
+    workflow_app.adjust_adaptive_concurrency_limit(True)
+    assert system_table.puts == []
+
+    set_limit(system_table, 8, last_decrease=NOW - workflow_app.AIMD_DECREASE_COOLDOWN_SECONDS)
+    workflow_app.adjust_adaptive_concurrency_limit(True)
+    assert limit(system_table) == Decimal("4.0")
+
+
+def test_limit_decrease_has_floor(workflow_app, system_table):
+    set_limit(system_table, 1.5)
+
+    workflow_app.adjust_adaptive_concurrency_limit(True)
+    assert limit(system_table) == Decimal("1.0")
+    assert workflow_app.get_adaptive_concurrency_limit(10) == 1
+
+
+def test_limit_is_clamped_to_ceiling(workflow_app, system_table):
+    # MaxConcurrentWorkflows was lowered after the limit was raised
+    set_limit(system_table, 20)
+    system_table.items["MaxConcurrentWorkflows"]["Value"] = Decimal(6)
+
+    assert workflow_app.get_adaptive_concurrency_limit(6) == 6
+
+    workflow_app.adjust_adaptive_concurrency_limit(True)
+    assert limit(system_table) == Decimal("3.0")
+    assert system_table.items["AdaptiveConcurrencyLimit"]["Ceiling"] == 6
+
+
+def test_limit_is_at_least_one(workflow_app, system_table):
+    set_limit(system_table, 0.2)
+
+    assert workflow_app.get_adaptive_concurrency_limit(10) == 1
+
+
+def test_concurrent_adjustment_wins(workflow_app, system_table):
+    set_limit(system_table, 8)
+
+    class ConcurrentTable(TableStub):
+        def put_item(self, **kwargs):
+            # Another stage adjusted the limit after this one read it
+            set_limit(self, 2, last_decrease=NOW)
+            return TableStub.put_item(self, **kwargs)
+
+    table = ConcurrentTable(system_table.items.values())
+    workflow_app.DYNAMO_RESOURCE.tables[workflow_app.SYSTEM_TABLE_NAME] = table
+
+    workflow_app.adjust_adaptive_concurrency_limit(False)
+    assert table.puts == []
+    assert limit(table) == Decimal("2")
@@ -0,0 +1,87 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import pytest
+import base64
+import json
+from MediaInsightsEngineLambdaHelper.dataplane_storage import DataPlaneStorage, DataPlaneError
+
+# Operator metadata by pointer, the list results are read one page per call
+METADATA = {
+    "private/assets/asset-1/workflows/workflow-1/labelDetection.json": [{"Labels": [1]}, {"Labels": [2]}, {"Labels": [3]}],
+    "private/assets/asset-1/workflows/workflow-1/transcribe.json": {"Transcript": "hello"}
+}
+LABELS = "private/assets/asset-1/workflows/workflow-1/labelDetection.json"
+TRANSCRIBE = "private/assets/asset-1/workflows/workflow-1/transcribe.json"
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    storage = DataPlaneStorage("dataplane-bucket", "dataplane-table")
+    monkeypatch.setattr(storage, "read_metadata_from_s3", lambda key: METADATA[key])
+    monkeypatch.setattr(storage, "is_metadata_manifest", lambda key: False)
+    return storage
+
+
+def old_cursor(next_object, remaining):
+    # The cursor format of earlier versions of the dataplane api
+    return base64.urlsafe_b64encode(json.dumps({"next": next_object, "remaining": remaining}).encode('UTF-8')).decode('ascii')
+
+
+def read_all(storage, cursor):
+    pages = []
+    while cursor is not None:
+        response, page_key = storage.get_asset_metadata("asset-1", cursor)
+        pages.append((response["operator"], response["results"]))
+        cursor = response.get("cursor")
+    return pages
+
+
+def test_asset_metadata_cursor(storage):
+    cursor = storage.encode_cursor({"next": {"operator": "labelDetection", "pointer": LABELS, "page": 0},
+                                    "remaining": [{"operator": "labelDetection", "pointer": LABELS},
+                                                  {"operator": "transcribe", "pointer": TRANSCRIBE}]})
+
+    assert read_all(storage, cursor) == [
+        ("labelDetection", {"Labels": [1]}),
+        ("labelDetection", {"Labels": [2]}),
+        ("labelDetection", {"Labels": [3]}),
+        ("transcribe", {"Transcript": "hello"})
+    ]
+
+
+def test_asset_metadata_old_cursor(storage):
+    # A client paging through the metadata when the dataplane was updated continues where it was
+    cursor = old_cursor({"labelDetection": LABELS, "page": 1},
+                        [{"labelDetection": LABELS}, {"transcribe": TRANSCRIBE}])
+
+    assert read_all(storage, cursor) == [
+        ("labelDetection", {"Labels": [2]}),
+        ("labelDetection", {"Labels": [3]}),
+        ("transcribe", {"Transcript": "hello"})
+    ]
+
+
+def test_asset_metadata_operator_old_cursor(storage):
+    cursor = old_cursor({"labelDetection": LABELS, "page": 2, "locator": None}, [{"labelDetection": LABELS}])
+
+    response, page_key = storage.get_asset_metadata_operator("asset-1", "labelDetection", cursor)
+
+    assert response["results"] == {"Labels": [3]}
+    assert "cursor" not in response
+
+    with pytest.raises(DataPlaneError) as e:
+        storage.get_asset_metadata_operator("asset-1", "transcribe", cursor)
+    assert e.value.code == "BadRequestError"
+
+
+@pytest.mark.parametrize("cursor", [
+    "not a cursor",
+    old_cursor({"page": 0}, []),
+    old_cursor({"labelDetection": LABELS, "transcribe": TRANSCRIBE, "page": 0}, []),
+    old_cursor(["labelDetection"], [])
+])
+def test_invalid_cursor(storage, cursor):
+    with pytest.raises(DataPlaneError) as e:
+        storage.get_asset_metadata("asset-1", cursor)
+    assert e.value.code == "BadRequestError"
@@ -0,0 +1,100 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import pytest
+import copy
+import asl as asl_helpers
+
+
+def filter_asl(workflowapi_app, name, media_type):
+    asl = workflowapi_app.choice_filter_operation_asl(copy.deepcopy(workflowapi_app.SYNC_OPERATION_ASL), media_type)
+    return asl_helpers.operation_asl(asl, name, media_type)
+
+
+def stage_input(name, configuration, media):
+    return {
+        "Name": "{} Stage".format(name),
+        "Status": "Started",
+        "AssetId": "asset-1",
+        "WorkflowExecutionId": "workflow-execution-1",
+        "Input": {
+            "Media": media,
+            "MetaData": {}
+        },
+        "Configuration": {
+            name: configuration
+        }
+    }
+
+
+def run_filter(asl, name, data):
+    # Run the operation state machine up to the state after the filter
+    states = asl["States"]
+    choice = "Filter {} Media Type? ({} Stage)".format(name, name)
+    assert asl["StartAt"] == choice
+    return asl_helpers.choose(states[choice], data)
+
+
+VIDEO = {"Video": {"S3Bucket": "bucket", "S3Key": "video.mp4"}}
+AUDIO = {"Audio": {"S3Bucket": "bucket", "S3Key": "audio.mp3"}}
+
+
+@pytest.mark.parametrize("media_type, configuration, media, route", [
+    # Disabled operations are skipped
+    ("Video", {"MediaType": "Video", "Enabled": False}, VIDEO, "Skip"),
+    ("MetadataOnly", {"MediaType": "MetadataOnly", "Enabled": False}, {}, "Skip"),
+    # Enabled operations run when the stage input has their media
+    ("Video", {"MediaType": "Video", "Enabled": True}, VIDEO, "Start"),
+    ("Video", {"MediaType": "Video", "Enabled": True}, AUDIO, "Skip"),
+    ("Video", {"MediaType": "Video", "Enabled": True}, {}, "Skip"),
+    # Metadata only operations don't need media
+    ("MetadataOnly", {"MediaType": "MetadataOnly", "Enabled": True}, {}, "Start"),
+    ("MetadataOnly", {"MediaType": "MetadataOnly", "Enabled": True}, VIDEO, "Start"),
+    # Configurations the Choice state can't decide on go to the filter lambda
+    ("Video", {"MediaType": "Audio", "Enabled": True}, AUDIO, "Filter"),
+    ("Video", {"Enabled": True}, VIDEO, "Filter"),
+    ("Video", {"MediaType": "Video", "Enabled": "true"}, VIDEO, "Filter"),
+    ("Video", {"MediaType": "Video"}, VIDEO, "Filter"),
+    ("MetadataOnly", {"MediaType": "Video", "Enabled": True}, VIDEO, "Filter")
+])
+def test_choice_filter_routes(workflowapi_app, media_type, configuration, media, route):
+    name = "TestOperation"
+    asl = filter_asl(workflowapi_app, name, media_type)
+
+    assert run_filter(asl, name, stage_input(name, configuration, media)) == "{} {} ({} Stage)".format(route, name, name)
+
+
+@pytest.mark.parametrize("media_type, configuration, media", [
+    ("Video", {"MediaType": "Video", "Enabled": False}, VIDEO),
+    ("Video", {"MediaType": "Video", "Enabled": True}, VIDEO),
+    ("Video", {"MediaType": "Video", "Enabled": True}, AUDIO),
+    ("MetadataOnly", {"MediaType": "MetadataOnly", "Enabled": True}, {}),
+    ("MetadataOnly", {"MediaType": "MetadataOnly", "Enabled": False}, VIDEO)
+])
+def test_choice_filter_matches_filter_lambda(workflowapi_app, workflow_app, media_type, configuration, media):
+    name = "TestOperation"
+    asl = filter_asl(workflowapi_app, name, media_type)
+    states = asl["States"]
+    data = stage_input(name, configuration, media)
+
+    route = run_filter(asl, name, data)
+    assert states[route]["Type"] == "Pass"
+    output = asl_helpers.parameters(states[route]["Parameters"], data)
+
+    # The filter lambda gets the input the Filter task builds and its output replaces the state input
+    filter_input = asl_helpers.parameters(states["Filter {} ({} Stage)".format(name, name)]["Parameters"], data)
+    expected = workflow_app.filter_operation_lambda(filter_input, None)
+
+    assert output == expected
+
+    # Both paths continue to the same state
+    skip = states["Skip {}? ({} Stage)".format(name, name)]
+    assert states[route]["Next"] == asl_helpers.choose(skip, expected)
+
+
+@pytest.mark.parametrize("media_type", ["Video", "MetadataOnly"])
+def test_choice_filter_transitions(workflowapi_app, media_type):
+    asl = filter_asl(workflowapi_app, "TestOperation", media_type)
+
+    assert asl_helpers.dangling_transitions(asl) == []
+    assert asl_helpers.reachable_states(asl) == set(asl["States"])
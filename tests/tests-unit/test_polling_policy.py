@@ -0,0 +1,103 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import pytest
+import asl as asl_helpers
+
+
+def test_default_polling_interval(workflowapi_app):
+    assert workflowapi_app.polling_intervals({}) == [workflowapi_app.DEFAULT_POLLING_INTERVAL_SECONDS]
+
+
+def test_polling_backoff_is_capped(workflowapi_app):
+    intervals = workflowapi_app.polling_intervals({"InitialDelaySeconds": 5, "BackoffRate": 2, "MaxIntervalSeconds": 60})
+
+    assert intervals == [5, 10, 20, 40, 60]
+
+
+def test_polling_expected_duration_comes_first(workflowapi_app):
+    intervals = workflowapi_app.polling_intervals({"ExpectedDurationSeconds": 300, "InitialDelaySeconds": 15})
+
+    assert intervals == [300, 15]
+
+
+def test_polling_intervals_are_whole_seconds(workflowapi_app):
+    intervals = workflowapi_app.polling_intervals({"ExpectedDurationSeconds": 0.2, "InitialDelaySeconds": 1, "BackoffRate": 1.5, "MaxIntervalSeconds": 10})
+
+    assert all(isinstance(interval, int) and interval >= 1 for interval in intervals)
+    assert intervals == [1, 1, 1, 2, 3, 5, 7, 10]
+
+
+def test_polling_steps_are_limited(workflowapi_app):
+    intervals = workflowapi_app.polling_intervals({"InitialDelaySeconds": 1, "BackoffRate": 1.01, "MaxIntervalSeconds": 3600})
+
+    assert len(intervals) == workflowapi_app.MAX_POLLING_STEPS
+    assert intervals == sorted(intervals)
+
+
+@pytest.mark.parametrize("polling_policy", [
+    {},
+    {"InitialDelaySeconds": 5, "BackoffRate": 2, "MaxIntervalSeconds": 60},
+    {"ExpectedDurationSeconds": 120, "InitialDelaySeconds": 10, "BackoffRate": 1.5, "MaxIntervalSeconds": 300},
+    {"InitialDelaySeconds": 1, "BackoffRate": 1.01, "MaxIntervalSeconds": 3600}
+])
+def test_polling_operation_asl_transitions(workflowapi_app, polling_policy):
+    asl = workflowapi_app.polling_operation_asl(polling_policy)
+
+    assert asl_helpers.dangling_transitions(asl) == []
+    assert asl_helpers.reachable_states(asl) == set(asl["States"])
+
+
+def test_polling_operation_asl_steps(workflowapi_app):
+    polling_policy = {"InitialDelaySeconds": 5, "BackoffRate": 2, "MaxIntervalSeconds": 60}
+    asl = workflowapi_app.polling_operation_asl(polling_policy)
+    states = asl["States"]
+
+    waits = [
+        "%%OPERATION_NAME%% Wait (%%STAGE_NAME%%)",
+        "%%OPERATION_NAME%% Wait 2 (%%STAGE_NAME%%)",
+        "%%OPERATION_NAME%% Wait 3 (%%STAGE_NAME%%)",
+        "%%OPERATION_NAME%% Wait 4 (%%STAGE_NAME%%)",
+        "%%OPERATION_NAME%% Wait 5 (%%STAGE_NAME%%)"
+    ]
+    assert [states[wait]["Seconds"] for wait in waits] == [5, 10, 20, 40, 60]
+    assert "%%OPERATION_NAME%% Wait 6 (%%STAGE_NAME%%)" not in states
+
+    # Each step polls once, then waits for the next step while the operation is executing
+    for step, wait in enumerate(waits[:-1]):
+        get_status = states[wait]["Next"]
+        did_complete = states[get_status]["Next"]
+        assert get_status.startswith("Get %%OPERATION_NAME%% Status")
+        assert states[did_complete]["Choices"][0]["StringEquals"] == "Executing"
+        assert states[did_complete]["Choices"][0]["Next"] == waits[step + 1]
+
+    # The last step repeats until the operation completes
+    last_did_complete = states[states[waits[-1]]["Next"]]["Next"]
+    assert states[last_did_complete]["Choices"][0]["Next"] == waits[-1]
+    assert states[last_did_complete]["Choices"][1]["Next"] == "%%OPERATION_NAME%% Succeeded (%%STAGE_NAME%%)"
+    assert states[last_did_complete]["Default"] == "%%OPERATION_NAME%% Failed (%%STAGE_NAME%%)"
+
+
+def test_polling_operation_asl_expected_duration(workflowapi_app):
+    asl = workflowapi_app.polling_operation_asl({})
+    states = asl["States"]
+
+    expected_duration = states[states["Execute %%OPERATION_NAME%% (%%STAGE_NAME%%)"]["Next"]]
+    assert expected_duration["Type"] == "Choice"
+    assert expected_duration["Default"] == "%%OPERATION_NAME%% Wait (%%STAGE_NAME%%)"
+
+    rules = expected_duration["Choices"][0]["And"]
+    assert {"Variable": "$.MetaData.ExpectedDurationSeconds", "NumericGreaterThanEquals": 0} in rules
+    assert all(rule["Variable"] == "$.MetaData.ExpectedDurationSeconds" for rule in rules)
+
+    wait_expected_duration = states[expected_duration["Choices"][0]["Next"]]
+    assert wait_expected_duration["SecondsPath"] == "$.MetaData.ExpectedDurationSeconds"
+    assert wait_expected_duration["Next"] == "Get %%OPERATION_NAME%% Status (%%STAGE_NAME%%)"
+
+
+def test_callback_operation_asl_transitions(workflowapi_app):
+    asl = workflowapi_app.polling_operation_asl({"InitialDelaySeconds": 5, "BackoffRate": 2, "MaxIntervalSeconds": 60})
+    asl = workflowapi_app.callback_operation_asl(asl, 600)
+
+    assert asl_helpers.dangling_transitions(asl) == []
+    assert asl_helpers.reachable_states(asl) == set(asl["States"])
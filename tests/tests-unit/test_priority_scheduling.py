@@ -0,0 +1,98 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import pytest
+
+WEIGHTS = {"High": 6, "Normal": 3, "Low": 1}
+
+
+def test_weighted_round_robin_order(workflow_app):
+    credits = {"High": 0, "Normal": 0, "Low": 0}
+    priorities = ["High", "Normal", "Low"]
+
+    order = [workflow_app.next_priority(priorities, workflow_app.PRIORITY_MODE_WEIGHTED, WEIGHTS, credits) for i in range(10)]
+
+    # Smooth weighted round robin interleaves the queues instead of draining High first
+    assert order == ["High", "Normal", "High", "High", "Normal", "High", "Low", "High", "Normal", "High"]
+    # After a full round each queue got its weight in batches and the credits are back where they started
+    assert credits == {"High": 0, "Normal": 0, "Low": 0}
+
+
+def test_weighted_round_robin_carries_credits(workflow_app):
+    # The credits saved by the previous scheduler run decide where the next one continues
+    credits = {"High": -4, "Normal": 3, "Low": 1}
+
+    priority = workflow_app.next_priority(["High", "Normal", "Low"], workflow_app.PRIORITY_MODE_WEIGHTED, WEIGHTS, credits)
+
+    assert priority == "Normal"
+    assert credits == {"High": 2, "Normal": -4, "Low": 2}
+
+
+def test_weighted_round_robin_ties_go_to_higher_priority(workflow_app):
+    credits = {"High": 0, "Normal": 0, "Low": 0}
+
+    priority = workflow_app.next_priority(["Normal", "Low"], workflow_app.PRIORITY_MODE_WEIGHTED, {"Normal": 1, "Low": 1}, credits)
+
+    assert priority == "Normal"
+
+
+def test_strict_priority(workflow_app):
+    credits = {"High": 0, "Normal": 5, "Low": 9}
+
+    assert workflow_app.next_priority(["High", "Normal", "Low"], workflow_app.PRIORITY_MODE_STRICT, WEIGHTS, credits) == "High"
+    assert workflow_app.next_priority(["Normal", "Low"], workflow_app.PRIORITY_MODE_STRICT, WEIGHTS, credits) == "Normal"
+    assert credits == {"High": 0, "Normal": 5, "Low": 9}
+
+
+class DynamoClientStub:
+    def delete_item(self, **kwargs):
+        pass
+
+
+@pytest.fixture
+def scheduler(workflow_app, monkeypatch):
+    """
+    Run the workflow scheduler over scripted queues.  Each queue returns its batches, given as the number
+    of workflow executions received, then is empty.
+    """
+    state = {"Running": 0, "Batches": {}, "Drawn": [], "Saved": None, "Credits": {}}
+    urls = dict((url, priority) for priority, url in workflow_app.PRIORITY_QUEUE_URLS.items())
+
+    def schedule_workflow_executions(queue_url, capacity, MaxConcurrentWorkflows, MaxConcurrentOperations, tenants, running, queued):
+        priority = urls[queue_url]
+        state["Drawn"].append(priority)
+        batches = state["Batches"][priority]
+        received = batches.pop(0) if batches else 0
+        state["Running"] += received
+        return {"Received": received, "Deferred": 0, "WaitSeconds": [1] * received, "Full": False}
+
+    def save_queue_statistics(statistics, credits):
+        state["Saved"] = dict(credits)
+
+    monkeypatch.setattr(workflow_app, "DYNAMO_CLIENT", DynamoClientStub())
+    monkeypatch.setattr(workflow_app, "get_max_concurrent_workflows", lambda: 12)
+    monkeypatch.setattr(workflow_app, "get_adaptive_concurrency_limit", lambda ceiling: ceiling)
+    monkeypatch.setattr(workflow_app, "get_max_concurrent_operations", lambda: {})
+    monkeypatch.setattr(workflow_app, "get_tenant_configuration", lambda: {})
+    monkeypatch.setattr(workflow_app, "get_tenant_counters", lambda tenants: ({}, {"High": {}, "Normal": {}, "Low": {}}))
+    monkeypatch.setattr(workflow_app, "get_priority_scheduling", lambda: (workflow_app.PRIORITY_MODE_WEIGHTED, dict(WEIGHTS)))
+    monkeypatch.setattr(workflow_app, "get_priority_credits", lambda: dict(state["Credits"]))
+    monkeypatch.setattr(workflow_app, "get_priority_queue_depths", lambda priorities: dict((p, {"Depth": 0, "NotVisible": 0}) for p in priorities))
+    monkeypatch.setattr(workflow_app, "get_system_counter", lambda name: state["Running"])
+    monkeypatch.setattr(workflow_app, "schedule_workflow_executions", schedule_workflow_executions)
+    monkeypatch.setattr(workflow_app, "save_queue_statistics", save_queue_statistics)
+    return state
+
+
+def test_scheduler_resets_credit_of_empty_queue(workflow_app, scheduler):
+    scheduler["Credits"] = {"High": 4, "Normal": 0, "Low": 0}
+    scheduler["Batches"] = {"High": [], "Normal": [5, 4], "Low": [3, 3]}
+
+    workflow_app.workflow_scheduler_lambda({}, None)
+
+    # High had the most credit but nothing queued, then Normal and Low share the slots by weight until
+    # the 12 slots are taken
+    assert scheduler["Drawn"] == ["High", "Normal", "Normal", "Normal", "Low"]
+    assert scheduler["Running"] == 12
+    # The empty queues don't keep the credit they built up, Low keeps what it is owed
+    assert scheduler["Saved"] == {"High": 0, "Normal": 0, "Low": 4}
@@ -0,0 +1,116 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import pytest
+
+
+def queued(normal=None, high=None, low=None):
+    return {"High": high or {}, "Normal": normal or {}, "Low": low or {}}
+
+
+@pytest.fixture
+def normal_queue(workflow_app):
+    return workflow_app.PRIORITY_QUEUE_URLS["Normal"]
+
+
+def test_tenant_alone_is_not_over_share(workflow_app, normal_queue):
+    assert not workflow_app.tenant_over_fair_share("a", normal_queue, 10, {}, {"a": 9}, queued(normal={"a": 20}))
+
+
+def test_equal_tenants(workflow_app, normal_queue):
+    # a holds its share of 5 slots while b waits with fewer
+    assert workflow_app.tenant_over_fair_share("a", normal_queue, 10, {}, {"a": 5, "b": 2}, queued(normal={"b": 3}))
+    assert not workflow_app.tenant_over_fair_share("a", normal_queue, 10, {}, {"a": 4, "b": 2}, queued(normal={"b": 3}))
+    # b has nothing waiting
+    assert not workflow_app.tenant_over_fair_share("a", normal_queue, 10, {}, {"a": 8, "b": 2}, queued())
+    # b already holds its share
+    assert not workflow_app.tenant_over_fair_share("a", normal_queue, 10, {}, {"a": 5, "b": 5}, queued(normal={"b": 3}))
+
+
+def test_only_tenants_waiting_on_the_same_queue_count(workflow_app, normal_queue):
+    assert not workflow_app.tenant_over_fair_share("a", normal_queue, 10, {}, {"a": 8}, queued(low={"b": 3}))
+
+
+def test_priorities_sharing_a_queue(workflow_app, normal_queue, monkeypatch):
+    # Without a high priority queue, High priority workflows wait on the Normal queue
+    monkeypatch.setitem(workflow_app.PRIORITY_QUEUE_URLS, "High", normal_queue)
+
+    assert workflow_app.tenant_over_fair_share("a", normal_queue, 10, {}, {"a": 8}, queued(high={"b": 1}))
+
+
+def test_idle_tenants_have_no_share(workflow_app, normal_queue):
+    # c neither runs nor waits, so a and b split the slots
+    assert not workflow_app.tenant_over_fair_share("a", normal_queue, 9, {}, {"a": 4, "b": 1, "c": 0}, queued(normal={"b": 2, "c": 0}))
+    assert workflow_app.tenant_over_fair_share("a", normal_queue, 9, {}, {"a": 5, "b": 1, "c": 0}, queued(normal={"b": 2, "c": 0}))
+
+
+def test_weighted_tenants(workflow_app, normal_queue):
+    tenants = {"a": {"Weight": 3}, "b": {"Weight": 1}}
+
+    # a is owed 7.5 of 10 slots and b 2.5
+    assert not workflow_app.tenant_over_fair_share("a", normal_queue, 10, tenants, {"a": 7, "b": 1}, queued(normal={"b": 4}))
+    assert workflow_app.tenant_over_fair_share("a", normal_queue, 10, tenants, {"a": 8, "b": 1}, queued(normal={"b": 4}))
+    assert workflow_app.tenant_over_fair_share("b", normal_queue, 10, tenants, {"a": 5, "b": 3}, queued(normal={"a": 4}))
+
+
+def test_tenant_limit_caps_share(workflow_app, normal_queue):
+    # b can't use more than one slot, so it isn't owed the slots a holds
+    tenants = {"b": {"Weight": 1, "MaxConcurrentWorkflows": 1}}
+
+    assert not workflow_app.tenant_over_fair_share("a", normal_queue, 10, tenants, {"a": 9, "b": 1}, queued(normal={"b": 4}))
+    assert workflow_app.tenant_over_fair_share("a", normal_queue, 10, tenants, {"a": 9, "b": 0}, queued(normal={"b": 4}))
+
+
+def workflow_execution(stages, tenant=None):
+    workflow_execution = {"Id": "workflow-execution-1", "Workflow": {"Stages": stages}}
+    if tenant is not None:
+        workflow_execution["Tenant"] = tenant
+    return workflow_execution
+
+
+def test_slot_limits_default_tenant(workflow_app):
+    limits = workflow_app.workflow_slot_limits(workflow_execution({"Preprocess": {"Configuration": {}}}), 10, {}, {})
+
+    assert limits == {
+        workflow_app.RUNNING_WORKFLOWS_COUNTER: 10,
+        workflow_app.RUNNING_TENANT_COUNTER_PREFIX + workflow_app.DEFAULT_TENANT: 10
+    }
+
+
+def test_slot_limits_tenant_limit(workflow_app):
+    tenants = {"a": {"Weight": 2, "MaxConcurrentWorkflows": 3}, "b": {"Weight": 1}}
+
+    limits = workflow_app.workflow_slot_limits(workflow_execution({}, tenant="a"), 10, {}, tenants)
+    assert limits[workflow_app.RUNNING_TENANT_COUNTER_PREFIX + "a"] == 3
+
+    # Tenants without a limit of their own can use all the slots
+    limits = workflow_app.workflow_slot_limits(workflow_execution({}, tenant="b"), 10, {}, tenants)
+    assert limits[workflow_app.RUNNING_TENANT_COUNTER_PREFIX + "b"] == 10
+
+
+def test_slot_limits_enabled_operations(workflow_app):
+    stages = {
+        "Analyze": {
+            "Configuration": {
+                "Transcribe": {"MediaType": "Audio", "Enabled": True},
+                "Translate": {"MediaType": "Text", "Enabled": False}
+            }
+        },
+        "Detect": {
+            "Configuration": {
+                "LabelDetection": {"MediaType": "Video"},
+                "Thumbnail": {"MediaType": "Video", "Enabled": True}
+            }
+        }
+    }
+    MaxConcurrentOperations = {"Transcribe": 2, "Translate": 1, "LabelDetection": 4, "Polly": 1}
+
+    limits = workflow_app.workflow_slot_limits(workflow_execution(stages), 10, MaxConcurrentOperations, {})
+
+    # Disabled operations, operations without a limit and operations of other workflows don't need a slot
+    assert limits == {
+        workflow_app.RUNNING_WORKFLOWS_COUNTER: 10,
+        workflow_app.RUNNING_TENANT_COUNTER_PREFIX + workflow_app.DEFAULT_TENANT: 10,
+        workflow_app.OPERATION_COUNTER_PREFIX + "Transcribe": 2,
+        workflow_app.OPERATION_COUNTER_PREFIX + "LabelDetection": 4
+    }
@@ -0,0 +1,240 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import pytest
+from datetime import datetime, timezone
+from decimal import Decimal
+
+
+def stage_metrics(start, end, operations, queued=None):
+    metrics = {
+        "StartTime": Decimal(str(start)),
+        "EndTime": Decimal(str(end)),
+        "Operations": {
+            name: {"StartTime": Decimal(str(op_start)), "EndTime": Decimal(str(op_end)), "MonitorPolls": Decimal(polls)}
+            for name, (op_start, op_end, polls) in operations.items()
+        }
+    }
+    if queued is not None:
+        metrics["QueuedTime"] = Decimal(str(queued))
+    return metrics
+
+
+def segments(metrics):
+    return [(segment["Segment"], segment.get("Stage"), segment.get("Operation"), segment["DurationSeconds"])
+            for segment in metrics["CriticalPath"]]
+
+
+def test_linear_workflow_metrics(workflowapi_app):
+    workflow_execution = {
+        "Id": "workflow-execution-1",
+        "Status": "Complete",
+        "Created": Decimal("1000"),
+        "Workflow": {
+            "StartAt": "Preprocess",
+            "Stages": {
+                "Preprocess": {
+                    "Status": "Complete",
+                    "Next": "Analyze",
+                    "Metrics": stage_metrics(1005, 1020, {"Thumbnail": (1006, 1018, 0)}, queued=1001)
+                },
+                "Analyze": {
+                    "Status": "Complete",
+                    "End": True,
+                    "Metrics": stage_metrics(1021, 1050, {"Transcribe": (1022, 1045, 4), "Translate": (1022, 1030, 0)})
+                }
+            }
+        }
+    }
+
+    metrics = workflowapi_app.workflow_execution_metrics(workflow_execution)
+
+    assert metrics["QueueWaitSeconds"] == 4
+    assert metrics["DurationSeconds"] == 50
+    assert [stage["Name"] for stage in metrics["Stages"]] == ["Preprocess", "Analyze"]
+    assert metrics["Stages"][1]["DurationSeconds"] == 29
+    assert [op["Name"] for op in metrics["Stages"][1]["Operations"]] == ["Transcribe", "Translate"]
+    assert metrics["Stages"][1]["Operations"][0]["MonitorPolls"] == 4
+    assert all("QueuedTime" not in stage for stage in metrics["Stages"])
+
+    assert segments(metrics) == [
+        ("Queue", None, None, 4),
+        ("Operation", "Preprocess", "Thumbnail", 13),
+        ("StageOverhead", "Preprocess", None, 2),
+        ("StageOverhead", "Analyze", None, 1),
+        ("Operation", "Analyze", "Transcribe", 24),
+        ("StageOverhead", "Analyze", None, 5)
+    ]
+    # The critical path accounts for all the time after the workflow execution was queued
+    assert sum(segment["DurationSeconds"] for segment in metrics["CriticalPath"]) == metrics["DurationSeconds"] - 1
+    assert metrics["DominantOperation"]["Operation"] == "Transcribe"
+    assert metrics["DominantOperation"]["Share"] == 0.48
+
+
+def test_parallel_workflow_metrics(workflowapi_app):
+    workflow_execution = {
+        "Id": "workflow-execution-2",
+        "Status": "Started",
+        "Created": Decimal("2000"),
+        "Workflow": {
+            "Stages": {
+                "Preprocess": {
+                    "Status": "Complete",
+                    "Metrics": stage_metrics(2002, 2010, {"Thumbnail": (2003, 2009, 0)})
+                },
+                "Video": {
+                    "Status": "Complete",
+                    "DependsOn": ["Preprocess"],
+                    "Metrics": stage_metrics(2011, 2060, {"LabelDetection": (2012, 2058, 7)})
+                },
+                "Audio": {
+                    "Status": "Complete",
+                    "DependsOn": ["Preprocess"],
+                    "Metrics": stage_metrics(2011, 2030, {"Transcribe": (2012, 2029, 2)})
+                },
+                "Merge": {
+                    "Status": "Complete",
+                    "DependsOn": ["Video", "Audio"],
+                    "Metrics": stage_metrics(2062, 2070, {})
+                },
+                "Notify": {
+                    "Status": "Not Started",
+                    "DependsOn": ["Merge"]
+                }
+            }
+        }
+    }
+
+    metrics = workflowapi_app.workflow_execution_metrics(workflow_execution)
+
+    assert metrics["QueueWaitSeconds"] == 2
+    assert metrics["DurationSeconds"] == 70
+    # Started stages in start order, then the stages that haven't started
+    assert [stage["Name"] for stage in metrics["Stages"]] == ["Preprocess", "Video", "Audio", "Merge", "Notify"]
+    assert "StartTime" not in metrics["Stages"][-1]
+
+    # The critical path goes through the parallel stage that ended last
+    assert segments(metrics) == [
+        ("Queue", None, None, 2),
+        ("Operation", "Preprocess", "Thumbnail", 7),
+        ("StageOverhead", "Preprocess", None, 1),
+        ("StageOverhead", "Video", None, 1),
+        ("Operation", "Video", "LabelDetection", 47),
+        ("StageOverhead", "Video", None, 2),
+        ("StageOverhead", "Merge", None, 2),
+        ("StageOverhead", "Merge", None, 8)
+    ]
+    assert sum(segment["DurationSeconds"] for segment in metrics["CriticalPath"]) == metrics["DurationSeconds"]
+    assert metrics["DominantOperation"]["Stage"] == "Video"
+    assert metrics["DominantOperation"]["Operation"] == "LabelDetection"
+
+
+def test_not_started_workflow_metrics(workflowapi_app, monkeypatch):
+    monkeypatch.setattr(workflowapi_app.time, "time", lambda: 3030.0)
+    workflow_execution = {
+        "Id": "workflow-execution-3",
+        "Status": "Queued",
+        "Created": Decimal("3000"),
+        "Workflow": {
+            "Stages": {
+                "Preprocess": {"Status": "Not Started"}
+            }
+        }
+    }
+
+    metrics = workflowapi_app.workflow_execution_metrics(workflow_execution)
+
+    assert metrics["QueueWaitSeconds"] is None
+    assert metrics["DurationSeconds"] == 30
+    assert metrics["CriticalPath"] == []
+    assert metrics["DominantOperation"] is None
+
+
+class ExecutionHistoryPaginator:
+    def __init__(self, events, page_size):
+        self.events = events
+        self.page_size = page_size
+        self.calls = []
+
+    def paginate(self, executionArn, reverseOrder=False):
+        self.calls.append({"executionArn": executionArn, "reverseOrder": reverseOrder})
+        events = list(reversed(self.events)) if reverseOrder else self.events
+        for i in range(0, len(events), self.page_size):
+            yield {"events": events[i:i + self.page_size]}
+
+
+class StepFunctionsStub:
+    def __init__(self, paginator):
+        self.paginator = paginator
+
+    def get_paginator(self, name):
+        assert name == "get_execution_history"
+        return self.paginator
+
+
+def history(states):
+    # Build state entered and exited events from (timestamp, entered, name) tuples
+    events = []
+    for event_id, (timestamp, entered, name) in enumerate(states, 1):
+        event = {"id": event_id, "timestamp": datetime.fromtimestamp(timestamp, tz=timezone.utc)}
+        if entered:
+            event["stateEnteredEventDetails"] = {"name": name}
+        else:
+            event["stateExitedEventDetails"] = {"name": name}
+        events.append(event)
+    return events
+
+
+def operation_states(operation, stage, start, polls):
+    # The states of an async operation that polls its monitor lambda polls times, one second apart
+    suffix = " ({})".format(stage)
+    states = []
+    t = start
+    for name in ["Filter {} Media Type?", "Start {}", "Skip {}?", "Execute {}", "{} Expected Duration?"]:
+        states.append((t, True, name.format(operation) + suffix))
+        states.append((t, False, name.format(operation) + suffix))
+    for poll in range(polls):
+        # The first poll uses the first step, the later polls the second step, which repeats
+        step = "" if poll == 0 else " 2"
+        t += 1
+        for name in ["{} Wait", "Get {} Status", "Did {} Complete"]:
+            states.append((t, True, name.format(operation) + step + suffix))
+            states.append((t, False, name.format(operation) + step + suffix))
+    t += 1
+    states.append((t, True, "{} Succeeded".format(operation) + suffix))
+    states.append((t, False, "{} Succeeded".format(operation) + suffix))
+    return states
+
+
+def test_stage_operation_metrics(workflow_app, monkeypatch):
+    states = [(100, True, "Preprocess")]
+    states += operation_states("Transcribe", "Preprocess", 101, 5)
+    states += [(120, False, "Preprocess"), (121, True, "Analyze")]
+    states += operation_states("Transcribe", "Analyze", 122, 3)
+    states += operation_states("Translate", "Analyze", 123, 1)
+    states += [(130, False, "Analyze")]
+    paginator = ExecutionHistoryPaginator(history(states), page_size=7)
+    monkeypatch.setattr(workflow_app, "SFN_CLIENT", StepFunctionsStub(paginator))
+
+    stage = {"Configuration": {"Transcribe": {"Enabled": True}, "Translate": {"Enabled": True}}}
+    metrics = workflow_app.get_stage_operation_metrics("arn:aws:states:us-east-1:123456789012:execution:mie:1", "Analyze", stage)
+
+    assert paginator.calls == [{"executionArn": "arn:aws:states:us-east-1:123456789012:execution:mie:1", "reverseOrder": True}]
+    assert metrics == {
+        "Transcribe": {"StartTime": Decimal("122.000"), "EndTime": Decimal("126.000"), "MonitorPolls": 3},
+        "Translate": {"StartTime": Decimal("123.000"), "EndTime": Decimal("125.000"), "MonitorPolls": 1}
+    }
+
+
+def test_stage_operation_metrics_ignore_other_operations(workflow_app, monkeypatch):
+    # The states of an operation whose name starts with the name of another operation are not counted for it
+    states = [(200, True, "Analyze")]
+    states += operation_states("Label", "Analyze", 201, 2)
+    states += operation_states("Label Status", "Analyze", 201, 4)
+    states += [(220, False, "Analyze")]
+    monkeypatch.setattr(workflow_app, "SFN_CLIENT", StepFunctionsStub(ExecutionHistoryPaginator(history(states), page_size=100)))
+
+    stage = {"Configuration": {"Label": {"Enabled": True}}}
+    metrics = workflow_app.get_stage_operation_metrics("arn", "Analyze", stage)
+
+    assert metrics == {"Label": {"StartTime": Decimal("201.000"), "EndTime": Decimal("204.000"), "MonitorPolls": 2}}
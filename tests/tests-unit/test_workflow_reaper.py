@@ -0,0 +1,149 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import pytest
+from stubs import DynamoClientStub, StepFunctionsClientStub
+
+NOW = 1600000000
+ARN = "arn:aws:states:us-east-1:123456789012:execution:mie-workflow:{}"
+
+
+def execution_item(id, status, arn=None):
+    item = {"Id": {"S": id}, "Status": {"S": status}}
+    if arn is not None:
+        item["StateMachineExecutionArn"] = {"S": arn}
+    return item
+
+
+@pytest.fixture
+def clients(workflow_app, monkeypatch):
+    dynamo = DynamoClientStub({workflow_app.WORKFLOW_EXECUTION_TABLE_NAME: [], workflow_app.SYSTEM_TABLE_NAME: []})
+    sfn = StepFunctionsClientStub({})
+    monkeypatch.setattr(workflow_app, "DYNAMO_CLIENT", dynamo)
+    monkeypatch.setattr(workflow_app, "SFN_CLIENT", sfn)
+    monkeypatch.setattr(workflow_app.time, "time", lambda: float(NOW))
+    return dynamo, sfn
+
+
+def started_execution(workflow_app, clients, id, state_machine_status=None, **details):
+    dynamo, sfn = clients
+    arn = ARN.format(id)
+    dynamo.tables[workflow_app.WORKFLOW_EXECUTION_TABLE_NAME].append(execution_item(id, "Started", arn))
+    if state_machine_status is not None:
+        sfn.executions[arn] = dict(details, status=state_machine_status)
+    return {"Id": id, "StateMachineExecutionArn": arn}
+
+
+def stored_status(workflow_app, clients, id):
+    dynamo, sfn = clients
+    item = dynamo.find(workflow_app.WORKFLOW_EXECUTION_TABLE_NAME, {"Id": {"S": id}})
+    return item["Status"]["S"], item.get("Message", {}).get("S")
+
+
+def test_reap_running_execution(workflow_app, clients):
+    workflow_execution = started_execution(workflow_app, clients, "running", "RUNNING")
+
+    assert workflow_app.reap_workflow_execution(workflow_execution) is None
+    assert stored_status(workflow_app, clients, "running") == ("Started", None)
+
+
+def test_reap_timed_out_execution(workflow_app, clients):
+    workflow_execution = started_execution(workflow_app, clients, "timed-out", "TIMED_OUT")
+
+    assert workflow_app.reap_workflow_execution(workflow_execution) == "Timed Out"
+    assert stored_status(workflow_app, clients, "timed-out") == ("Timed Out", "The state machine timed out")
+
+
+def test_reap_failed_execution(workflow_app, clients):
+    workflow_execution = started_execution(workflow_app, clients, "failed", "FAILED", error="States.Runtime", cause="Invalid path")
+
+    assert workflow_app.reap_workflow_execution(workflow_execution) == "Error"
+    status, message = stored_status(workflow_app, clients, "failed")
+    assert status == "Error"
+    assert message == "The state machine ended with status FAILED without completing the workflow execution: States.Runtime Invalid path"
+
+
+def test_reap_expired_execution(workflow_app, clients):
+    # The state machine execution history is gone
+    workflow_execution = started_execution(workflow_app, clients, "expired")
+
+    assert workflow_app.reap_workflow_execution(workflow_execution) == "Error"
+    status, message = stored_status(workflow_app, clients, "expired")
+    assert status == "Error"
+    assert "DOES_NOT_EXIST" in message
+
+
+def test_reap_execution_that_changed_status(workflow_app, clients):
+    dynamo, sfn = clients
+    workflow_execution = started_execution(workflow_app, clients, "completed", "SUCCEEDED")
+    # The complete stage lambda ended the workflow execution after the reaper listed it
+    dynamo.find(workflow_app.WORKFLOW_EXECUTION_TABLE_NAME, {"Id": {"S": "completed"}})["Status"] = {"S": "Complete"}
+
+    assert workflow_app.reap_workflow_execution(workflow_execution) is None
+    assert stored_status(workflow_app, clients, "completed") == ("Complete", None)
+
+
+def test_reap_resumed_execution(workflow_app, clients):
+    dynamo, sfn = clients
+    workflow_execution = started_execution(workflow_app, clients, "resumed", "FAILED")
+    # The workflow execution was resumed and runs on a new state machine execution
+    dynamo.find(workflow_app.WORKFLOW_EXECUTION_TABLE_NAME, {"Id": {"S": "resumed"}})["StateMachineExecutionArn"] = {"S": ARN.format("resumed-1")}
+
+    assert workflow_app.reap_workflow_execution(workflow_execution) is None
+    assert stored_status(workflow_app, clients, "resumed") == ("Started", None)
+
+
+def slot_item(workflow_app, id, acquired=None):
+    item = {"Name": {"S": workflow_app.WORKFLOW_SLOT_PREFIX + id}}
+    if acquired is not None:
+        item["Acquired"] = {"N": str(acquired)}
+    return item
+
+
+def test_unreleased_workflow_slots(workflow_app, clients):
+    dynamo, sfn = clients
+    timeout = workflow_app.WORKFLOW_START_TIMEOUT_SECONDS
+    dynamo.page_size = 3
+    dynamo.unprocessed = 2
+    dynamo.tables[workflow_app.SYSTEM_TABLE_NAME] = [
+        {"Name": {"S": workflow_app.RUNNING_WORKFLOWS_COUNTER}, "Value": {"N": "7"}},
+        slot_item(workflow_app, "started", NOW - 2 * timeout),
+        slot_item(workflow_app, "queued", NOW - 60),
+        slot_item(workflow_app, "stalled", NOW - timeout - 1),
+        slot_item(workflow_app, "queued-before-leases-were-timed"),
+        slot_item(workflow_app, "complete", NOW - 60),
+        slot_item(workflow_app, "cancelled", NOW - 60),
+        slot_item(workflow_app, "deleted", NOW - 60)
+    ]
+    dynamo.tables[workflow_app.WORKFLOW_EXECUTION_TABLE_NAME] = [
+        execution_item("started", "Started"),
+        execution_item("queued", "Queued"),
+        execution_item("stalled", "Queued"),
+        execution_item("queued-before-leases-were-timed", "Queued"),
+        execution_item("complete", "Complete"),
+        execution_item("cancelled", "Cancelled"),
+        execution_item("unrelated", "Error")
+    ]
+
+    orphaned, stalled = workflow_app.get_unreleased_workflow_slots()
+
+    # Slots of workflow executions that ended, or were deleted, are orphaned
+    assert sorted(orphaned) == ["cancelled", "complete", "deleted"]
+    # Only workflow executions still queued well after they took their slot are stalled
+    assert stalled == ["stalled"]
+
+
+def test_fail_stalled_workflow_execution(workflow_app, clients, monkeypatch):
+    dynamo, sfn = clients
+    released = []
+    monkeypatch.setattr(workflow_app, "release_workflow_slot", lambda id: released.append(id))
+    dynamo.tables[workflow_app.WORKFLOW_EXECUTION_TABLE_NAME] = [execution_item("stalled", "Queued"), execution_item("started", "Started")]
+
+    assert workflow_app.fail_stalled_workflow_execution("stalled")
+    assert stored_status(workflow_app, clients, "stalled")[0] == "Error"
+
+    # The workflow execution started after its status was read
+    assert not workflow_app.fail_stalled_workflow_execution("started")
+    assert stored_status(workflow_app, clients, "started") == ("Started", None)
+
+    assert released == ["stalled"]
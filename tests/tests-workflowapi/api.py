@@ -121,10 +121,8 @@ def delete_operation_workflow_request(workflow, stack_resources):
     return delete_workflow_response
 
 
-def create_workflow_execution_request(workflow, config, stack_resources):
-    
-    headers = {"Content-Type": "application/json", "Authorization": token}
-    
+def workflow_execution_body(workflow, config):
+
     body = {
         "Name": workflow["Name"],
         "Input": {
@@ -138,6 +136,9 @@ def create_workflow_execution_request(workflow, config, stack_resources):
     if "WorkflowConfiguration" in config:
         body["Configuration"] = config["WorkflowConfiguration"]
 
+    if "IdempotencyKey" in config:
+        body["IdempotencyKey"] = config["IdempotencyKey"]
+
     if config["Input"] == "Video":
         body["Input"]["Media"]["Video"] = {}
         body["Input"]["Media"]["Video"]["S3Bucket"] = BUCKET_NAME
@@ -155,6 +156,15 @@ def create_workflow_execution_request(workflow, config, stack_resources):
         body["Input"]["Media"]["Text"]["S3Bucket"] = BUCKET_NAME
         body["Input"]["Media"]["Text"]["S3Key"] = TEXT_FILENAME
 
+    return body
+
+
+def create_workflow_execution_request(workflow, config, stack_resources):
+    
+    headers = {"Content-Type": "application/json", "Authorization": token}
+    
+    body = workflow_execution_body(workflow, config)
+
     print ("POST /workflow/execution {}".format(json.dumps(body)))
     
     create_workflow_execution_response = requests.post(stack_resources["WorkflowApiEndpoint"]+'/workflow/execution', headers=headers, json=body, verify=False)
@@ -162,6 +172,20 @@ def create_workflow_execution_request(workflow, config, stack_resources):
     return create_workflow_execution_response
 
 
+def create_workflow_executions_request(bodies, stack_resources):
+
+    headers = {"Content-Type": "application/json", "Authorization": token}
+    body = {
+        "Executions": bodies
+    }
+
+    print ("POST /workflow/execution/batch {}".format(json.dumps(body)))
+
+    create_workflow_executions_response = requests.post(stack_resources["WorkflowApiEndpoint"]+'/workflow/execution/batch', headers=headers, json=body, verify=False)
+
+    return create_workflow_executions_response
+
+
 def wait_for_workflow_execution(workflow_execution, stack_resources, wait_seconds):
     headers = {"Authorization": token}
     # disable unsigned HTTPS certificate warnings
@@ -187,6 +211,42 @@ def wait_for_workflow_execution(workflow_execution, stack_resources, wait_second
     return workflow_execution
 
 
+def get_workflow_execution_request(workflow_execution, stack_resources):
+    headers = {"Authorization": token}
+
+    get_workflow_execution_response = requests.get(stack_resources["WorkflowApiEndpoint"]+'/workflow/execution/'+workflow_execution["Id"], verify=False, headers=headers)
+
+    return get_workflow_execution_response
+
+
+def resume_workflow_execution_request(workflow_execution, stack_resources):
+    headers = {"Authorization": token}
+
+    print ("POST /workflow/execution/{}/resume".format(workflow_execution["Id"]))
+    resume_workflow_execution_response = requests.post(stack_resources["WorkflowApiEndpoint"]+'/workflow/execution/'+workflow_execution["Id"]+'/resume', verify=False, headers=headers)
+
+    return resume_workflow_execution_response
+
+
+def cancel_workflow_execution_request(workflow_execution, stack_resources):
+    headers = {"Authorization": token}
+
+    print ("POST /workflow/execution/{}/cancel".format(workflow_execution["Id"]))
+    cancel_workflow_execution_response = requests.post(stack_resources["WorkflowApiEndpoint"]+'/workflow/execution/'+workflow_execution["Id"]+'/cancel', verify=False, headers=headers)
+
+    return cancel_workflow_execution_response
+
+
+def get_running_workflows(stack_resources):
+    get_configuration_response = get_configuration_request(stack_resources)
+    assert get_configuration_response.status_code == 200
+
+    configuration = get_configuration_response.json()
+    running_workflows = [item["Value"] for item in configuration if item["Name"] == "RunningWorkflows"]
+
+    return int(running_workflows[0]) if running_workflows else 0
+
+
 def create_stage_request(config, stack_resources):
     
     headers = {"Content-Type": "application/json", "Authorization": token}
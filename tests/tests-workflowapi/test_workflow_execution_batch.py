@@ -0,0 +1,91 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+###############################################################################
+# Integration testing for the MIE workflow API
+#
+# PRECONDITIONS:
+# MIE base stack must be deployed in your AWS account
+#
+# Boto3 will raise a deprecation warning (known issue). It's safe to ignore.
+#
+# USAGE:
+#   cd tests/
+#   pytest -s -W ignore::DeprecationWarning -p no:cacheprovider
+#
+###############################################################################
+
+import pytest
+import boto3
+import json
+import time
+import math
+import requests
+import urllib3
+import logging
+from botocore.exceptions import ClientError
+import re
+import os
+from jsonschema import validate
+
+# local imports
+import api 
+import validation
+
+REGION = os.environ['REGION']
+BUCKET_NAME = os.environ['BUCKET_NAME']
+MIE_STACK_NAME = os.environ['MIE_STACK_NAME']
+VIDEO_FILENAME = os.environ['VIDEO_FILENAME']
+IMAGE_FILENAME = os.environ['IMAGE_FILENAME']
+AUDIO_FILENAME = os.environ['AUDIO_FILENAME']
+TEXT_FILENAME = os.environ['TEXT_FILENAME']
+token = os.environ["MIE_ACCESS_TOKEN"]
+
+
+def test_create_workflow_executions(stages, stack_resources, api_schema):
+
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+    print("Test bulk workflow execution submission")
+
+    stage = {}
+    stage["Name"] = "no-op-s"
+    config = next(item for item in stages if item["Name"] == "no-op-s")
+
+    create_workflow_response = api.create_stage_workflow_request(stage, stack_resources)
+    workflow = create_workflow_response.json()
+    assert create_workflow_response.status_code == 200
+
+    print("An empty batch is rejected")
+    create_workflow_executions_response = api.create_workflow_executions_request([], stack_resources)
+    assert create_workflow_executions_response.status_code == 400
+
+    body = api.workflow_execution_body(workflow, config)
+    idempotent_body = dict(body)
+    idempotent_body["IdempotencyKey"] = "batch-test"
+    sync_body = dict(body)
+    sync_body["Async"] = False
+
+    create_workflow_executions_response = api.create_workflow_executions_request([body, body, idempotent_body, sync_body], stack_resources)
+    assert create_workflow_executions_response.status_code == 200
+    results = create_workflow_executions_response.json()["Executions"]
+    assert len(results) == 4
+
+    print("The valid requests are queued")
+    for result in results[:2]:
+        assert "Error" not in result
+        assert result["Status"] == "Queued"
+    assert results[0]["Id"] != results[1]["Id"]
+
+    print("IdempotencyKey and Async false are rejected per request")
+    for result in results[2:]:
+        assert "Error" in result
+        assert "Id" not in result
+
+    for result in results[:2]:
+        workflow_execution = api.wait_for_workflow_execution(result, stack_resources, 120)
+        assert workflow_execution["Status"] == "Complete"
+        assert workflow_execution["AssetId"] is not None
+
+    delete_workflow_response = api.delete_stage_workflow_request(workflow, stack_resources)
+    assert delete_workflow_response.status_code == 200
@@ -0,0 +1,103 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+###############################################################################
+# Integration testing for the MIE workflow API
+#
+# PRECONDITIONS:
+# MIE base stack must be deployed in your AWS account
+#
+# Boto3 will raise a deprecation warning (known issue). It's safe to ignore.
+#
+# USAGE:
+#   cd tests/
+#   pytest -s -W ignore::DeprecationWarning -p no:cacheprovider
+#
+###############################################################################
+
+import pytest
+import boto3
+import json
+import time
+import math
+import requests
+import urllib3
+import logging
+from botocore.exceptions import ClientError
+import re
+import os
+from jsonschema import validate
+
+# local imports
+import api 
+import validation
+
+REGION = os.environ['REGION']
+BUCKET_NAME = os.environ['BUCKET_NAME']
+MIE_STACK_NAME = os.environ['MIE_STACK_NAME']
+VIDEO_FILENAME = os.environ['VIDEO_FILENAME']
+IMAGE_FILENAME = os.environ['IMAGE_FILENAME']
+AUDIO_FILENAME = os.environ['AUDIO_FILENAME']
+TEXT_FILENAME = os.environ['TEXT_FILENAME']
+token = os.environ["MIE_ACCESS_TOKEN"]
+
+
+def test_cancel_workflow_execution(stages, stack_resources, api_schema):
+
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+    print("Test cancelling queued and running workflow executions")
+
+    # Only one workflow runs at a time, so the workflow executions after the first wait on the queue
+    set_max_concurrent_response = api.set_max_concurrent_request(stack_resources, 1)
+    assert set_max_concurrent_response.status_code == 200
+    # It can take up to one run of the lambda for a configuration change to take effect
+    time.sleep(20)
+
+    stage = {}
+    stage["Name"] = "2-op-as"
+    config = next(item for item in stages if item["Name"] == "2-op-as")
+
+    create_workflow_response = api.create_stage_workflow_request(stage, stack_resources)
+    workflow = create_workflow_response.json()
+    assert create_workflow_response.status_code == 200
+
+    workflow_executions = []
+    for i in range(3):
+        create_workflow_execution_response = api.create_workflow_execution_request(workflow, config, stack_resources)
+        assert create_workflow_execution_response.status_code == 200
+        workflow_executions.append(create_workflow_execution_response.json())
+    running, queued, last = workflow_executions
+
+    print("Cancel a queued workflow execution")
+    get_workflow_execution_response = api.get_workflow_execution_request(queued, stack_resources)
+    assert get_workflow_execution_response.status_code == 200
+    print("Workflow execution {} has status {}".format(queued["Id"], get_workflow_execution_response.json()["Status"]))
+    cancel_workflow_execution_response = api.cancel_workflow_execution_request(queued, stack_resources)
+    assert cancel_workflow_execution_response.status_code == 200
+    assert cancel_workflow_execution_response.json()["Status"] == "Cancelled"
+
+    print("Cancel the workflow execution holding the only slot")
+    cancel_workflow_execution_response = api.cancel_workflow_execution_request(running, stack_resources)
+    assert cancel_workflow_execution_response.status_code == 200
+    assert cancel_workflow_execution_response.json()["Status"] == "Cancelled"
+
+    # The slots of the cancelled workflow executions were released, so the last one runs
+    last = api.wait_for_workflow_execution(last, stack_resources, 120)
+    assert last["Status"] == "Complete"
+    assert api.get_running_workflows(stack_resources) == 0
+
+    for workflow_execution in [running, queued]:
+        get_workflow_execution_response = api.get_workflow_execution_request(workflow_execution, stack_resources)
+        assert get_workflow_execution_response.status_code == 200
+        assert get_workflow_execution_response.json()["Status"] == "Cancelled"
+
+    print("A workflow execution that ended can't be cancelled")
+    cancel_workflow_execution_response = api.cancel_workflow_execution_request(last, stack_resources)
+    assert cancel_workflow_execution_response.status_code == 409
+
+    delete_workflow_response = api.delete_stage_workflow_request(workflow, stack_resources)
+    assert delete_workflow_response.status_code == 200
+
+    set_max_concurrent_response = api.set_max_concurrent_request(stack_resources, 10)
+    assert set_max_concurrent_response.status_code == 200
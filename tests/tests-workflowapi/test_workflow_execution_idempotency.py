@@ -0,0 +1,83 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+###############################################################################
+# Integration testing for the MIE workflow API
+#
+# PRECONDITIONS:
+# MIE base stack must be deployed in your AWS account
+#
+# Boto3 will raise a deprecation warning (known issue). It's safe to ignore.
+#
+# USAGE:
+#   cd tests/
+#   pytest -s -W ignore::DeprecationWarning -p no:cacheprovider
+#
+###############################################################################
+
+import pytest
+import boto3
+import json
+import time
+import math
+import requests
+import urllib3
+import logging
+from botocore.exceptions import ClientError
+import re
+import os
+import uuid
+from jsonschema import validate
+
+# local imports
+import api 
+import validation
+
+REGION = os.environ['REGION']
+BUCKET_NAME = os.environ['BUCKET_NAME']
+MIE_STACK_NAME = os.environ['MIE_STACK_NAME']
+VIDEO_FILENAME = os.environ['VIDEO_FILENAME']
+IMAGE_FILENAME = os.environ['IMAGE_FILENAME']
+AUDIO_FILENAME = os.environ['AUDIO_FILENAME']
+TEXT_FILENAME = os.environ['TEXT_FILENAME']
+token = os.environ["MIE_ACCESS_TOKEN"]
+
+
+def test_workflow_execution_idempotency(stages, stack_resources, api_schema):
+
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+    print("Test workflow execution submission with an IdempotencyKey")
+
+    stage = {}
+    stage["Name"] = "no-op-s"
+    config = dict(next(item for item in stages if item["Name"] == "no-op-s"))
+    config["IdempotencyKey"] = str(uuid.uuid4())
+
+    # Create a singleton workflow to test executing this stage
+    create_workflow_response = api.create_stage_workflow_request(stage, stack_resources)
+    workflow = create_workflow_response.json()
+    assert create_workflow_response.status_code == 200
+
+    create_workflow_execution_response = api.create_workflow_execution_request(workflow, config, stack_resources)
+    workflow_execution = create_workflow_execution_response.json()
+    assert create_workflow_execution_response.status_code == 200
+    assert workflow_execution['Status'] == 'Queued'
+
+    print("Replaying the request returns the same workflow execution")
+    replay_response = api.create_workflow_execution_request(workflow, config, stack_resources)
+    assert replay_response.status_code == 200
+    assert replay_response.json()["Id"] == workflow_execution["Id"]
+
+    print("Reusing the IdempotencyKey with a different request is rejected")
+    mismatched_config = dict(config)
+    mismatched_config["Input"] = "Video"
+    mismatched_response = api.create_workflow_execution_request(workflow, mismatched_config, stack_resources)
+    assert mismatched_response.status_code == 400
+
+    workflow_execution = api.wait_for_workflow_execution(workflow_execution, stack_resources, 120)
+    assert workflow_execution["Status"] == "Complete"
+
+    # Delete the workflow
+    delete_workflow_response = api.delete_stage_workflow_request(workflow, stack_resources)
+    assert delete_workflow_response.status_code == 200
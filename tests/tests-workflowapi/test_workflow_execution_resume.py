@@ -0,0 +1,153 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+###############################################################################
+# Integration testing for the MIE workflow API
+#
+# PRECONDITIONS:
+# MIE base stack must be deployed in your AWS account
+#
+# Boto3 will raise a deprecation warning (known issue). It's safe to ignore.
+#
+# USAGE:
+#   cd tests/
+#   pytest -s -W ignore::DeprecationWarning -p no:cacheprovider
+#
+###############################################################################
+
+import pytest
+import boto3
+import json
+import time
+import math
+import requests
+import urllib3
+import logging
+from botocore.exceptions import ClientError
+import re
+import os
+from jsonschema import validate
+
+# local imports
+import api 
+import validation
+
+REGION = os.environ['REGION']
+BUCKET_NAME = os.environ['BUCKET_NAME']
+MIE_STACK_NAME = os.environ['MIE_STACK_NAME']
+VIDEO_FILENAME = os.environ['VIDEO_FILENAME']
+IMAGE_FILENAME = os.environ['IMAGE_FILENAME']
+AUDIO_FILENAME = os.environ['AUDIO_FILENAME']
+TEXT_FILENAME = os.environ['TEXT_FILENAME']
+token = os.environ["MIE_ACCESS_TOKEN"]
+
+
+def test_resume_workflow_execution(stages, stack_resources, api_schema):
+
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+    print("Test resuming workflow executions")
+
+    print("A workflow execution that completed can't be resumed")
+    stage = {}
+    stage["Name"] = "no-op-s"
+    config = next(item for item in stages if item["Name"] == "no-op-s")
+
+    create_workflow_response = api.create_stage_workflow_request(stage, stack_resources)
+    workflow = create_workflow_response.json()
+    assert create_workflow_response.status_code == 200
+
+    create_workflow_execution_response = api.create_workflow_execution_request(workflow, config, stack_resources)
+    workflow_execution = create_workflow_execution_response.json()
+    assert create_workflow_execution_response.status_code == 200
+
+    workflow_execution = api.wait_for_workflow_execution(workflow_execution, stack_resources, 120)
+    assert workflow_execution["Status"] == "Complete"
+
+    resume_workflow_execution_response = api.resume_workflow_execution_request(workflow_execution, stack_resources)
+    assert resume_workflow_execution_response.status_code == 409
+
+    delete_workflow_response = api.delete_stage_workflow_request(workflow, stack_resources)
+    assert delete_workflow_response.status_code == 200
+
+    print("A workflow execution that failed is queued again from the failed stage")
+    stage = {}
+    stage["Name"] = "fail-op-2-as"
+    config = next(item for item in stages if item["Name"] == "fail-op-2-as")
+
+    create_workflow_response = api.create_stage_workflow_request(stage, stack_resources)
+    workflow = create_workflow_response.json()
+    assert create_workflow_response.status_code == 200
+
+    create_workflow_execution_response = api.create_workflow_execution_request(workflow, config, stack_resources)
+    workflow_execution = create_workflow_execution_response.json()
+    assert create_workflow_execution_response.status_code == 200
+
+    workflow_execution = api.wait_for_workflow_execution(workflow_execution, stack_resources, 120)
+    assert workflow_execution["Status"] == "Error"
+
+    resume_workflow_execution_response = api.resume_workflow_execution_request(workflow_execution, stack_resources)
+    resumed_workflow_execution = resume_workflow_execution_response.json()
+    assert resume_workflow_execution_response.status_code == 200
+    assert resumed_workflow_execution["Id"] == workflow_execution["Id"]
+    assert resumed_workflow_execution["Status"] == "Queued"
+    assert resumed_workflow_execution["CurrentStage"] == "fail-op-2-as"
+    assert resumed_workflow_execution["ResumeCount"] == 1
+
+    # The stage fails again
+    workflow_execution = api.wait_for_workflow_execution(resumed_workflow_execution, stack_resources, 120)
+    assert workflow_execution["Status"] == "Error"
+
+    delete_workflow_response = api.delete_stage_workflow_request(workflow, stack_resources)
+    assert delete_workflow_response.status_code == 200
+
+
+def test_resume_workflow_execution_keeps_completed_stages(stages, workflow_configs, stack_resources, api_schema):
+
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+    print("Test resuming a workflow execution whose last stage failed")
+    config = next(item for item in workflow_configs if item["Name"] == "last-stage-fail")
+
+    create_workflow_response = api.create_workflow_request(config, stack_resources)
+    workflow = create_workflow_response.json()
+    assert create_workflow_response.status_code == 200
+
+    create_workflow_execution_response = api.create_workflow_execution_request(workflow, config, stack_resources)
+    workflow_execution = create_workflow_execution_response.json()
+    assert create_workflow_execution_response.status_code == 200
+
+    workflow_execution = api.wait_for_workflow_execution(workflow_execution, stack_resources, 240)
+    assert workflow_execution["Status"] == "Error"
+
+    completed_stages = config["Stages"][:-1]
+    failed_stage = config["Stages"][-1]
+    before = workflow_execution["Workflow"]["Stages"]
+    for stage_name in completed_stages:
+        assert before[stage_name]["Status"] == "Complete"
+        assert "Outputs" in before[stage_name]
+
+    # The workflow state machine starts at the failed stage, the completed stages keep their outputs
+    resume_workflow_execution_response = api.resume_workflow_execution_request(workflow_execution, stack_resources)
+    resumed_workflow_execution = resume_workflow_execution_response.json()
+    assert resume_workflow_execution_response.status_code == 200
+    assert resumed_workflow_execution["CurrentStage"] == failed_stage
+    assert resumed_workflow_execution["ResumeCount"] == 1
+    for stage_name in completed_stages:
+        assert resumed_workflow_execution["Workflow"]["Stages"][stage_name]["Outputs"] == before[stage_name]["Outputs"]
+
+    # The failed stage fails again
+    workflow_execution = api.wait_for_workflow_execution(resumed_workflow_execution, stack_resources, 120)
+    assert workflow_execution["Status"] == "Error"
+
+    # The completed stages were not run again
+    after = workflow_execution["Workflow"]["Stages"]
+    for stage_name in completed_stages:
+        assert after[stage_name]["Status"] == "Complete"
+        assert after[stage_name]["Outputs"] == before[stage_name]["Outputs"]
+        assert after[stage_name]["Metrics"]["StartTime"] == before[stage_name]["Metrics"]["StartTime"]
+        assert after[stage_name]["Metrics"]["EndTime"] == before[stage_name]["Metrics"]["EndTime"]
+    assert after[failed_stage]["Metrics"]["StartTime"] > before[failed_stage]["Metrics"]["StartTime"]
+
+    delete_workflow_response = api.delete_stage_workflow_request(workflow, stack_resources)
+    assert delete_workflow_response.status_code == 200